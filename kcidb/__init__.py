@@ -28,7 +28,8 @@ io_schema = io.schema
 class Client:
     """Kernel CI reporting client"""
 
-    def __init__(self, project_id=None, dataset_name=None, topic_name=None):
+    def __init__(self, project_id=None, dataset_name=None, topic_name=None,
+                 result_cache=None, stats_hook=None):
         """
         Initialize a reporting client
 
@@ -44,6 +45,12 @@ class Client:
                             submissions to. The message queue should be
                             located within the specified Google Cloud project.
                             Can be None, to have submitting disabled.
+            result_cache:   A query result cache (kcidb.db.cache.ResultCache)
+                            to serve queries from, or None to not cache
+                            query results.
+            stats_hook:     A function to call with statistics of each
+                            executed database job, or None. See
+                            kcidb.db.Client() for details.
         """
         assert project_id is None or \
             isinstance(project_id, str) and project_id
@@ -52,7 +59,9 @@ class Client:
         assert topic_name is None or \
             isinstance(topic_name, str) and topic_name
         self.db_client = \
-            db.Client(dataset_name, project_id=project_id) if dataset_name \
+            db.Client(dataset_name, project_id=project_id,
+                      result_cache=result_cache,
+                      stats_hook=stats_hook) if dataset_name \
             else None
         self.mq_publisher = \
             mq.Publisher(project_id, topic_name) if project_id and topic_name \
@@ -76,7 +85,9 @@ class Client:
         else:
             raise NotImplementedError
 
-    def query(self, patterns, children=False, parents=False):
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children=False, parents=False,
+              since=None, until=None, filters=None):
         """
         Match and fetch report objects.
 
@@ -87,6 +98,18 @@ class Client:
                         as well.
             parents:    True if parents of matched objects should be matched
                         as well.
+            since:      An "aware" datetime.datetime object specifying the
+                        earliest (inclusive) discovery (revisions) or start
+                        (builds and tests) time of objects to match, or None
+                        for no lower bound.
+            until:      An "aware" datetime.datetime object specifying the
+                        latest (exclusive) discovery (revisions) or start
+                        (builds and tests) time of objects to match, or None
+                        for no upper bound.
+            filters:    A dictionary of object list names, and dictionaries
+                        of their field names and filters the objects should
+                        satisfy to match, or None for no filters. See
+                        kcidb.db.Client.query() for details.
 
         Returns:
             The fetched JSON data adhering to the latest I/O schema version.
@@ -102,7 +125,9 @@ class Client:
                    all(isinstance(e, str) for e in v)
                    for k, v in patterns.items())
         if self.db_client:
-            data = self.db_client.query(patterns, children, parents)
+            data = self.db_client.query(patterns, children, parents,
+                                        since=since, until=until,
+                                        filters=filters)
         else:
             raise NotImplementedError
         assert io.schema.is_valid_latest(data)
@@ -134,14 +159,22 @@ def submit_main():
 def query_main():
     """Execute the kcidb-query command-line tool"""
     args = db.query_main_parse_args(
-        "kcidb-query - Query Kernel CI reports"
+        "kcidb-query - Query Kernel CI reports", caching=True
+    )
+    client = Client(
+        project_id=args.project, dataset_name=args.database,
+        result_cache=None if args.no_cache
+        else db.cache.ResultCache.from_env(),
+        stats_hook=db.print_stats if args.stats else None
     )
-    client = Client(project_id=args.project, dataset_name=args.dataset)
     data = client.query(dict(revisions=args.revision_id_patterns,
                              builds=args.build_id_patterns,
                              tests=args.test_id_patterns),
                         parents=args.parents,
-                        children=args.children)
+                        children=args.children,
+                        since=args.since,
+                        until=args.until,
+                        filters=args.filters)
     json.dump(data, sys.stdout, indent=4, sort_keys=True)
 
 
@@ -1,19 +1,23 @@
 """Kernel CI report database"""
+# pylint: disable=too-many-lines
 
 import argparse
+import concurrent.futures
 import decimal
 import json
+import os
 import sys
 import re
-import textwrap
-from datetime import datetime
-from google.cloud import bigquery
-from google.api_core.exceptions import BadRequest
-from google.api_core.exceptions import NotFound
-from kcidb.db import schema
+import uuid
+from datetime import datetime, timezone
+from kcidb.db import schema, misc, arrow, bigquery, sqlite, cache
 from kcidb import io
 
 
+# A regex matching object field filter command-line arguments
+FILTER_ARG_RE = re.compile(r"(\w+)\.(\w+)(=|\^=|>=|<)(.*)", re.DOTALL)
+
+
 class IncompatibleSchema(Exception):
     """Database schema is incompatible with latest I/O schema"""
 
@@ -34,142 +38,192 @@ class IncompatibleSchema(Exception):
 class Client:
     """Kernel CI report database client"""
 
-    _LIKE_PATTERN_ESCAPE_RE = re.compile(r"([%_\\])")
+    escape_like_pattern = staticmethod(misc.escape_like_pattern)
+    get_filter_field = staticmethod(misc.get_filter_field)
+    is_valid_filters = staticmethod(misc.is_valid_filters)
 
-    def __init__(self, dataset_name, project_id=None):
+    # pylint: disable=too-many-arguments
+    def __init__(self, database, project_id=None, obj_cache=None,
+                 result_cache=None, stats_hook=None):
         """
         Initialize a Kernel CI report database client.
 
         Args:
-            dataset_name:   The name of the Kernel CI dataset where data is
-                            located. The dataset should be located within the
-                            specified Google Cloud project.
+            database:       The database specification, one of:
+                            * "bigquery:DATASET", or just "DATASET" - the
+                              BigQuery dataset named DATASET, located
+                              within the specified Google Cloud project,
+                            * "sqlite:PATH" - the SQLite database in the
+                              file at PATH, or a temporary in-memory
+                              database, if PATH is ":memory:". SQLite
+                              databases don't support paging, Arrow
+                              output, aggregation, and rollups, raising
+                              NotImplementedError for them.
             project_id:     ID of the Google Cloud project hosting the
-                            dataset, or None to use the project from the
-                            credentials file point to by
+                            BigQuery dataset, or None to use the project
+                            from the credentials file point to by
                             GOOGLE_APPLICATION_CREDENTIALS environment
-                            variable.
+                            variable. Ignored for other databases.
+            obj_cache:      An object cache (cache.ObjectCache) to serve
+                            complement() from, and to keep updated with
+                            the objects passing through load() and
+                            complement(), or None to not cache objects.
+            result_cache:   A query result cache (cache.ResultCache) to
+                            serve query() from, invalidated by load(), or
+                            None to not cache query results.
+            stats_hook:     A function to call after executing each database
+                            job (statement or load), or None. Called with a
+                            dictionary containing the logical "operation"
+                            (e.g. "query", "dump", "load", or "complement"),
+                            the "table" accessed, the "shape" of the SQL
+                            statement (a short hash of its text, same for
+                            queries differing only in parameters, or None),
+                            the "bytes_processed" and "bytes_billed",
+                            the "slot_millis" consumed, the number of "rows"
+                            returned or loaded (None if unknown), and the
+                            wall-clock "latency" in seconds. Only BigQuery
+                            reports bytes and slot time, other values are
+                            None.
         """
-        assert isinstance(dataset_name, str)
+        assert isinstance(database, str)
         assert project_id is None or isinstance(project_id, str)
-        self.client = bigquery.Client(project=project_id)
-        self.dataset_ref = self.client.dataset(dataset_name)
+        assert obj_cache is None or isinstance(obj_cache, cache.ObjectCache)
+        assert result_cache is None or \
+            isinstance(result_cache, cache.ResultCache)
+        assert stats_hook is None or callable(stats_hook)
+        self.obj_cache = obj_cache
+        self.result_cache = result_cache
+        # The identity of the database, distinguishing its results in
+        # caches shared with clients of other databases
+        if database.startswith("sqlite:"):
+            path = database[len("sqlite:"):]
+            self.driver = sqlite.Driver(path)
+            # In-memory databases are private to their driver
+            self.database_id = "sqlite:" + (
+                f":memory:{uuid.uuid4().hex}" if path == ":memory:"
+                else os.path.abspath(path)
+            )
+        else:
+            if database.startswith("bigquery:"):
+                database = database[len("bigquery:"):]
+            self.driver = bigquery.Driver(database, project_id=project_id)
+            dataset_ref = self.driver.dataset_ref
+            self.database_id = \
+                f"bigquery:{dataset_ref.project}.{dataset_ref.dataset_id}"
+        self.driver.stats_hook = stats_hook
 
     def get_schema_version(self):
         """
-        Get the version of the I/O schema the dataset schema corresponds to.
+        Get the version of the I/O schema the database schema corresponds to.
 
         Returns:
             Major version number, minor version number.
         """
-        dataset = self.client.get_dataset(self.dataset_ref)
-        if "version_major" in dataset.labels and \
-           "version_minor" in dataset.labels:
-            return int(dataset.labels["version_major"]), \
-                int(dataset.labels["version_minor"])
-        return io.schema.V1.major, io.schema.V1.minor
+        return self.driver.get_schema_version()
+
+    def _check_schema_version(self):
+        """
+        Check the database schema is compatible with the latest I/O schema.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        major, minor = self.driver.get_schema_version()
+        if major != io.schema.LATEST.major:
+            raise IncompatibleSchema(major, minor)
 
     def init(self):
         """
         Initialize the database. The database must be empty.
+        BigQuery tables are partitioned and clustered according to
+        schema.TABLE_PARTITIONING_MAP and schema.TABLE_CLUSTERING_MAP, and
+        rollup tables from schema.ROLLUP_TABLE_MAP are created as well.
+        SQLite tables are indexed by object IDs and parent IDs.
         """
-        for table_name, table_schema in schema.TABLE_MAP.items():
-            table_ref = self.dataset_ref.table(table_name)
-            table = bigquery.table.Table(table_ref, schema=table_schema)
-            self.client.create_table(table)
-        dataset = self.client.get_dataset(self.dataset_ref)
-        dataset.labels["version_major"] = str(io.schema.LATEST.major)
-        dataset.labels["version_minor"] = str(io.schema.LATEST.minor)
-        self.client.update_dataset(dataset, ["labels"])
+        self.driver.init()
 
     def cleanup(self):
         """
         Cleanup (empty) the database, removing all data.
         """
-        for table_name, _ in schema.TABLE_MAP.items():
-            table_ref = self.dataset_ref.table(table_name)
-            try:
-                self.client.delete_table(table_ref)
-            except NotFound:
-                pass
-        dataset = self.client.get_dataset(self.dataset_ref)
-        dataset.labels["version_major"] = None
-        dataset.labels["version_minor"] = None
-        self.client.update_dataset(dataset, ["labels"])
+        self.driver.cleanup()
 
-    @staticmethod
-    def _unpack_node(node):
+    def dump_incremental(self, since=None):
         """
-        Unpack a retrieved data node (and all its children) to
-        the JSON-compatible and schema-complying representation.
+        Dump data loaded into the database after a watermark.
 
         Args:
-            node:   The node to unpack.
+            since:  The watermark returned by the previous call, an "aware"
+                    datetime.datetime object, to only dump objects loaded
+                    after it, or None to dump all objects.
 
         Returns:
-            The unpacked node.
-        """
-        if isinstance(node, decimal.Decimal):
-            node = float(node)
-        elif isinstance(node, datetime):
-            node = node.isoformat()
-        elif isinstance(node, list):
-            for index, value in enumerate(node):
-                node[index] = Client._unpack_node(value)
-        elif isinstance(node, dict):
-            for key, value in list(node.items()):
-                if value is None:
-                    del node[key]
-                elif key == "misc":
-                    node[key] = json.loads(value)
-                else:
-                    node[key] = Client._unpack_node(value)
-        return node
-
-    def dump(self):
+            The JSON data from the database adhering to the latest I/O schema
+            version, and the new watermark to pass to the next call to only
+            get objects loaded since this one. Objects loaded shortly before
+            the dump may be returned again by the next call, as loads can
+            take time to finish and their clocks can differ.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
+
+        self._check_schema_version()
+        return self.driver.dump_incremental(since)
+
+    def dump(self, since=None):
         """
         Dump all data from the database.
 
+        Args:
+            since:  An "aware" datetime.datetime object specifying the
+                    watermark to only dump objects loaded after, or None to
+                    dump all objects. See dump_incremental() for details.
+
         Returns:
             The JSON data from the database adhering to the latest I/O schema
             version.
 
         Raises:
-            `IncompatibleSchema` if the dataset schema is incompatible with
+            `IncompatibleSchema` if the database schema is incompatible with
             the latest I/O schema.
         """
-        major, minor = self.get_schema_version()
-        if major != io.schema.LATEST.major:
-            raise IncompatibleSchema(major, minor)
-
-        data = dict(version=dict(major=io.schema.LATEST.major,
-                                 minor=io.schema.LATEST.minor))
-        for obj_list_name in schema.TABLE_MAP:
-            job_config = bigquery.job.QueryJobConfig(
-                default_dataset=self.dataset_ref)
-            query_job = self.client.query(
-                f"SELECT * FROM `{obj_list_name}`", job_config=job_config)
-            data[obj_list_name] = [
-                Client._unpack_node(dict(row.items())) for row in query_job
-            ]
+        return self.dump_incremental(since)[0]
 
-        assert io.schema.is_valid_latest(data)
-        return data
-
-    @staticmethod
-    def escape_like_pattern(string):
+    def dump_arrow(self, since=None):
         """
-        Escape a string for use as a literal in a LIKE pattern.
+        Dump all data from the database as Arrow record batches, without
+        converting it to the I/O representation. Requires the optional
+        "pyarrow" package.
 
         Args:
-            string: The string to escape.
+            since:  An "aware" datetime.datetime object specifying the
+                    watermark to only dump objects loaded after, or None to
+                    dump all objects. See dump_incremental() for details.
 
         Returns:
-            The escaped string.
+            An iterator returning tuples, each containing the name of an
+            object list, and a pyarrow.RecordBatch with a portion of its
+            objects, conforming to the list's Arrow schema (see
+            arrow.get_schema()). Misc fields are kept as JSON strings.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
         """
-        return Client._LIKE_PATTERN_ESCAPE_RE.sub(r"\\\1", string)
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
 
-    def query(self, patterns, children=False, parents=False):
+        self._check_schema_version()
+        return self.driver.dump_arrow(since)
+
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children=False, parents=False,
+              since=None, until=None, filters=None):
         """
         Match and fetch objects from the database.
 
@@ -180,167 +234,352 @@ class Client:
                         as well.
             parents:    True if parents of matched objects should be matched
                         as well.
+            since:      An "aware" datetime.datetime object specifying the
+                        earliest (inclusive) time of objects to match, or
+                        None for no lower bound. Revisions are matched by
+                        discovery time, and builds and tests - by start
+                        time. Objects without the time are not matched, if
+                        either bound is specified. Parents and children are
+                        matched regardless of their time.
+            until:      An "aware" datetime.datetime object specifying the
+                        latest (exclusive) time of objects to match, or
+                        None for no upper bound. Matched the same way as
+                        "since".
+            filters:    A dictionary of object list names, and dictionaries
+                        of their field names and filters the objects should
+                        satisfy to match, or None for no filters. Only
+                        top-level single-value fields can be filtered on
+                        (see get_filter_field()). Each filter is a tuple of
+                        an operator and its argument, one of:
+                        * ("=", VALUE) - the field equals VALUE,
+                        * ("in", [VALUE, ...]) - the field equals one of
+                          the VALUEs,
+                        * ("prefix", STRING) - the (string) field starts
+                          with STRING,
+                        * ("range", (MIN, MAX)) - the (timestamp or numeric)
+                          field is greater than or equal to MIN, and less
+                          than MAX. Either can be None for no bound.
+                        Values should be strings, booleans, "aware"
+                        datetime.datetime objects, or numbers, matching the
+                        field types. Objects with missing fields don't
+                        satisfy the filters. Parents and children are
+                        matched regardless of the filters.
 
         Returns:
             The JSON data from the database adhering to the latest I/O schema
             version.
 
         Raises:
-            `IncompatibleSchema` if the dataset schema is incompatible with
+            `IncompatibleSchema` if the database schema is incompatible with
             the latest I/O schema.
         """
         assert isinstance(patterns, dict)
         assert all(isinstance(k, str) and isinstance(v, list) and
                    all(isinstance(e, str) for e in v)
                    for k, v in patterns.items())
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
+        assert until is None or \
+            isinstance(until, datetime) and until.tzinfo
+        assert filters is None or Client.is_valid_filters(filters)
+
+        self._check_schema_version()
+        if self.result_cache is None:
+            return self.driver.query(patterns, children, parents,
+                                     since, until, filters or {})
+        key = self.result_cache.get_key(self.database_id, patterns,
+                                        children, parents,
+                                        since, until, filters)
+        data = self.result_cache.get(key)
+        if data is None:
+            data = self.driver.query(patterns, children, parents,
+                                     since, until, filters or {})
+            self.result_cache.put(key, data)
+        return data
 
-        major, minor = self.get_schema_version()
-        if major != io.schema.LATEST.major:
-            raise IncompatibleSchema(major, minor)
+    # pylint: disable=too-many-arguments
+    def query_page(self, patterns, children=False, parents=False,
+                   since=None, until=None, filters=None,
+                   page_size=1000, token=None):
+        """
+        Match and fetch a page of objects from the database.
 
-        # A dictionary of object list names and tuples containing a SELECT
-        # statement and the list of its parameters, returning IDs of the
-        # objects to fetch.
-        obj_list_queries = {
-            # JOIN selecting objects with IDs matching the patterns
-            obj_list_name: [
-                f"SELECT {obj_list_name}.id AS id " \
-                f"FROM {obj_list_name} " \
-                f"INNER JOIN UNNEST(?) AS id_pattern " \
-                f"ON {obj_list_name}.id LIKE id_pattern\n",
-                [
-                    bigquery.ArrayQueryParameter(
-                        None, "STRING", patterns.get(obj_list_name, [])
-                    )
-                ]
-            ]
-            for obj_list_name in io.schema.LATEST.tree if obj_list_name
-        }
-
-        # Add referenced parents if requested
-        if parents:
-            def add_parents(obj_list_name):
-                """Add parent IDs to query results"""
-                obj_name = obj_list_name[:-1]
-                query = obj_list_queries[obj_list_name]
-                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
-                    add_parents(child_list_name)
-                    child_query = obj_list_queries[child_list_name]
-                    query[0] += \
-                        f"UNION DISTINCT\n" \
-                        f"SELECT {child_list_name}.{obj_name}_id AS id " \
-                        f"FROM {child_list_name} " + \
-                        f"WHERE {child_list_name}.id IN (\n" + \
-                        textwrap.indent(child_query[0], " " * 4) + \
-                        f")\n"
-                    query[1] += child_query[1]
-
-            for obj_list_name in io.schema.LATEST.tree[""]:
-                add_parents(obj_list_name)
-
-        # Add referenced children if requested
-        if children:
-            def add_children(obj_list_name):
-                """Add child IDs to query results"""
-                obj_name = obj_list_name[:-1]
-                query = obj_list_queries[obj_list_name]
-                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
-                    child_query = obj_list_queries[child_list_name]
-                    child_query[0] += \
-                        f"UNION DISTINCT\n" \
-                        f"SELECT {child_list_name}.id AS id " \
-                        f"FROM {child_list_name} " + \
-                        f"WHERE {child_list_name}.{obj_name}_id IN (\n" + \
-                        textwrap.indent(query[0], " " * 4) + \
-                        f")\n"
-                    child_query[1] += query[1]
-                    add_children(child_list_name)
-
-            for obj_list_name in io.schema.LATEST.tree[""]:
-                add_children(obj_list_name)
-
-        # Fetch the data
-        data = dict(version=dict(major=io.schema.LATEST.major,
-                                 minor=io.schema.LATEST.minor))
-        for obj_list_name, query in obj_list_queries.items():
-            job_config = bigquery.job.QueryJobConfig(
-                query_parameters=query[1],
-                default_dataset=self.dataset_ref
-            )
-            query_job = self.client.query(
-                f"SELECT * FROM {obj_list_name} WHERE id IN (\n" +
-                query[0] +
-                f")\n",
-                job_config=job_config
-            )
-            data[obj_list_name] = [
-                Client._unpack_node(dict(row.items())) for row in query_job
-            ]
+        Args:
+            patterns:   A dictionary of object list names, and lists of LIKE
+                        patterns, for IDs of objects to match.
+            children:   True if children of matched objects should be matched
+                        as well.
+            parents:    True if parents of matched objects should be matched
+                        as well.
+            since:      The earliest (inclusive) time of objects to match,
+                        or None. See query() for details.
+            until:      The latest (exclusive) time of objects to match,
+                        or None. See query() for details.
+            filters:    Filters for object fields, or None.
+                        See query() for details.
+            page_size:  The maximum number of objects to return in the page.
+            token:      The continuation token returned with the previous
+                        page, or None to fetch the first page. Tokens
+                        expire together with BigQuery query results, after
+                        about a day. The query arguments must be the same
+                        as for the previous page.
 
-        assert io.schema.is_valid_latest(data)
-        return data
+        Returns:
+            The JSON data from the database with the page of objects,
+            adhering to the latest I/O schema version, and the continuation
+            token for fetching the next page, or None if there are no more
+            pages.
 
-    @staticmethod
-    def _pack_node(node):
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+            `ValueError` if the continuation token is invalid.
+        """
+        assert isinstance(patterns, dict)
+        assert all(isinstance(k, str) and isinstance(v, list) and
+                   all(isinstance(e, str) for e in v)
+                   for k, v in patterns.items())
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
+        assert until is None or \
+            isinstance(until, datetime) and until.tzinfo
+        assert filters is None or Client.is_valid_filters(filters)
+        assert isinstance(page_size, int) and page_size > 0
+        assert token is None or isinstance(token, str)
+
+        self._check_schema_version()
+        return self.driver.query_page(patterns, children, parents,
+                                      since, until, filters or {},
+                                      page_size, token)
+
+    # pylint: disable=too-many-arguments
+    def query_iter(self, patterns, children=False, parents=False,
+                   since=None, until=None, filters=None, page_size=1000):
         """
-        Pack a loaded data node (and all its children) to
-        the BigQuery storage-compatible representation.
+        Match and fetch objects from the database, page by page, lazily.
 
         Args:
-            node:   The node to pack.
+            patterns:   A dictionary of object list names, and lists of LIKE
+                        patterns, for IDs of objects to match.
+            children:   True if children of matched objects should be matched
+                        as well.
+            parents:    True if parents of matched objects should be matched
+                        as well.
+            since:      The earliest (inclusive) time of objects to match,
+                        or None. See query() for details.
+            until:      The latest (exclusive) time of objects to match,
+                        or None. See query() for details.
+            filters:    Filters for object fields, or None.
+                        See query() for details.
+            page_size:  The maximum number of objects to return in a page.
+
+        Returns:
+            An iterator returning JSON data pages from the database, each
+            adhering to the latest I/O schema version, and containing at
+            most "page_size" objects.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        token = None
+        while True:
+            data, token = self.query_page(patterns, children, parents,
+                                          since, until, filters,
+                                          page_size, token)
+            yield data
+            if token is None:
+                break
+
+    # pylint: disable=too-many-arguments
+    def query_arrow(self, patterns, children=False, parents=False,
+                    since=None, until=None, filters=None):
+        """
+        Match and fetch objects from the database as Arrow record batches,
+        without converting them to the I/O representation. Requires the
+        optional "pyarrow" package.
+
+        Args:
+            patterns:   A dictionary of object list names, and lists of LIKE
+                        patterns, for IDs of objects to match.
+            children:   True if children of matched objects should be matched
+                        as well.
+            parents:    True if parents of matched objects should be matched
+                        as well.
+            since:      The earliest (inclusive) time of objects to match,
+                        or None. See query() for details.
+            until:      The latest (exclusive) time of objects to match,
+                        or None. See query() for details.
+            filters:    Filters for object fields, or None.
+                        See query() for details.
+
+        Returns:
+            An iterator returning tuples, each containing the name of an
+            object list, and a pyarrow.RecordBatch with a portion of its
+            matched objects, conforming to the list's Arrow schema (see
+            arrow.get_schema()). Misc fields are kept as JSON strings.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        assert isinstance(patterns, dict)
+        assert all(isinstance(k, str) and isinstance(v, list) and
+                   all(isinstance(e, str) for e in v)
+                   for k, v in patterns.items())
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
+        assert until is None or \
+            isinstance(until, datetime) and until.tzinfo
+        assert filters is None or Client.is_valid_filters(filters)
+
+        self._check_schema_version()
+        return self.driver.query_arrow(patterns, children, parents,
+                                       since, until, filters or {})
+
+    # pylint: disable=too-many-arguments
+    def aggregate(self, obj_list_name, group_by, patterns,
+                  children=False, parents=False,
+                  since=None, until=None, filters=None, path_depth=None):
+        """
+        Count matching objects of a list in the database, grouped by
+        specified keys.
+
+        Args:
+            obj_list_name:  The name of the object list to count objects in.
+            group_by:       A list of keys to group the objects by. Each key
+                            is either a name of a field, which can be
+                            filtered on (see get_filter_field()), or
+                            "origin", for the name of the CI system which
+                            submitted the object (the ID prefix).
+            patterns:       A dictionary of object list names, and lists of
+                            LIKE patterns, for IDs of objects to match.
+            children:       True if children of matched objects should be
+                            matched as well.
+            parents:        True if parents of matched objects should be
+                            matched as well.
+            since:          The earliest (inclusive) time of objects to
+                            match, or None. See query() for details.
+            until:          The latest (exclusive) time of objects to match,
+                            or None. See query() for details.
+            filters:        Filters for object fields, or None.
+                            See query() for details.
+            path_depth:     The maximum number of dot-separated test path
+                            components to group by, when grouping by "path",
+                            or None to group by the complete path.
+
+        Returns:
+            A list of dictionaries, one for each group of objects, in order
+            of their keys, containing the keys and their values, and the
+            number of objects in the group, under the "count" key.
+            Missing values are represented with None.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        assert isinstance(obj_list_name, str)
+        assert obj_list_name in schema.TABLE_MAP
+        assert isinstance(group_by, list)
+        assert all(key == "origin" or
+                   Client.get_filter_field(obj_list_name, key) is not None
+                   for key in group_by)
+        assert len(set(group_by)) == len(group_by)
+        assert path_depth is None or \
+            isinstance(path_depth, int) and path_depth > 0
+        assert isinstance(patterns, dict)
+        assert all(isinstance(k, str) and isinstance(v, list) and
+                   all(isinstance(e, str) for e in v)
+                   for k, v in patterns.items())
+        assert since is None or \
+            isinstance(since, datetime) and since.tzinfo
+        assert until is None or \
+            isinstance(until, datetime) and until.tzinfo
+        assert filters is None or Client.is_valid_filters(filters)
+
+        self._check_schema_version()
+        return self.driver.aggregate(obj_list_name, group_by, patterns,
+                                     children, parents, since, until,
+                                     filters or {}, path_depth)
+
+    def get_rollups(self, obj_list_name, ids):
+        """
+        Get aggregated data for objects from the rollup tables, maintained by
+        loading with rollup updates enabled.
+
+        Args:
+            obj_list_name:  The name of the object list to get the aggregated
+                            data for: "revisions" or "builds".
+            ids:            A list of IDs of the objects to get the
+                            aggregated data for.
 
         Returns:
-            The packed node.
-        """
-        if isinstance(node, list):
-            node = node.copy()
-            for index, value in enumerate(node):
-                node[index] = Client._pack_node(value)
-        elif isinstance(node, dict):
-            node = node.copy()
-            for key, value in list(node.items()):
-                # Flatten the "misc" fields
-                if key == "misc":
-                    node[key] = json.dumps(value)
-                else:
-                    node[key] = Client._pack_node(value)
-        return node
-
-    def load(self, data):
+            A dictionary of object IDs and dictionaries with their aggregated
+            data, with keys and values as described by the rollup table
+            schema (see schema.ROLLUP_TABLE_MAP). Objects without aggregated
+            data are omitted.
+        """
+        assert obj_list_name in ("revisions", "builds")
+        assert isinstance(ids, list)
+        assert all(isinstance(id, str) for id in ids)
+
+        self._check_schema_version()
+        return self.driver.get_rollups(obj_list_name, ids)
+
+    def load(self, data, upsert=False, rollup=False):
         """
         Load data into the database.
 
         Args:
             data:   The JSON data to load into the database.
                     Must adhere to a version of I/O schema.
+            upsert: True if the loaded objects should replace the objects
+                    with the same IDs already in the database, and only the
+                    last of the loaded objects with the same ID should be
+                    stored. False if all the loaded objects should simply be
+                    appended to the database, possibly duplicating
+                    existing ones.
+            rollup: True if the rollup tables should be updated for the
+                    objects affected by the loaded data, i.e. the loaded
+                    revisions and builds, and parents of the loaded builds
+                    and tests. False if not.
+
+        Returns:
+            A dictionary of names of loaded object lists, and tuples
+            containing the number of objects inserted into their tables,
+            and the number of objects merged into (updated in) them.
 
         Raises:
-            `IncompatibleSchema` if the dataset schema is incompatible with
+            `IncompatibleSchema` if the database schema is incompatible with
             the latest I/O schema.
         """
         assert io.schema.is_valid(data)
         data = io.schema.upgrade(data)
 
-        major, minor = self.get_schema_version()
-        if major != io.schema.LATEST.major:
-            raise IncompatibleSchema(major, minor)
+        self._check_schema_version()
+        stats = self.driver.load(data, upsert, rollup)
+        if self.obj_cache is not None:
+            self.obj_cache.update(data)
+        if self.result_cache is not None:
+            self.result_cache.invalidate()
+        return stats
+
+    def compact(self):
+        """
+        Remove rows with duplicate IDs from the database tables, in place,
+        keeping the last loaded row for each ID.
 
-        for obj_list_name in schema.TABLE_MAP:
-            if obj_list_name in data:
-                obj_list = Client._pack_node(data[obj_list_name])
-                job_config = bigquery.job.LoadJobConfig(
-                    autodetect=False,
-                    schema=schema.TABLE_MAP[obj_list_name])
-                job = self.client.load_table_from_json(
-                    obj_list,
-                    self.dataset_ref.table(obj_list_name),
-                    job_config=job_config)
-                try:
-                    job.result()
-                except BadRequest:
-                    raise Exception("".join([
-                        f"ERROR: {error['message']}\n" for error in job.errors
-                    ]))
+        Returns:
+            A dictionary of names of object lists, and tuples containing the
+            number of rows kept in their tables, and the number of duplicate
+            rows merged into (removed in favor of) the kept ones.
+
+        Raises:
+            `IncompatibleSchema` if the database schema is incompatible with
+            the latest I/O schema.
+        """
+        self._check_schema_version()
+        return self.driver.compact()
 
     def complement(self, data):
         """
@@ -362,6 +601,12 @@ class Client:
         assert io.schema.is_valid(data)
         data = io.schema.upgrade(data)
 
+        # Serve the complement from the cache, if possible
+        if self.obj_cache is not None:
+            complement = self.obj_cache.complement(data)
+            if complement is not None:
+                return complement
+
         # Generate patterns matching IDs of all supplied objects
         patterns = {}
         for obj_list_name in io.schema.LATEST.tree.keys():
@@ -372,7 +617,142 @@ class Client:
                 })
 
         # Query the objects along with parents and children
-        return self.query(patterns, children=True, parents=True)
+        with self.driver.operation("complement"):
+            complement = self.query(patterns, children=True, parents=True)
+        if self.obj_cache is not None:
+            self.obj_cache.update(complement, complete=True)
+        return complement
+
+
+class FederatedClient:
+    """
+    Kernel CI report database client federating several databases.
+    Fans queries out to all the databases concurrently, and merges the
+    results, taking objects present in several databases from the one
+    earliest in the precedence order.
+    """
+
+    def __init__(self, clients, max_workers=None):
+        """
+        Initialize a federated database client.
+
+        Args:
+            clients:        A list of database clients (kcidb.db.Client
+                            instances) to federate, in order of precedence,
+                            highest first.
+            max_workers:    Maximum number of databases to access
+                            concurrently, or None for all of them.
+        """
+        assert isinstance(clients, list) and clients
+        assert all(isinstance(client, Client) for client in clients)
+        assert max_workers is None or \
+            isinstance(max_workers, int) and max_workers > 0
+        self.clients = clients
+        self.max_workers = max_workers or len(clients)
+
+    def _fan_out(self, method_name, *args, **kwargs):
+        """
+        Call a method of every federated client concurrently, and merge the
+        I/O data they return.
+
+        Args:
+            method_name:    The name of the client method to call.
+            args:           Positional arguments to pass to the method.
+            kwargs:         Keyword arguments to pass to the method.
+
+        Returns:
+            The merged JSON data adhering to the latest I/O schema version.
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as executor:
+            futures = [
+                executor.submit(getattr(client, method_name), *args, **kwargs)
+                for client in self.clients
+            ]
+            return FederatedClient.merge([f.result() for f in futures])
+
+    @staticmethod
+    def merge(data_list):
+        """
+        Merge I/O data from several databases, taking objects with the same
+        ID from the earliest data.
+
+        Args:
+            data_list:  A list of JSON data adhering to the latest I/O
+                        schema version, in order of precedence, highest
+                        first. Will not be modified.
+
+        Returns:
+            The merged JSON data adhering to the latest I/O schema version.
+        """
+        assert isinstance(data_list, list)
+        assert all(io.schema.is_valid_latest(data) for data in data_list)
+        merged = dict(version=dict(major=io.schema.LATEST.major,
+                                   minor=io.schema.LATEST.minor))
+        for obj_list_name in io.schema.LATEST.tree:
+            if not obj_list_name:
+                continue
+            objs = {}
+            for data in data_list:
+                for obj in data.get(obj_list_name, []):
+                    objs.setdefault(obj["id"], obj)
+            if objs:
+                merged[obj_list_name] = list(objs.values())
+        assert io.schema.is_valid_latest(merged)
+        return merged
+
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children=False, parents=False,
+              since=None, until=None, filters=None):
+        """
+        Match and fetch objects from all the federated databases.
+        See Client.query() for details.
+
+        Returns:
+            The merged JSON data from the databases adhering to the latest
+            I/O schema version.
+
+        Raises:
+            `IncompatibleSchema` if a database schema is incompatible with
+            the latest I/O schema.
+        """
+        return self._fan_out("query", patterns, children=children,
+                             parents=parents, since=since, until=until,
+                             filters=filters)
+
+    def complement(self, data):
+        """
+        Given I/O data, return its complement from all the federated
+        databases. Each database complements the data separately, so
+        objects referencing objects in other databases are not followed
+        across them. See Client.complement() for details.
+
+        Args:
+            data:   The JSON data to complement from the databases.
+                    Must adhere to a version of I/O schema
+                    Will not be modified.
+
+        Returns:
+            The merged complemented JSON data from the databases adhering
+            to the latest version of I/O schema.
+        """
+        assert io.schema.is_valid(data)
+        return self._fan_out("complement", data)
+
+
+def print_stats(stats):
+    """
+    Output database job statistics to stderr, as a line of JSON.
+    Suitable as a kcidb.db.Client statistics hook.
+
+    Args:
+        stats:  The dictionary of job statistics to output.
+    """
+    assert isinstance(stats, dict)
+    json.dump(stats, sys.stderr, sort_keys=True)
+    sys.stderr.write("\n")
+    sys.stderr.flush()
 
 
 def common_main_add_args(parser):
@@ -388,16 +768,25 @@ def common_main_add_args(parser):
     assert isinstance(parser, argparse.ArgumentParser)
     parser.add_argument(
         '-p', '--project',
-        help='ID of the Google Cloud project containing the dataset. '
-             'Taken from credentials by default.',
+        help='ID of the Google Cloud project containing the BigQuery '
+             'dataset. Taken from credentials by default.',
         default=None,
         required=False
     )
     parser.add_argument(
-        '-d', '--dataset',
-        help='Dataset name',
+        '-d', '--database', '--dataset',
+        metavar="DATABASE",
+        help='Database specification: "sqlite:PATH" for an SQLite '
+             'database file, or "[bigquery:]DATASET" for a BigQuery '
+             'dataset',
         required=True
     )
+    parser.add_argument(
+        '--stats',
+        help='Output statistics of each executed database job to stderr, '
+             'as JSON, one object per line',
+        action='store_true'
+    )
     return parser
 
 
@@ -410,28 +799,183 @@ def complement_main():
     args = parser.parse_args()
     data = json.load(sys.stdin)
     data = io.schema.upgrade(data, copy=False)
-    client = Client(args.dataset, project_id=args.project)
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
     json.dump(client.complement(data), sys.stdout, indent=4, sort_keys=True)
 
 
 def dump_main():
     """Execute the kcidb-db-dump command-line tool"""
     description = \
-        'kcidb-db-dump - Dump all data from Kernel CI report database'
+        'kcidb-db-dump - Dump all data from Kernel CI report database. ' \
+        'Output the watermark to dump objects loaded later with, to ' \
+        'stderr, as the last line: a JSON object with the "watermark" ' \
+        'timestamp, null if nothing was ever loaded.'
     parser = argparse.ArgumentParser(description=description)
     common_main_add_args(parser)
+    parser.add_argument(
+        '--since',
+        metavar="TIMESTAMP",
+        type=timestamp_arg,
+        default=None,
+        help='Only dump objects loaded after the ISO-8601 TIMESTAMP '
+             '(a watermark output by a previous dump). '
+             'Assume UTC, if no timezone is specified.',
+    )
+    parser.add_argument(
+        '-w', '--watermark-file',
+        metavar="FILE",
+        default=None,
+        help='Only dump objects loaded after the watermark stored in FILE, '
+             'if it exists, and store the new watermark into it afterwards',
+    )
+    parser.add_argument(
+        '-f', '--format',
+        choices=["json", "parquet"],
+        default="json",
+        help='Output format: JSON to stdout (default), or a Parquet file '
+             'per object list, written into the --output-dir directory',
+    )
+    parser.add_argument(
+        '-o', '--output-dir',
+        metavar="DIR",
+        default=None,
+        help='Directory to write Parquet files into',
+    )
     args = parser.parse_args()
-    client = Client(args.dataset, project_id=args.project)
-    json.dump(client.dump(), sys.stdout, indent=4, sort_keys=True)
+    if args.since is not None and args.watermark_file is not None:
+        parser.error("Cannot use both --since and --watermark-file")
+    if args.format == "parquet":
+        if args.output_dir is None:
+            parser.error("Parquet format requires --output-dir")
+        if args.watermark_file is not None:
+            parser.error("Cannot use --watermark-file with Parquet format")
+        client = Client(args.database, project_id=args.project,
+                        stats_hook=print_stats if args.stats else None)
+        try:
+            arrow.write_parquet(args.output_dir,
+                                client.dump_arrow(args.since))
+        except NotImplementedError:
+            sys.exit("The database doesn't support Parquet output")
+        return
+    if args.output_dir is not None:
+        parser.error("Only Parquet format supports --output-dir")
+    since = args.since
+    if args.watermark_file is not None and \
+       os.path.exists(args.watermark_file):
+        with open(args.watermark_file, "r",
+                  encoding="utf-8") as watermark_file:
+            since = timestamp_arg(watermark_file.read().strip())
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
+    data, watermark = client.dump_incremental(since)
+    json.dump(data, sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.flush()
+    if watermark is not None and args.watermark_file is not None:
+        with open(args.watermark_file, "w",
+                  encoding="utf-8") as watermark_file:
+            watermark_file.write(watermark.isoformat() + "\n")
+    # Output the watermark after any statistics, separately from the data
+    json.dump(dict(watermark=watermark and watermark.isoformat()),
+              sys.stderr)
+    sys.stderr.write("\n")
+
+
+def timestamp_arg(string):
+    """
+    Parse an ISO-8601 timestamp command-line argument, assuming UTC if no
+    timezone is specified.
+
+    Args:
+        string: The argument string to parse.
+
+    Returns:
+        An "aware" datetime.datetime object with the parsed timestamp.
+
+    Raises:
+        `argparse.ArgumentTypeError` if the string is not a valid timestamp.
+    """
+    try:
+        timestamp = misc.parse_timestamp(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid ISO-8601 timestamp: {string!r}"
+        ) from None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def filter_arg(string):
+    """
+    Parse an object field filter command-line argument.
+
+    Args:
+        string: The argument string to parse, in LIST.FIELD<OP>VALUE format,
+                where <OP> is one of "=", "^=", ">=", or "<".
 
+    Returns:
+        The object list name, the field name, the operator ("=", "prefix",
+        ">=", or "<"), and the value converted to the field type.
 
-def query_main_parse_args(description):
+    Raises:
+        `argparse.ArgumentTypeError` if the string is not a valid filter.
+    """
+    match = FILTER_ARG_RE.fullmatch(string)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid filter: {string!r}")
+    obj_list_name, field_name, op, value = match.groups()
+    field = Client.get_filter_field(obj_list_name, field_name)
+    if field is None:
+        raise argparse.ArgumentTypeError(
+            f"Cannot filter on {obj_list_name}.{field_name}"
+        )
+    if op == "^=":
+        if field.field_type != "STRING":
+            raise argparse.ArgumentTypeError(
+                f"Cannot match prefix of {obj_list_name}.{field_name}"
+            )
+        op = "prefix"
+    elif op in (">=", "<") and \
+            field.field_type not in ("TIMESTAMP", "NUMERIC"):
+        raise argparse.ArgumentTypeError(
+            f"Cannot compare {obj_list_name}.{field_name}"
+        )
+    if field.field_type == "BOOL":
+        if value.lower() not in ("true", "false"):
+            raise argparse.ArgumentTypeError(
+                f"Invalid boolean value: {value!r}"
+            )
+        value = value.lower() == "true"
+    elif field.field_type == "NUMERIC":
+        try:
+            value = decimal.Decimal(value)
+        except decimal.InvalidOperation:
+            raise argparse.ArgumentTypeError(
+                f"Invalid numeric value: {value!r}"
+            ) from None
+    elif field.field_type == "TIMESTAMP":
+        value = timestamp_arg(value)
+    return obj_list_name, field_name, op, value
+
+
+def query_main_parse_args(description, paging=False, caching=False,
+                          add_args=None):
     """
     Parse arguments for a database-querying command-line tool
 
     Args:
         description:    The program description to use in online help
                         messages.
+        paging:         True if the tool supports outputting the results
+                        page by page, and the corresponding option should be
+                        accepted.
+        caching:        True if the tool supports caching query results
+                        (see cache.ResultCache.from_env()), and the option
+                        disabling it should be accepted.
+        add_args:       A function accepting an argparse.ArgumentParser
+                        object, adding arguments specific to the tool,
+                        or None.
 
     Returns:
         An instance of argparse.Namespace containing the parsed arguments.
@@ -440,6 +984,8 @@ def query_main_parse_args(description):
 
     parser = argparse.ArgumentParser(description=description)
     common_main_add_args(parser)
+    if add_args is not None:
+        add_args(parser)
     parser.add_argument(
         '-r', '--revision-id-like',
         metavar="ID_PATTERN",
@@ -464,6 +1010,26 @@ def query_main_parse_args(description):
         dest="test_id_patterns",
         action='append',
     )
+    parser.add_argument(
+        '--since',
+        metavar="TIMESTAMP",
+        type=timestamp_arg,
+        default=None,
+        help='Only match objects discovered (revisions) or started (builds '
+             'and tests) at or after the ISO-8601 TIMESTAMP, among those '
+             'matching ID patterns. '
+             'Assume UTC, if no timezone is specified.',
+    )
+    parser.add_argument(
+        '--until',
+        metavar="TIMESTAMP",
+        type=timestamp_arg,
+        default=None,
+        help='Only match objects discovered (revisions) or started (builds '
+             'and tests) before the ISO-8601 TIMESTAMP, among those '
+             'matching ID patterns. '
+             'Assume UTC, if no timezone is specified.',
+    )
     parser.add_argument(
         '--parents',
         help='Match parents of matching objects',
@@ -474,21 +1040,173 @@ def query_main_parse_args(description):
         help='Match children of matching objects',
         action='store_true'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '-f', '--filter',
+        metavar="FILTER",
+        default=[],
+        type=filter_arg,
+        help='Only match objects with a field satisfying the FILTER. '
+             'Format: LIST.FIELD=VALUE (equals), LIST.FIELD^=VALUE '
+             '(starts with), LIST.FIELD>=VALUE (greater or equal), or '
+             'LIST.FIELD<VALUE (less than). E.g. tests.status=FAIL. '
+             'Specify "=" filters for the same field repeatedly to match '
+             'any of the values. Timestamps are in ISO-8601, booleans are '
+             '"true" or "false".',
+        dest="filter_list",
+        action='append',
+    )
+    if paging:
+        parser.add_argument(
+            '--page-size',
+            metavar="NUMBER",
+            type=int,
+            default=None,
+            help='Fetch and output results in pages of at most NUMBER '
+                 'objects, as separate JSON documents, instead of '
+                 'a single document',
+        )
+    if caching:
+        parser.add_argument(
+            '--no-cache',
+            help='Do not use the query result cache enabled by the '
+                 'KCIDB_RESULT_CACHE environment variable',
+            action='store_true'
+        )
+    args = parser.parse_args()
+    if paging and args.page_size is not None and args.page_size <= 0:
+        parser.error("Page size must be positive")
+    # Time bounds and filters only narrow down objects matched by ID
+    if (args.since is not None or args.until is not None or
+            args.filter_list) and \
+       not (args.revision_id_patterns or args.build_id_patterns or
+            args.test_id_patterns):
+        parser.error("--since, --until, and --filter require ID patterns, "
+                     "e.g. \"-t %\" to match all tests")
+
+    # Combine the filters into the query() format
+    args.filters = {}
+    for obj_list_name, field_name, op, value in args.filter_list:
+        field_filters = args.filters.setdefault(obj_list_name, {})
+        prev_op, prev_value = field_filters.get(field_name, (None, None))
+        if prev_op is None:
+            if op in (">=", "<"):
+                field_filters[field_name] = \
+                    ("range", (value, None) if op == ">=" else (None, value))
+            else:
+                field_filters[field_name] = (op, value)
+        elif op == "=" and prev_op in ("=", "in"):
+            field_filters[field_name] = (
+                "in",
+                (prev_value if prev_op == "in" else [prev_value]) + [value]
+            )
+        elif op in (">=", "<") and prev_op == "range" and \
+                prev_value[0 if op == ">=" else 1] is None:
+            field_filters[field_name] = (
+                "range",
+                (value, prev_value[1]) if op == ">=" else
+                (prev_value[0], value)
+            )
+        else:
+            parser.error(f"Conflicting filters for "
+                         f"{obj_list_name}.{field_name}")
+    del args.filter_list
+    return args
 
 
 def query_main():
     """Execute the kcidb-db-query command-line tool"""
     args = query_main_parse_args(
-        "kcidb-db-query - Query objects from Kernel CI report database"
+        "kcidb-db-query - Query objects from Kernel CI report database",
+        paging=True, caching=True
     )
-    client = Client(args.dataset, project_id=args.project)
-    data = client.query(dict(revisions=args.revision_id_patterns,
-                             builds=args.build_id_patterns,
-                             tests=args.test_id_patterns),
-                        parents=args.parents,
-                        children=args.children)
-    json.dump(data, sys.stdout, indent=4, sort_keys=True)
+    client = Client(
+        args.database, project_id=args.project,
+        result_cache=None if args.no_cache else cache.ResultCache.from_env(),
+        stats_hook=print_stats if args.stats else None
+    )
+    patterns = dict(revisions=args.revision_id_patterns,
+                    builds=args.build_id_patterns,
+                    tests=args.test_id_patterns)
+    if args.page_size is None:
+        data = client.query(patterns,
+                            parents=args.parents,
+                            children=args.children,
+                            since=args.since,
+                            until=args.until,
+                            filters=args.filters)
+        json.dump(data, sys.stdout, indent=4, sort_keys=True)
+    else:
+        try:
+            for data in client.query_iter(patterns,
+                                          parents=args.parents,
+                                          children=args.children,
+                                          since=args.since,
+                                          until=args.until,
+                                          filters=args.filters,
+                                          page_size=args.page_size):
+                json.dump(data, sys.stdout, indent=4, sort_keys=True)
+                sys.stdout.write("\n")
+                sys.stdout.flush()
+        except NotImplementedError:
+            sys.exit("The database doesn't support paging")
+
+
+def stats_main():
+    """Execute the kcidb-db-stats command-line tool"""
+    def add_args(parser):
+        """Add kcidb-db-stats-specific arguments"""
+        parser.add_argument(
+            'obj_list_name',
+            metavar='LIST',
+            choices=[n for n in io.schema.LATEST.tree if n],
+            help='Name of the object list to count objects in (%(choices)s)'
+        )
+        parser.add_argument(
+            '-g', '--group-by',
+            metavar="KEY",
+            default=[],
+            help='Group objects by KEY: a field name (e.g. "status", '
+                 '"waived", "path", or "architecture"), or "origin". '
+                 'Can be repeated to group by several keys.',
+            dest="group_by",
+            action='append',
+        )
+        parser.add_argument(
+            '--path-depth',
+            metavar="NUMBER",
+            type=int,
+            default=None,
+            help='Group by at most NUMBER first components of test paths',
+        )
+
+    args = query_main_parse_args(
+        "kcidb-db-stats - Count objects in Kernel CI report database",
+        add_args=add_args
+    )
+    for key in args.group_by:
+        if key != "origin" and \
+           Client.get_filter_field(args.obj_list_name, key) is None:
+            sys.exit(f"Cannot group {args.obj_list_name} by {key!r}")
+    if len(set(args.group_by)) != len(args.group_by):
+        sys.exit("Duplicate grouping keys")
+    if args.path_depth is not None and args.path_depth <= 0:
+        sys.exit("Path depth must be positive")
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
+    try:
+        groups = client.aggregate(args.obj_list_name, args.group_by,
+                                  dict(revisions=args.revision_id_patterns,
+                                       builds=args.build_id_patterns,
+                                       tests=args.test_id_patterns),
+                                  parents=args.parents,
+                                  children=args.children,
+                                  since=args.since,
+                                  until=args.until,
+                                  filters=args.filters,
+                                  path_depth=args.path_depth)
+    except NotImplementedError:
+        sys.exit("The database doesn't support aggregation")
+    json.dump(groups, sys.stdout, indent=4, sort_keys=True)
 
 
 def load_main():
@@ -497,11 +1215,30 @@ def load_main():
         'kcidb-db-load - Load reports into Kernel CI report database'
     parser = argparse.ArgumentParser(description=description)
     common_main_add_args(parser)
+    parser.add_argument(
+        '-u', '--upsert',
+        help='Replace objects with the same IDs already in the database, '
+             'instead of duplicating them, and output the numbers of '
+             'inserted and merged rows',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--rollup',
+        help='Update rollup tables for objects affected by the loaded data',
+        action='store_true'
+    )
     args = parser.parse_args()
     data = json.load(sys.stdin)
     data = io.schema.upgrade(data, copy=False)
-    client = Client(args.dataset, project_id=args.project)
-    client.load(data)
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
+    try:
+        stats = client.load(data, upsert=args.upsert, rollup=args.rollup)
+    except NotImplementedError:
+        sys.exit("The database doesn't support rollups")
+    if args.upsert:
+        for obj_list_name, (inserted, merged) in stats.items():
+            print(f"{obj_list_name}: {inserted} inserted, {merged} merged")
 
 
 def init_main():
@@ -510,7 +1247,8 @@ def init_main():
     parser = argparse.ArgumentParser(description=description)
     common_main_add_args(parser)
     args = parser.parse_args()
-    client = Client(args.dataset, project_id=args.project)
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
     client.init()
 
 
@@ -520,5 +1258,20 @@ def cleanup_main():
     parser = argparse.ArgumentParser(description=description)
     common_main_add_args(parser)
     args = parser.parse_args()
-    client = Client(args.dataset, project_id=args.project)
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
     client.cleanup()
+
+
+def compact_main():
+    """Execute the kcidb-db-compact command-line tool"""
+    description = \
+        'kcidb-db-compact - Remove duplicate objects from ' \
+        'a Kernel CI report database'
+    parser = argparse.ArgumentParser(description=description)
+    common_main_add_args(parser)
+    args = parser.parse_args()
+    client = Client(args.database, project_id=args.project,
+                    stats_hook=print_stats if args.stats else None)
+    for obj_list_name, (kept, merged) in client.compact().items():
+        print(f"{obj_list_name}: {kept} kept, {merged} merged")
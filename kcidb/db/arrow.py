@@ -0,0 +1,150 @@
+"""
+Kernel CI report database Arrow and Parquet representation.
+
+Requires the optional "pyarrow" package, installed with the "arrow" extra.
+"""
+
+import os
+import importlib
+from kcidb.db import schema
+
+# A map of BigQuery field types to functions returning
+# the corresponding Arrow types, given the pyarrow module
+TYPE_MAP = dict(
+    STRING=lambda pa: pa.string(),
+    INTEGER=lambda pa: pa.int64(),
+    FLOAT=lambda pa: pa.float64(),
+    NUMERIC=lambda pa: pa.decimal128(38, 9),
+    BOOL=lambda pa: pa.bool_(),
+    TIMESTAMP=lambda pa: pa.timestamp("us", tz="UTC"),
+)
+
+
+def import_pyarrow(name="pyarrow"):
+    """
+    Import a pyarrow module, explaining how to get it, if it's missing.
+
+    Args:
+        name:   The name of the module to import.
+
+    Returns:
+        The imported module.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError as exc:
+        raise Exception("Arrow support requires the \"pyarrow\" package, "
+                        "install it with the \"kcidb[arrow]\" extra") \
+            from exc
+
+
+def get_type(field):
+    """
+    Get the Arrow type of a BigQuery schema field.
+
+    Args:
+        field:  The BigQuery schema field to get the type of.
+
+    Returns:
+        The pyarrow.DataType of the field.
+    """
+    pa = import_pyarrow()
+    if field.field_type == "RECORD":
+        arrow_type = pa.struct([get_field(f) for f in field.fields])
+    else:
+        arrow_type = TYPE_MAP[field.field_type](pa)
+    if field.mode == "REPEATED":
+        arrow_type = pa.list_(arrow_type)
+    return arrow_type
+
+
+def get_field(field):
+    """
+    Get the Arrow field corresponding to a BigQuery schema field.
+
+    Args:
+        field:  The BigQuery schema field to convert.
+
+    Returns:
+        The pyarrow.Field corresponding to the BigQuery field.
+    """
+    pa = import_pyarrow()
+    metadata = None
+    if field.description:
+        metadata = dict(description=field.description)
+    return pa.field(field.name, get_type(field),
+                    nullable=(field.mode != "REQUIRED"),
+                    metadata=metadata)
+
+
+def get_schema(table_name):
+    """
+    Get the Arrow schema of an object table.
+
+    Args:
+        table_name: The name of the table (object list) to get the schema
+                    of, one of the keys of schema.TABLE_MAP.
+
+    Returns:
+        The pyarrow.Schema of the table.
+    """
+    assert table_name in schema.TABLE_MAP
+    pa = import_pyarrow()
+    return pa.schema([get_field(f) for f in schema.TABLE_MAP[table_name]])
+
+
+def conform_batch(table_name, batch):
+    """
+    Conform a record batch retrieved from an object table to the table's
+    Arrow schema, dropping any extra (e.g. service) columns, and casting
+    the rest to the expected types.
+
+    Args:
+        table_name: The name of the table (object list) the batch was
+                    retrieved from.
+        batch:      The pyarrow.RecordBatch to conform.
+
+    Returns:
+        The conformed pyarrow.RecordBatch.
+    """
+    pa = import_pyarrow()
+    assert isinstance(batch, pa.RecordBatch)
+    arrow_schema = get_schema(table_name)
+    arrays = []
+    for field in arrow_schema:
+        index = batch.schema.get_field_index(field.name)
+        if index < 0:
+            arrays.append(pa.nulls(batch.num_rows, type=field.type))
+        else:
+            arrays.append(batch.column(index).cast(field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+
+
+def write_parquet(directory, table_batches):
+    """
+    Write object table record batches into per-table Parquet files named
+    after the tables, in a directory. A file is written for every object
+    table, even if it has no batches.
+
+    Args:
+        directory:      The path to the directory to write the files into.
+                        Will be created, if it doesn't exist.
+        table_batches:  An iterable of tuples, each containing the name of
+                        an object table, and a pyarrow.RecordBatch
+                        conforming to its Arrow schema (see get_schema()).
+    """
+    assert isinstance(directory, str)
+    pq = import_pyarrow("pyarrow.parquet")
+    os.makedirs(directory, exist_ok=True)
+    writers = {}
+    try:
+        for table_name in schema.TABLE_MAP:
+            writers[table_name] = pq.ParquetWriter(
+                os.path.join(directory, table_name + ".parquet"),
+                get_schema(table_name)
+            )
+        for table_name, batch in table_batches:
+            writers[table_name].write_batch(batch)
+    finally:
+        for writer in writers.values():
+            writer.close()
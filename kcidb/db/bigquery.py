@@ -0,0 +1,1488 @@
+"""Kernel CI report database - Google BigQuery driver"""
+# pylint: disable=too-many-lines
+
+import base64
+import decimal
+import functools
+import json
+import textwrap
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from google.cloud import bigquery
+from google.api_core.exceptions import BadRequest
+from google.api_core.exceptions import NotFound
+from kcidb.db import schema, misc, arrow
+from kcidb.oo.misc import Status, Waived
+from kcidb import io
+
+
+class Driver(misc.Driver):
+    """Kernel CI report database driver for Google BigQuery"""
+
+    # Time after which an abandoned staging table is removed automatically
+    _STAGING_TABLE_LIFETIME = timedelta(hours=1)
+
+    # Maximum expected time between taking the ingestion timestamp and the
+    # loaded data becoming visible, including clock differences
+    _LOAD_LATENCY_MARGIN = timedelta(minutes=10)
+
+    # A map of names of object lists affecting rollups, to dictionaries of
+    # names and BigQuery types of the fields rollups are computed from
+    _ROLLUP_FIELD_TYPES = dict(
+        builds=dict(id="STRING", revision_id="STRING", valid="BOOL",
+                    duration="NUMERIC"),
+        tests=dict(id="STRING", build_id="STRING", status="STRING",
+                   waived="BOOL", duration="NUMERIC"),
+    )
+
+    def __init__(self, dataset_name, project_id=None):
+        """
+        Initialize a BigQuery database driver.
+
+        Args:
+            dataset_name:   The name of the Kernel CI dataset where data is
+                            located. The dataset should be located within the
+                            specified Google Cloud project.
+            project_id:     ID of the Google Cloud project hosting the
+                            dataset, or None to use the project from the
+                            credentials file point to by
+                            GOOGLE_APPLICATION_CREDENTIALS environment
+                            variable.
+        """
+        assert isinstance(dataset_name, str)
+        assert project_id is None or isinstance(project_id, str)
+        super().__init__()
+        self.client = bigquery.Client(project=project_id)
+        self.dataset_ref = self.client.dataset(dataset_name)
+        # True if the object tables are known to have all service fields
+        self.service_fields_added = False
+
+    # pylint: disable=too-many-arguments
+    def _record_job(self, operation, table, job, rows, started):
+        """
+        Report statistics of a finished BigQuery job to the statistics
+        hook, if any. See misc.Driver.record_stats() for details.
+
+        Args:
+            operation:  The name of the driver operation executing the job.
+            table:      The name of the table the job accessed.
+            job:        The finished query or load job.
+            rows:       The number of rows the job returned or loaded, or
+                        None if unknown.
+            started:    The time.monotonic() value taken before starting
+                        the job.
+        """
+        self.record_stats(
+            operation, table, getattr(job, "query", None), rows, started,
+            bytes_processed=getattr(job, "total_bytes_processed", None),
+            bytes_billed=getattr(job, "total_bytes_billed", None),
+            slot_millis=getattr(job, "slot_millis", None)
+        )
+
+    def get_schema_version(self):
+        """
+        Get the version of the I/O schema the dataset schema corresponds to.
+
+        Returns:
+            Major version number, minor version number.
+        """
+        dataset = self.client.get_dataset(self.dataset_ref)
+        if "version_major" in dataset.labels and \
+           "version_minor" in dataset.labels:
+            return int(dataset.labels["version_major"]), \
+                int(dataset.labels["version_minor"])
+        return io.schema.V1.major, io.schema.V1.minor
+
+    def init(self):
+        """
+        Initialize the database. The database must be empty.
+        Tables are partitioned and clustered according to
+        schema.TABLE_PARTITIONING_MAP and schema.TABLE_CLUSTERING_MAP.
+        Rollup tables from schema.ROLLUP_TABLE_MAP are created as well.
+        """
+        for table_name in schema.TABLE_MAP:
+            table_ref = self.dataset_ref.table(table_name)
+            table = bigquery.table.Table(
+                table_ref, schema=schema.STORAGE_TABLE_MAP[table_name]
+            )
+            table.time_partitioning = bigquery.table.TimePartitioning(
+                type_=bigquery.table.TimePartitioningType.DAY,
+                field=schema.TABLE_PARTITIONING_MAP[table_name]
+            )
+            table.clustering_fields = schema.TABLE_CLUSTERING_MAP[table_name]
+            self.client.create_table(table)
+        for table_name, table_schema in schema.ROLLUP_TABLE_MAP.items():
+            table_ref = self.dataset_ref.table(table_name)
+            table = bigquery.table.Table(table_ref, schema=table_schema)
+            table.clustering_fields = \
+                schema.ROLLUP_TABLE_CLUSTERING_MAP[table_name]
+            self.client.create_table(table)
+        dataset = self.client.get_dataset(self.dataset_ref)
+        dataset.labels["version_major"] = str(io.schema.LATEST.major)
+        dataset.labels["version_minor"] = str(io.schema.LATEST.minor)
+        self.client.update_dataset(dataset, ["labels"])
+
+    def _add_service_fields(self):
+        """
+        Add the service fields (see schema.STORAGE_TABLE_MAP) missing from
+        object tables created before the fields were introduced, once per
+        driver. The fields are NULL in the rows stored before that.
+        """
+        if self.service_fields_added:
+            return
+        for table_name, table_schema in schema.STORAGE_TABLE_MAP.items():
+            table = self.client.get_table(self.dataset_ref.table(table_name))
+            field_names = {field.name for field in table.schema}
+            missing_fields = [field for field in table_schema
+                              if field.name not in field_names]
+            if missing_fields:
+                table.schema = [*table.schema, *missing_fields]
+                self.client.update_table(table, ["schema"])
+        self.service_fields_added = True
+
+    def cleanup(self):
+        """
+        Cleanup (empty) the database, removing all data.
+        """
+        for table_name in [*schema.TABLE_MAP, *schema.ROLLUP_TABLE_MAP]:
+            table_ref = self.dataset_ref.table(table_name)
+            try:
+                self.client.delete_table(table_ref)
+            except NotFound:
+                pass
+        dataset = self.client.get_dataset(self.dataset_ref)
+        dataset.labels["version_major"] = None
+        dataset.labels["version_minor"] = None
+        self.client.update_dataset(dataset, ["labels"])
+
+    @staticmethod
+    def _unpack_row(row):
+        """
+        Unpack a retrieved object table row to the JSON-compatible and
+        schema-complying representation, dropping the service fields.
+
+        Args:
+            row:    The row to unpack.
+
+        Returns:
+            The unpacked object.
+        """
+        node = dict(row.items())
+        node.pop(schema.INGESTION_TIME_FIELD.name, None)
+        return misc.unpack_node(node)
+
+    def dump_incremental(self, since):
+        """
+        Dump data loaded into the database after a watermark.
+        See kcidb.db.Client.dump_incremental() for details.
+        """
+        # Don't let the watermark pass loads which could still be running
+        max_watermark = \
+            datetime.now(timezone.utc) - Driver._LOAD_LATENCY_MARGIN
+        watermark = since
+        time_column = schema.INGESTION_TIME_FIELD.name
+        if since is not None:
+            self._add_service_fields()
+        data = dict(version=dict(major=io.schema.LATEST.major,
+                                 minor=io.schema.LATEST.minor))
+        for obj_list_name in schema.TABLE_MAP:
+            if since is None:
+                params = []
+                sql = f"SELECT * FROM `{obj_list_name}`"
+            else:
+                params = [Driver._get_param("TIMESTAMP", since)]
+                sql = f"SELECT * FROM `{obj_list_name}` " \
+                    f"WHERE {time_column} > ?"
+            job_config = bigquery.job.QueryJobConfig(
+                query_parameters=params,
+                default_dataset=self.dataset_ref)
+            started = time.monotonic()
+            query_job = self.client.query(sql, job_config=job_config)
+            data[obj_list_name] = []
+            for row in query_job:
+                row_time = row.get(time_column)
+                if row_time is not None:
+                    row_time = min(row_time, max_watermark)
+                    # Don't move the watermark backwards, past "since"
+                    if watermark is None or row_time > watermark:
+                        watermark = row_time
+                data[obj_list_name].append(Driver._unpack_row(row))
+            self._record_job("dump", obj_list_name, query_job,
+                             len(data[obj_list_name]), started)
+
+        assert io.schema.is_valid_latest(data)
+        return data, watermark
+
+    def _get_record_batches(self, obj_list_name, table_ref):
+        """
+        Retrieve the contents of an object table, or a query result table
+        with the object table's schema, as Arrow record batches, page by
+        page.
+
+        Args:
+            obj_list_name:  The name of the object list the table contains.
+            table_ref:      The reference to the table to retrieve.
+
+        Returns:
+            An iterator returning pyarrow.RecordBatch objects conforming to
+            the object list's Arrow schema (see arrow.get_schema()).
+        """
+        row_iter = self.client.list_rows(
+            table_ref, selected_fields=schema.TABLE_MAP[obj_list_name]
+        )
+        for batch in row_iter.to_arrow_iterable():
+            yield arrow.conform_batch(obj_list_name, batch)
+
+    def dump_arrow(self, since):
+        """
+        Dump data from the database as Arrow record batches.
+        See kcidb.db.Client.dump_arrow() for details.
+        """
+        if since is not None:
+            self._add_service_fields()
+        for obj_list_name in schema.TABLE_MAP:
+            if since is None:
+                # Read the table directly, avoiding query costs
+                table_ref = self.dataset_ref.table(obj_list_name)
+            else:
+                job_config = bigquery.job.QueryJobConfig(
+                    query_parameters=[
+                        Driver._get_param("TIMESTAMP", since)
+                    ],
+                    default_dataset=self.dataset_ref)
+                started = time.monotonic()
+                query_job = self.client.query(
+                    f"SELECT * FROM `{obj_list_name}` "
+                    f"WHERE {schema.INGESTION_TIME_FIELD.name} > ?",
+                    job_config=job_config
+                )
+                rows = query_job.result().total_rows
+                self._record_job("dump", obj_list_name, query_job, rows,
+                                 started)
+                table_ref = query_job.destination
+            for batch in self._get_record_batches(obj_list_name, table_ref):
+                yield obj_list_name, batch
+
+    @staticmethod
+    def _get_param(field_type, value):
+        """
+        Create a query parameter for a scalar value of a field type.
+
+        Args:
+            field_type: The BigQuery type of the field.
+            value:      The value of the parameter.
+
+        Returns:
+            The query parameter.
+        """
+        if field_type == "NUMERIC":
+            value = decimal.Decimal(str(value))
+        return bigquery.ScalarQueryParameter(None, field_type, value)
+
+    @staticmethod
+    def _get_conditions(obj_list_name, bounds, filters_shape):
+        """
+        Generate a condition template limiting rows of an object list table
+        to those with their partitioning time within specified bounds, and
+        fields satisfying specified filters.
+
+        Args:
+            obj_list_name:  Name of the object list (and its table) to
+                            generate the condition for.
+            bounds:         A tuple of two booleans, True if the lower
+                            (inclusive), and the upper (exclusive) time bound
+                            is specified, respectively.
+            filters_shape:  The shape of the filters, as returned by
+                            misc.get_filters_shape().
+
+        Returns:
+            The condition text (empty, if not limited), and the list of its
+            parameter slots (see misc.get_slot_value()).
+        """
+        time_column = \
+            f"{obj_list_name}.{schema.TABLE_PARTITIONING_MAP[obj_list_name]}"
+        conditions = []
+        slots = []
+        if bounds[0]:
+            conditions.append(f"{time_column} >= ?")
+            slots.append(("since",))
+        if bounds[1]:
+            conditions.append(f"{time_column} < ?")
+            slots.append(("until",))
+        for field_name, op, range_bounds in \
+                dict(filters_shape).get(obj_list_name, ()):
+            column = f"{obj_list_name}.{field_name}"
+            slot = ("filter", obj_list_name, field_name, op, None)
+            if op == "=":
+                conditions.append(f"{column} = ?")
+                slots.append(slot)
+            elif op == "in":
+                conditions.append(f"{column} IN UNNEST(?)")
+                slots.append(slot)
+            elif op == "prefix":
+                conditions.append(f"STARTS_WITH({column}, ?)")
+                slots.append(slot)
+            elif op == "range":
+                if range_bounds[0]:
+                    conditions.append(f"{column} >= ?")
+                    slots.append(slot[:-1] + (0,))
+                if range_bounds[1]:
+                    conditions.append(f"{column} < ?")
+                    slots.append(slot[:-1] + (1,))
+        return " AND ".join(conditions), slots
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _get_query_template(children, parents, bounds, filters_shape,
+                            columns):
+        """
+        Generate templates of SELECT statements fetching objects matching
+        queries of a particular shape. Memoized, as the statement text only
+        depends on the query shape, and not on the values queried.
+
+        Args:
+            children:       True if children of matched objects should be
+                            matched as well.
+            parents:        True if parents of matched objects should be
+                            matched as well.
+            bounds:         A tuple of two booleans, True if the lower
+                            (inclusive), and the upper (exclusive)
+                            partitioning time bound is specified,
+                            respectively.
+            filters_shape:  The shape of the filters, as returned by
+                            misc.get_filters_shape().
+            columns:        The text of the list of columns to select from
+                            the matching objects.
+
+        Returns:
+            A dictionary of object list names and tuples containing a SELECT
+            statement and the tuple of its parameter slots (see
+            misc.get_slot_value()), fetching the matching objects of the
+            list.
+        """
+        # A dictionary of object list names and lists containing a SELECT
+        # statement and the list of its parameter slots, returning IDs of
+        # the objects to fetch, and a boolean, which is True if all the
+        # objects are known to be within the time bounds and to satisfy the
+        # filters
+        obj_list_queries = {}
+        for obj_list_name in io.schema.LATEST.tree:
+            if not obj_list_name:
+                continue
+            # JOIN selecting objects with IDs matching the patterns
+            query = [
+                f"SELECT {obj_list_name}.id AS id "
+                f"FROM {obj_list_name} "
+                f"INNER JOIN UNNEST(?) AS id_pattern "
+                f"ON {obj_list_name}.id LIKE id_pattern",
+                [("patterns", obj_list_name)],
+                True
+            ]
+            # Limit them by time and filters, if requested
+            condition, slots = \
+                Driver._get_conditions(obj_list_name, bounds, filters_shape)
+            if condition:
+                query[0] += f" WHERE {condition}"
+                query[1] += slots
+            query[0] += "\n"
+            obj_list_queries[obj_list_name] = query
+
+        def get_bound_condition(obj_list_name):
+            """
+            Get the time and filter condition (prefixed with AND) and its
+            parameter slots for selecting from the table of an object list,
+            if its ID query is within the time bounds and satisfies the
+            filters, empty otherwise.
+            """
+            if obj_list_queries[obj_list_name][2]:
+                condition, slots = \
+                    Driver._get_conditions(obj_list_name, bounds,
+                                           filters_shape)
+                if condition:
+                    return f" AND {condition}", slots
+            return "", []
+
+        # Add referenced parents if requested
+        if parents:
+            def add_parents(obj_list_name):
+                """Add parent IDs to query results"""
+                obj_name = obj_list_name[:-1]
+                query = obj_list_queries[obj_list_name]
+                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
+                    add_parents(child_list_name)
+                    child_query = obj_list_queries[child_list_name]
+                    condition, slots = get_bound_condition(child_list_name)
+                    query[0] += \
+                        "UNION DISTINCT\n" \
+                        f"SELECT {child_list_name}.{obj_name}_id AS id " \
+                        f"FROM {child_list_name} " + \
+                        f"WHERE {child_list_name}.id IN (\n" + \
+                        textwrap.indent(child_query[0], " " * 4) + \
+                        f"){condition}\n"
+                    query[1] += child_query[1] + slots
+                    query[2] = False
+
+            for obj_list_name in io.schema.LATEST.tree[""]:
+                add_parents(obj_list_name)
+
+        # Add referenced children if requested
+        if children:
+            def add_children(obj_list_name):
+                """Add child IDs to query results"""
+                obj_name = obj_list_name[:-1]
+                query = obj_list_queries[obj_list_name]
+                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
+                    child_query = obj_list_queries[child_list_name]
+                    child_query[0] += \
+                        "UNION DISTINCT\n" \
+                        f"SELECT {child_list_name}.id AS id " \
+                        f"FROM {child_list_name} " + \
+                        f"WHERE {child_list_name}.{obj_name}_id IN (\n" + \
+                        textwrap.indent(query[0], " " * 4) + \
+                        ")\n"
+                    child_query[1] += query[1]
+                    child_query[2] = False
+                    add_children(child_list_name)
+
+            for obj_list_name in io.schema.LATEST.tree[""]:
+                add_children(obj_list_name)
+
+        # Generate the statements fetching the objects, limiting them by
+        # time and filters, if possible, to let the database skip unneeded
+        # partitions and clustered blocks
+        obj_list_templates = {}
+        for obj_list_name, query in obj_list_queries.items():
+            condition, slots = get_bound_condition(obj_list_name)
+            obj_list_templates[obj_list_name] = (
+                f"SELECT {columns} FROM {obj_list_name} WHERE id IN (\n" +
+                query[0] +
+                f"){condition}\n",
+                tuple(query[1] + slots)
+            )
+        return obj_list_templates
+
+    @staticmethod
+    def _get_slot_param(slot, value):
+        """
+        Create a query parameter for a parameter slot's value.
+
+        Args:
+            slot:   The parameter slot (see misc.get_slot_value()).
+            value:  The raw value of the slot.
+
+        Returns:
+            The query parameter.
+        """
+        if slot[0] == "patterns":
+            return bigquery.ArrayQueryParameter(None, "STRING", value)
+        if slot[0] in ("since", "until"):
+            return Driver._get_param("TIMESTAMP", value)
+        field_type = misc.get_filter_field(slot[1], slot[2]).field_type
+        if slot[3] == "in":
+            return bigquery.ArrayQueryParameter(
+                None, field_type,
+                [Driver._get_param(field_type, v).value for v in value]
+            )
+        return Driver._get_param(field_type, value)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _get_query_sql(patterns, children, parents, since, until, filters,
+                       columns="*"):
+        """
+        Generate SELECT statements fetching objects matching a query.
+
+        Args:
+            patterns:   A dictionary of object list names, and lists of LIKE
+                        patterns, for IDs of objects to match.
+            children:   True if children of matched objects should be matched
+                        as well.
+            parents:    True if parents of matched objects should be matched
+                        as well.
+            since:      An "aware" datetime.datetime object specifying the
+                        earliest (inclusive) partitioning time of the objects
+                        to match, or None for no lower bound.
+            until:      An "aware" datetime.datetime object specifying the
+                        latest (exclusive) partitioning time of the objects
+                        to match, or None for no upper bound.
+            filters:    A dictionary of object list names, and dictionaries
+                        of their field names and filters, as accepted by
+                        query().
+            columns:    The text of the list of columns to select from the
+                        matching objects.
+
+        Returns:
+            A dictionary of object list names and tuples containing a SELECT
+            statement and the list of its parameters, fetching the matching
+            objects of the list.
+        """
+        obj_list_templates = Driver._get_query_template(
+            bool(children), bool(parents),
+            (since is not None, until is not None),
+            misc.get_filters_shape(filters), columns
+        )
+        return {
+            obj_list_name: (
+                sql,
+                [
+                    Driver._get_slot_param(
+                        slot,
+                        misc.get_slot_value(slot, patterns,
+                                            since, until, filters)
+                    )
+                    for slot in slots
+                ]
+            )
+            for obj_list_name, (sql, slots) in obj_list_templates.items()
+        }
+
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children, parents, since, until, filters):
+        """
+        Match and fetch objects from the database.
+        See kcidb.db.Client.query() for details.
+        """
+        # Fetch the data
+        data = dict(version=dict(major=io.schema.LATEST.major,
+                                 minor=io.schema.LATEST.minor))
+        for obj_list_name, (sql, params) in \
+                Driver._get_query_sql(patterns, children, parents,
+                                      since, until, filters).items():
+            job_config = bigquery.job.QueryJobConfig(
+                query_parameters=params,
+                default_dataset=self.dataset_ref
+            )
+            started = time.monotonic()
+            query_job = self.client.query(sql, job_config=job_config)
+            data[obj_list_name] = [
+                Driver._unpack_row(row) for row in query_job
+            ]
+            self._record_job("query", obj_list_name, query_job,
+                             len(data[obj_list_name]), started)
+
+        assert io.schema.is_valid_latest(data)
+        return data
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    @staticmethod
+    def _decode_page_token(token, obj_list_num):
+        """
+        Decode the state of a paged query from a continuation token.
+
+        Args:
+            token:          The continuation token to decode.
+            obj_list_num:   The number of object lists being queried.
+
+        Returns:
+            The decoded query state.
+
+        Raises:
+            `ValueError` if the token is invalid.
+        """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except ValueError as exc:
+            raise ValueError(f"Invalid page token {token!r}") from exc
+        if not isinstance(state, dict) or \
+           set(state) != {"index", "job_id", "location", "page"} or \
+           not isinstance(state["index"], int) or \
+           not 0 <= state["index"] < obj_list_num or \
+           not all(state[key] is None or isinstance(state[key], str)
+                   for key in ("job_id", "location", "page")):
+            raise ValueError(f"Invalid page token {token!r}")
+        return state
+
+    def query_page(self, patterns, children, parents, since, until, filters,
+                   page_size, token):
+        """
+        Match and fetch a page of objects from the database.
+        See kcidb.db.Client.query_page() for details.
+        """
+        obj_list_names = [name for name in io.schema.LATEST.tree if name]
+        # The state of the query: index of the object list being fetched,
+        # the ID and location of the job with its query results (if
+        # started), and the token of the next results page (if any)
+        if token is None:
+            state = dict(index=0, job_id=None, location=None, page=None)
+        else:
+            state = Driver._decode_page_token(token, len(obj_list_names))
+        obj_list_sql = None
+
+        data = dict(version=dict(major=io.schema.LATEST.major,
+                                 minor=io.schema.LATEST.minor))
+        remaining = page_size
+        while remaining > 0 and state["index"] < len(obj_list_names):
+            obj_list_name = obj_list_names[state["index"]]
+            # Run the query for the list, or reuse its results
+            if state["job_id"] is None:
+                if obj_list_sql is None:
+                    obj_list_sql = Driver._get_query_sql(
+                        patterns, children, parents, since, until, filters
+                    )
+                sql, params = obj_list_sql[obj_list_name]
+                job_config = bigquery.job.QueryJobConfig(
+                    query_parameters=params,
+                    default_dataset=self.dataset_ref
+                )
+                started = time.monotonic()
+                query_job = self.client.query(sql, job_config=job_config)
+                rows = query_job.result().total_rows
+                self._record_job("query", obj_list_name, query_job, rows,
+                                 started)
+                state["job_id"] = query_job.job_id
+                state["location"] = query_job.location
+            else:
+                query_job = self.client.get_job(state["job_id"],
+                                                location=state["location"])
+            # Fetch a page of the results
+            row_iter = self.client.list_rows(
+                query_job.destination,
+                selected_fields=schema.TABLE_MAP[obj_list_name],
+                page_size=remaining,
+                page_token=state["page"]
+            )
+            obj_list = [
+                Driver._unpack_row(row)
+                for row in next(row_iter.pages, [])
+            ]
+            if obj_list:
+                data.setdefault(obj_list_name, []).extend(obj_list)
+                remaining -= len(obj_list)
+            state["page"] = row_iter.next_page_token
+            # Move onto the next list, if this one is exhausted
+            if state["page"] is None:
+                state = dict(index=state["index"] + 1,
+                             job_id=None, location=None, page=None)
+
+        assert io.schema.is_valid_latest(data)
+        if state["index"] < len(obj_list_names):
+            token = base64.urlsafe_b64encode(
+                json.dumps(state).encode()
+            ).decode()
+        else:
+            token = None
+        return data, token
+
+    def query_arrow(self, patterns, children, parents, since, until,
+                    filters):
+        """
+        Match and fetch objects from the database as Arrow record
+        batches.
+        See kcidb.db.Client.query_arrow() for details.
+        """
+        for obj_list_name, (sql, params) in \
+                Driver._get_query_sql(patterns, children, parents,
+                                      since, until, filters).items():
+            job_config = bigquery.job.QueryJobConfig(
+                query_parameters=params,
+                default_dataset=self.dataset_ref
+            )
+            started = time.monotonic()
+            query_job = self.client.query(sql, job_config=job_config)
+            rows = query_job.result().total_rows
+            self._record_job("query", obj_list_name, query_job, rows,
+                             started)
+            for batch in self._get_record_batches(obj_list_name,
+                                                  query_job.destination):
+                yield obj_list_name, batch
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def aggregate(self, obj_list_name, group_by, patterns, children, parents,
+                  since, until, filters, path_depth):
+        """
+        Count matching objects, grouped by keys.
+        See kcidb.db.Client.aggregate() for details.
+        """
+        # Generate the key expressions
+        key_exprs = []
+        for key in group_by:
+            column = f"{obj_list_name}.{key}"
+            if key == "origin":
+                expr = f"SPLIT({obj_list_name}.id, ':')[OFFSET(0)]"
+            elif key == "path" and path_depth is not None:
+                expr = f"ARRAY_TO_STRING(ARRAY(" \
+                    f"SELECT part FROM UNNEST(SPLIT({column}, '.')) " \
+                    f"AS part WITH OFFSET AS part_index " \
+                    f"WHERE part_index < {path_depth} " \
+                    f"ORDER BY part_index), '.')"
+            else:
+                expr = column
+            key_exprs.append(f"{expr} AS {key}")
+
+        sql, params = Driver._get_query_sql(
+            patterns, children, parents, since, until, filters,
+            columns=", ".join(key_exprs + ["COUNT(*) AS count"])
+        )[obj_list_name]
+        if group_by:
+            # Refer to keys by position, as their names can match columns
+            positions = ", ".join(str(i + 1) for i in range(len(group_by)))
+            sql += f"GROUP BY {positions}\nORDER BY {positions}\n"
+
+        job_config = bigquery.job.QueryJobConfig(
+            query_parameters=params,
+            default_dataset=self.dataset_ref
+        )
+        started = time.monotonic()
+        query_job = self.client.query(sql, job_config=job_config)
+        groups = []
+        for row in query_job:
+            group = {}
+            for key, value in row.items():
+                if isinstance(value, decimal.Decimal):
+                    value = float(value)
+                elif isinstance(value, datetime):
+                    value = value.isoformat()
+                group[key] = value
+            groups.append(group)
+        self._record_job("aggregate", obj_list_name, query_job, len(groups),
+                         started)
+        return groups
+
+    def _load_table(self, table_ref, obj_list_name, obj_list):
+        """
+        Load a list of packed objects into a table, appending them.
+
+        Args:
+            table_ref:      Reference to the table to load the objects into.
+            obj_list_name:  Name of the object list the objects belong to,
+                            determining the table schema.
+            obj_list:       The list of packed objects to load, including
+                            service fields.
+        """
+        job_config = bigquery.job.LoadJobConfig(
+            autodetect=False,
+            schema=schema.STORAGE_TABLE_MAP[obj_list_name],
+            # Add service fields missing from older tables
+            schema_update_options=[
+                bigquery.job.SchemaUpdateOption.ALLOW_FIELD_ADDITION
+            ])
+        started = time.monotonic()
+        job = self.client.load_table_from_json(obj_list, table_ref,
+                                               job_config=job_config)
+        try:
+            job.result()
+        except BadRequest:
+            raise Exception("".join([
+                f"ERROR: {error['message']}\n" for error in job.errors
+            ]))
+        self._record_job("load", obj_list_name, job, job.output_rows,
+                         started)
+
+    @staticmethod
+    def _get_merge_sql(obj_list_name, staging_table_name):
+        """
+        Generate a MERGE statement upserting objects from a staging table
+        into the table for an object list, matching them by ID.
+
+        Args:
+            obj_list_name:      Name of the object list (and its table) to
+                                merge the objects into.
+            staging_table_name: Name of the staging table to merge the
+                                objects from. Must have the same schema as
+                                the target table, and must not contain
+                                duplicate IDs.
+
+        Returns:
+            The MERGE statement text.
+        """
+        assignments = ",\n".join(
+            f"        {field.name} = source.{field.name}"
+            for field in schema.STORAGE_TABLE_MAP[obj_list_name]
+            if field.name != "id"
+        )
+        return \
+            f"MERGE `{obj_list_name}` AS target\n" \
+            f"USING `{staging_table_name}` AS source\n" \
+            f"ON target.id = source.id\n" \
+            f"WHEN MATCHED THEN\n" \
+            f"    UPDATE SET\n" \
+            f"{assignments}\n" \
+            f"WHEN NOT MATCHED THEN\n" \
+            f"    INSERT ROW\n"
+
+    def _upsert_table(self, obj_list_name, obj_list):
+        """
+        Upsert a list of packed objects into the table for an object list,
+        via a temporary staging table.
+
+        Args:
+            obj_list_name:  Name of the object list (and its table) to upsert
+                            the objects into.
+            obj_list:       The list of packed objects to upsert. Must not
+                            contain duplicate IDs.
+
+        Returns:
+            The number of inserted rows, and the number of merged (updated)
+            rows.
+        """
+        staging_table_name = \
+            f"_staging_{obj_list_name}_{uuid.uuid4().hex}"
+        staging_table_ref = self.dataset_ref.table(staging_table_name)
+        staging_table = bigquery.table.Table(
+            staging_table_ref, schema=schema.STORAGE_TABLE_MAP[obj_list_name]
+        )
+        # Make sure the staging table goes away, even if we crash
+        staging_table.expires = \
+            datetime.now(timezone.utc) + Driver._STAGING_TABLE_LIFETIME
+        self.client.create_table(staging_table)
+        try:
+            self._load_table(staging_table_ref, obj_list_name, obj_list)
+            job_config = bigquery.job.QueryJobConfig(
+                default_dataset=self.dataset_ref)
+            started = time.monotonic()
+            query_job = self.client.query(
+                Driver._get_merge_sql(obj_list_name, staging_table_name),
+                job_config=job_config
+            )
+            query_job.result()
+            self._record_job("load", obj_list_name, query_job,
+                             query_job.num_dml_affected_rows, started)
+        finally:
+            try:
+                self.client.delete_table(staging_table_ref)
+            except NotFound:
+                pass
+        dml_stats = query_job.dml_stats
+        return dml_stats.inserted_row_count, dml_stats.updated_row_count
+
+    @staticmethod
+    def _get_worst_order(status_column, waived_column):
+        """
+        Generate an ORDER BY expression list sorting tests (or their
+        summaries) from the worst status to the best, the same way
+        notification templates do, according to kcidb.oo.misc.Status and
+        kcidb.oo.misc.Waived.
+
+        Args:
+            status_column:  The name of the column with test status.
+            waived_column:  The name of the column with test "waived" flag.
+
+        Returns:
+            The ORDER BY expression list text.
+        """
+        status_rank = \
+            f"CASE {status_column} " + \
+            "".join(f"WHEN '{status.name}' THEN {status.value} "
+                    for status in Status if status != Status.NONE) + \
+            f"ELSE {Status.NONE.value} END"
+        waived_rank = \
+            f"CASE {waived_column} " \
+            f"WHEN TRUE THEN {Waived.TRUE.value} " \
+            f"WHEN FALSE THEN {Waived.FALSE.value} " \
+            f"ELSE {Waived.UNKNOWN.value} END"
+        return f"({waived_rank}) * ({status_rank}) DESC, {waived_rank} DESC"
+
+    @staticmethod
+    def _get_worst_sql(structs, field=None):
+        """
+        Generate an expression picking the worst of test status and
+        "waived" flag pairs, skipping missing ones.
+
+        Args:
+            structs:    A list of expressions evaluating to STRUCTs with
+                        "status" and "waived" fields, or NULL.
+            field:      The name of the field of the worst pair to return,
+                        or None to return the whole pair.
+
+        Returns:
+            The expression text, evaluating to NULL if there are no pairs.
+        """
+        return \
+            f"(SELECT w{'.' + field if field else ''} " \
+            f"FROM UNNEST([{', '.join(structs)}]) AS w " \
+            "WHERE w.status IS NOT NULL OR w.waived IS NOT NULL " \
+            "ORDER BY " + Driver._get_worst_order("w.status", "w.waived") + \
+            " LIMIT 1)"
+
+    @staticmethod
+    def _get_status_count_columns(template):
+        """
+        Generate the list of columns with test status counts for a rollup
+        table, in the order of schema.TEST_STATUS_FIELDS, except the worst
+        status fields.
+
+        Args:
+            template:   The template of the column expression, with
+                        "{name}" replaced with the name of the count field,
+                        and "{condition}" - with the condition a row of the
+                        "tests" table (or parameter) must match to be
+                        counted in it.
+
+        Returns:
+            The list of column expressions.
+        """
+        columns = []
+        for field in schema.TEST_STATUS_FIELDS:
+            if not field.name.endswith("_count"):
+                continue
+            if field.name == "test_count":
+                condition = "tests.id IS NOT NULL"
+            elif field.name == "none_count":
+                condition = "tests.status IS NULL"
+            else:
+                condition = \
+                    f"tests.status = '{field.name[:-len('_count')].upper()}'"
+            columns.append(
+                template.format(name=field.name, condition=condition) +
+                f" AS {field.name}"
+            )
+        return columns
+
+    @staticmethod
+    def _get_rollup_merge_sql(table_name, key_column, source_sql):
+        """
+        Generate a MERGE statement adding changes to rows of a rollup
+        table: adding to the counts and durations, picking the worst of
+        the statuses, and replacing the other fields, if specified.
+        Missing rows are inserted from the changes as is.
+
+        Args:
+            table_name:     The name of the rollup table.
+            key_column:     The name of the column identifying the rows.
+            source_sql:     The SELECT statement returning the changes to
+                            the rows, with the columns in the table's order.
+
+        Returns:
+            The MERGE statement text.
+        """
+        assignments = []
+        for field in schema.ROLLUP_TABLE_MAP[table_name]:
+            name = field.name
+            if name == key_column:
+                continue
+            if name.endswith("_count"):
+                value = f"target.{name} + source.{name}"
+            elif name.endswith("_duration"):
+                value = f"(SELECT SUM(d) FROM " \
+                    f"UNNEST([target.{name}, source.{name}]) AS d)"
+            elif name.startswith("worst_"):
+                value = Driver._get_worst_sql(
+                    [
+                        f"STRUCT({alias}.worst_status AS status, "
+                        f"{alias}.worst_waived AS waived)"
+                        for alias in ("target", "source")
+                    ],
+                    name[len("worst_"):]
+                )
+            elif name == "updated_at":
+                value = f"source.{name}"
+            else:
+                value = f"IFNULL(source.{name}, target.{name})"
+            assignments.append(f"        {name} = {value}")
+        return \
+            f"MERGE `{table_name}` AS target\n" \
+            f"USING (\n" + \
+            textwrap.indent(source_sql, " " * 4) + \
+            f") AS source\n" \
+            f"ON target.{key_column} = source.{key_column}\n" \
+            f"WHEN MATCHED THEN\n" \
+            f"    UPDATE SET\n" + \
+            ",\n".join(assignments) + "\n" \
+            "WHEN NOT MATCHED THEN\n" \
+            "    INSERT ROW\n"
+
+    @staticmethod
+    def _get_rollup_deltas_sql():
+        """
+        Generate a WITH clause defining the "build_deltas" table with
+        changes to build rollups from loading objects: one row per affected
+        build, with the ID of the build's revision (if the build was
+        loaded), the changes to test status counts, the worst status of
+        the loaded tests, and the change to the total test duration.
+
+        The changes are computed from the "builds" and "tests" parameters
+        only: arrays of the loaded objects with "sign" 1, and their
+        previously stored versions with "sign" -1.
+
+        Returns:
+            The WITH clause text, without the trailing newline.
+        """
+        test_columns = ",\n".join(
+            ["tests.build_id AS build_id"] +
+            Driver._get_status_count_columns(
+                "SUM(IF({condition}, tests.sign, 0))"
+            ) +
+            [
+                "ARRAY_AGG(IF(tests.sign > 0, "
+                "STRUCT(tests.status AS status, tests.waived AS waived), "
+                "NULL) IGNORE NULLS ORDER BY " +
+                Driver._get_worst_order("tests.status", "tests.waived") +
+                " LIMIT 1)[SAFE_OFFSET(0)] AS worst",
+                "SUM(tests.sign * tests.duration) AS test_duration",
+            ]
+        )
+        build_columns = ",\n".join(
+            ["build_id", "loaded_builds.revision_id"] +
+            Driver._get_status_count_columns("IFNULL(test_deltas.{name}, 0)") +
+            ["test_deltas.worst", "test_deltas.test_duration"]
+        )
+        return \
+            "WITH test_deltas AS (\n" \
+            "    SELECT\n" + \
+            textwrap.indent(test_columns, " " * 8) + "\n" \
+            "    FROM UNNEST(@tests) AS tests\n" \
+            "    GROUP BY tests.build_id\n" \
+            "), build_deltas AS (\n" \
+            "    SELECT\n" + \
+            textwrap.indent(build_columns, " " * 8) + "\n" \
+            "    FROM test_deltas\n" \
+            "    FULL JOIN (\n" \
+            "        SELECT id AS build_id, revision_id\n" \
+            "        FROM UNNEST(@builds)\n" \
+            "        WHERE sign > 0\n" \
+            "    ) AS loaded_builds USING (build_id)\n" \
+            ")"
+
+    @staticmethod
+    def _get_build_rollups_sql():
+        """
+        Generate a MERGE statement adding changes from loading objects to
+        build rollups. See _get_rollup_deltas_sql() for the parameters.
+
+        Returns:
+            The MERGE statement text.
+        """
+        source_sql = \
+            Driver._get_rollup_deltas_sql() + "\n" \
+            "SELECT * EXCEPT(worst, test_duration),\n" \
+            "    worst.status AS worst_status,\n" \
+            "    worst.waived AS worst_waived,\n" \
+            "    test_duration,\n" \
+            "    CURRENT_TIMESTAMP() AS updated_at\n" \
+            "FROM build_deltas\n"
+        return Driver._get_rollup_merge_sql("build_rollups", "build_id",
+                                            source_sql)
+
+    @staticmethod
+    def _get_revision_rollups_sql():
+        """
+        Generate a MERGE statement adding changes from loading objects to
+        revision rollups, and creating rollups for revisions with IDs in
+        the "revision_ids" parameter. Must be executed before updating
+        the build rollups, as the totals of builds moving between
+        revisions are taken from them. Only the build rollups with IDs in
+        the "build_ids" parameter are read. See _get_rollup_deltas_sql()
+        for the other parameters.
+
+        Returns:
+            The MERGE statement text.
+        """
+        zero_build_counts = [
+            "0 AS build_count",
+            "0 AS valid_build_count",
+            "0 AS invalid_build_count",
+        ]
+        zero_test_counts = Driver._get_status_count_columns("0")
+        # The updated totals of affected builds, added to their current
+        # revisions
+        added_columns = \
+            [
+                "IFNULL(build_deltas.revision_id, "
+                "affected_rollups.revision_id) AS revision_id",
+            ] + \
+            zero_build_counts + \
+            Driver._get_status_count_columns(
+                "IFNULL(affected_rollups.{name}, 0) + build_deltas.{name}"
+            ) + \
+            [
+                Driver._get_worst_sql([
+                    "STRUCT(affected_rollups.worst_status AS status, "
+                    "affected_rollups.worst_waived AS waived)",
+                    "build_deltas.worst",
+                ]) + " AS worst",
+                "NULL AS build_duration",
+                "(SELECT SUM(d) FROM UNNEST([affected_rollups.test_duration, "
+                "build_deltas.test_duration]) AS d) AS test_duration",
+            ]
+        # The previous totals of affected builds, removed from their
+        # previous revisions
+        removed_columns = \
+            ["affected_rollups.revision_id"] + \
+            zero_build_counts + \
+            Driver._get_status_count_columns("-affected_rollups.{name}") + \
+            [
+                "NULL AS worst",
+                "NULL AS build_duration",
+                "-affected_rollups.test_duration AS test_duration",
+            ]
+        # The loaded builds, replacing their previous versions
+        build_columns = \
+            [
+                "builds.revision_id",
+                "builds.sign AS build_count",
+                "IF(builds.valid, builds.sign, 0) AS valid_build_count",
+                "IF(NOT builds.valid, builds.sign, 0) "
+                "AS invalid_build_count",
+            ] + \
+            zero_test_counts + \
+            [
+                "NULL AS worst",
+                "builds.sign * builds.duration AS build_duration",
+                "NULL AS test_duration",
+            ]
+        # The loaded revisions, possibly without any builds
+        revision_columns = \
+            ["revision_id"] + zero_build_counts + zero_test_counts + \
+            ["NULL AS worst", "NULL AS build_duration",
+             "NULL AS test_duration"]
+        total_columns = \
+            [
+                "changes.revision_id",
+                "SUM(changes.build_count) AS build_count",
+                "SUM(changes.valid_build_count) AS valid_build_count",
+                "SUM(changes.invalid_build_count) AS invalid_build_count",
+            ] + \
+            Driver._get_status_count_columns("SUM(changes.{name})") + \
+            [
+                "ARRAY_AGG(changes.worst IGNORE NULLS ORDER BY " +
+                Driver._get_worst_order("changes.worst.status",
+                                        "changes.worst.waived") +
+                " LIMIT 1)[SAFE_OFFSET(0)] AS worst",
+                "SUM(changes.build_duration) AS build_duration",
+                "SUM(changes.test_duration) AS test_duration",
+            ]
+
+        def select(columns):
+            return "SELECT\n" + \
+                textwrap.indent(",\n".join(columns), " " * 4) + "\n"
+
+        source_sql = \
+            Driver._get_rollup_deltas_sql() + ", affected_rollups AS (\n" \
+            "    SELECT * FROM `build_rollups`\n" \
+            "    WHERE build_id IN UNNEST(@build_ids)\n" \
+            "), changes AS (\n" + \
+            textwrap.indent(
+                select(added_columns) +
+                "FROM build_deltas\n"
+                "LEFT JOIN affected_rollups USING (build_id)\n"
+                "UNION ALL\n" +
+                select(removed_columns) +
+                "FROM build_deltas\n"
+                "INNER JOIN affected_rollups USING (build_id)\n"
+                "UNION ALL\n" +
+                select(build_columns) +
+                "FROM UNNEST(@builds) AS builds\n"
+                "UNION ALL\n" +
+                select(revision_columns) +
+                "FROM UNNEST(@revision_ids) AS revision_id\n",
+                " " * 4
+            ) + \
+            ")\n" \
+            "SELECT * EXCEPT(worst, build_duration, test_duration),\n" \
+            "    worst.status AS worst_status,\n" \
+            "    worst.waived AS worst_waived,\n" \
+            "    build_duration,\n" \
+            "    test_duration,\n" \
+            "    CURRENT_TIMESTAMP() AS updated_at\n" \
+            "FROM (\n" + \
+            textwrap.indent(select(total_columns), " " * 4) + \
+            "    FROM changes\n" \
+            "    WHERE changes.revision_id IS NOT NULL\n" \
+            "    GROUP BY changes.revision_id\n" \
+            ")\n"
+        return Driver._get_rollup_merge_sql("revision_rollups",
+                                            "revision_id", source_sql)
+
+    @staticmethod
+    def _get_previous_sql(obj_list_name):
+        """
+        Generate a SELECT statement returning the fields affecting rollups
+        of the last stored versions of objects with IDs in the "ids"
+        parameter. The objects are only looked up in the partitions with
+        start times in the "<partitioning field>s" parameter, and without
+        start times.
+
+        Args:
+            obj_list_name:  Name of the object list to look up the objects
+                            in: "builds" or "tests".
+
+        Returns:
+            The SELECT statement text.
+        """
+        ingestion_time = schema.INGESTION_TIME_FIELD.name
+        partitioning = schema.TABLE_PARTITIONING_MAP[obj_list_name]
+        columns = ", ".join(f"t.{name}" for name in
+                            Driver._ROLLUP_FIELD_TYPES[obj_list_name])
+        return \
+            f"SELECT AS VALUE ARRAY_AGG(\n" \
+            f"    STRUCT({columns})\n" \
+            f"    ORDER BY t.{ingestion_time} DESC LIMIT 1\n" \
+            f")[OFFSET(0)]\n" \
+            f"FROM `{obj_list_name}` AS t\n" \
+            f"WHERE t.id IN UNNEST(@ids) AND\n" \
+            f"      (t.{partitioning} IS NULL OR\n" \
+            f"       t.{partitioning} IN UNNEST(@{partitioning}s))\n" \
+            f"GROUP BY t.id\n"
+
+    def _get_previous(self, data):
+        """
+        Get the stored versions of the builds and tests about to be loaded,
+        to be replaced with the loaded ones in rollups. The start times of
+        builds and tests are expected to not change between submissions,
+        as the previous versions are only looked up in the partitions of
+        the loaded ones.
+
+        Args:
+            data:   The JSON data about to be loaded, adhering to the latest
+                    I/O schema.
+
+        Returns:
+            A dictionary of object list names and lists of the previously
+            stored objects, as dictionaries of fields from
+            _ROLLUP_FIELD_TYPES.
+        """
+        assert io.schema.is_valid_latest(data)
+        previous = {}
+        for obj_list_name in self._ROLLUP_FIELD_TYPES:
+            obj_list = data.get(obj_list_name, [])
+            if not obj_list:
+                continue
+            partitioning = schema.TABLE_PARTITIONING_MAP[obj_list_name]
+            job_config = bigquery.job.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ArrayQueryParameter(
+                        "ids", "STRING",
+                        sorted({obj["id"] for obj in obj_list})
+                    ),
+                    bigquery.ArrayQueryParameter(
+                        f"{partitioning}s", "TIMESTAMP",
+                        sorted({obj[partitioning] for obj in obj_list
+                                if partitioning in obj})
+                    ),
+                ],
+                default_dataset=self.dataset_ref
+            )
+            started = time.monotonic()
+            query_job = self.client.query(
+                Driver._get_previous_sql(obj_list_name),
+                job_config=job_config
+            )
+            previous[obj_list_name] = [dict(row.items()) for row in query_job]
+            self._record_job("load", obj_list_name, query_job,
+                             len(previous[obj_list_name]), started)
+        return previous
+
+    @staticmethod
+    def _get_rows_param(name, field_types, rows):
+        """
+        Create an array query parameter with objects for updating rollups.
+
+        Args:
+            name:           The name of the parameter.
+            field_types:    A dictionary of names of the object fields to
+                            include, and their BigQuery types.
+            rows:           A list of tuples, each containing an object
+                            (a dictionary), and its "sign": 1 for a loaded
+                            object, and -1 for a replaced one.
+
+        Returns:
+            The query parameter: an array of STRUCTs with the object
+            fields and the "sign".
+        """
+        field_types = dict(field_types, sign="INT64")
+        values = []
+        for obj, sign in rows:
+            fields = []
+            for field_name, field_type in field_types.items():
+                value = sign if field_name == "sign" else obj.get(field_name)
+                if field_type == "NUMERIC" and value is not None:
+                    value = decimal.Decimal(str(value))
+                fields.append(bigquery.ScalarQueryParameter(
+                    field_name, field_type, value
+                ))
+            values.append(bigquery.StructQueryParameter(None, *fields))
+        return bigquery.ArrayQueryParameter(
+            name,
+            bigquery.StructQueryParameterType(*(
+                bigquery.ScalarQueryParameterType(field_type, name=field_name)
+                for field_name, field_type in field_types.items()
+            )),
+            values
+        )
+
+    def _update_rollups(self, data, previous):
+        """
+        Add changes from loading data to the rollup tables: add the loaded
+        builds and tests to the rollups of their parents, replacing their
+        previously stored versions, and create rollups for the loaded
+        revisions and builds, if missing. Only the loaded objects and the
+        rollups of the affected objects are read.
+
+        The worst status in rollups can only get worse, as tests replaced
+        with versions having a better status are not accounted for.
+
+        Args:
+            data:       The loaded JSON data, adhering to the latest I/O
+                        schema.
+            previous:   The previously stored versions of the loaded
+                        objects, as returned by _get_previous() before
+                        loading.
+        """
+        assert io.schema.is_valid_latest(data)
+        assert isinstance(previous, dict)
+        query_parameters = []
+        build_ids = set()
+        for obj_list_name, field_types in self._ROLLUP_FIELD_TYPES.items():
+            # Only the last of the loaded objects with the same ID counts
+            loaded = {
+                obj["id"]: obj for obj in data.get(obj_list_name, [])
+            }.values()
+            rows = [(obj, 1) for obj in loaded] + \
+                [(obj, -1) for obj in previous.get(obj_list_name, [])]
+            build_id_field = "id" if obj_list_name == "builds" else "build_id"
+            build_ids |= {obj[build_id_field] for obj, _ in rows}
+            query_parameters.append(
+                Driver._get_rows_param(obj_list_name, field_types, rows)
+            )
+        revision_ids = {revision["id"]
+                        for revision in data.get("revisions", [])}
+        if not build_ids and not revision_ids:
+            return
+        query_parameters += [
+            bigquery.ArrayQueryParameter("build_ids", "STRING",
+                                         sorted(build_ids)),
+            bigquery.ArrayQueryParameter("revision_ids", "STRING",
+                                         sorted(revision_ids)),
+        ]
+        job_config = bigquery.job.QueryJobConfig(
+            query_parameters=query_parameters,
+            default_dataset=self.dataset_ref
+        )
+        started = time.monotonic()
+        query_job = self.client.query(
+            "BEGIN TRANSACTION;\n" +
+            Driver._get_revision_rollups_sql() + ";\n" +
+            Driver._get_build_rollups_sql() + ";\n" +
+            "COMMIT TRANSACTION;\n",
+            job_config=job_config
+        )
+        query_job.result()
+        self._record_job("load", "rollups", query_job,
+                         query_job.num_dml_affected_rows, started)
+
+    def get_rollups(self, obj_list_name, ids):
+        """
+        Get aggregated data for objects from the rollup tables.
+        See kcidb.db.Client.get_rollups() for details.
+        """
+        obj_name = obj_list_name[:-1]
+        job_config = bigquery.job.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter(None, "STRING", ids)
+            ],
+            default_dataset=self.dataset_ref
+        )
+        started = time.monotonic()
+        query_job = self.client.query(
+            f"SELECT * FROM `{obj_name}_rollups`\n"
+            f"WHERE {obj_name}_id IN UNNEST(?)\n",
+            job_config=job_config
+        )
+        rollups = {
+            row[f"{obj_name}_id"]: misc.unpack_node(dict(row.items()))
+            for row in query_job
+        }
+        self._record_job("get_rollups", f"{obj_name}_rollups", query_job,
+                         len(rollups), started)
+        return rollups
+
+    def load(self, data, upsert, rollup):
+        """
+        Load data adhering to the latest I/O schema into the database.
+        See kcidb.db.Client.load() for details.
+        """
+        self._add_service_fields()
+        ingestion_time = datetime.now(timezone.utc).isoformat()
+        # Rollups are updated with the differences from the replaced objects
+        previous = self._get_previous(data) if rollup else {}
+        stats = {}
+        for obj_list_name in schema.TABLE_MAP:
+            if obj_list_name in data:
+                obj_list = misc.pack_node(data[obj_list_name])
+                for obj in obj_list:
+                    obj[schema.INGESTION_TIME_FIELD.name] = ingestion_time
+                if upsert:
+                    # Keep only the last object with each ID
+                    obj_list = list({
+                        obj["id"]: obj for obj in obj_list
+                    }.values())
+                    stats[obj_list_name] = \
+                        self._upsert_table(obj_list_name, obj_list)
+                else:
+                    self._load_table(self.dataset_ref.table(obj_list_name),
+                                     obj_list_name, obj_list)
+                    stats[obj_list_name] = (len(obj_list), 0)
+        if rollup:
+            self._update_rollups(data, previous)
+        return stats
+
+    @staticmethod
+    def _get_compact_sql(obj_list_name):
+        """
+        Generate a MERGE statement removing rows with duplicate IDs from the
+        table for an object list, in place, keeping the last loaded row for
+        each ID.
+
+        Args:
+            obj_list_name:  Name of the object list (and its table) to
+                            generate the statement for.
+
+        Returns:
+            The MERGE statement text.
+        """
+        ingestion_time = schema.INGESTION_TIME_FIELD.name
+        return \
+            f"MERGE `{obj_list_name}` AS target\n" \
+            f"USING (\n" \
+            f"    SELECT AS VALUE ARRAY_AGG(\n" \
+            f"        original ORDER BY original.{ingestion_time} DESC\n" \
+            f"        LIMIT 1\n" \
+            f"    )[OFFSET(0)]\n" \
+            f"    FROM `{obj_list_name}` AS original\n" \
+            f"    GROUP BY original.id\n" \
+            f") AS source\n" \
+            f"ON FALSE\n" \
+            f"WHEN NOT MATCHED BY SOURCE THEN\n" \
+            f"    DELETE\n" \
+            f"WHEN NOT MATCHED BY TARGET THEN\n" \
+            f"    INSERT ROW\n"
+
+    def compact(self):
+        """
+        Remove rows with duplicate IDs from the database tables, in place,
+        keeping the last loaded row for each ID.
+        See kcidb.db.Client.compact() for details.
+        """
+        self._add_service_fields()
+        stats = {}
+        job_config = bigquery.job.QueryJobConfig(
+            default_dataset=self.dataset_ref)
+        for obj_list_name in schema.TABLE_MAP:
+            # Check for duplicates first, scanning only the ID column
+            started = time.monotonic()
+            query_job = self.client.query(
+                f"SELECT COUNT(*) AS total, COUNT(DISTINCT id) AS ids\n"
+                f"FROM `{obj_list_name}`\n",
+                job_config=job_config
+            )
+            row = next(iter(query_job.result()))
+            self._record_job("compact", obj_list_name, query_job, 1, started)
+            if row.total == row.ids:
+                stats[obj_list_name] = (row.total, 0)
+                continue
+            # Rewrite the table with duplicates removed
+            started = time.monotonic()
+            query_job = self.client.query(
+                Driver._get_compact_sql(obj_list_name),
+                job_config=job_config
+            )
+            query_job.result()
+            self._record_job("compact", obj_list_name, query_job,
+                             query_job.num_dml_affected_rows, started)
+            dml_stats = query_job.dml_stats
+            stats[obj_list_name] = (
+                dml_stats.inserted_row_count,
+                dml_stats.deleted_row_count - dml_stats.inserted_row_count
+            )
+        return stats
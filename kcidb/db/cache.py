@@ -0,0 +1,510 @@
+"""Kernel CI report database - caches"""
+
+import os
+import copy
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+from kcidb import io
+
+
+class ObjectCache:
+    """
+    A read-through cache of database objects, keyed by object list name and
+    object ID, serving complement() requests. Keeps the objects in an
+    in-memory LRU cache, and optionally in an on-disk SQLite database.
+
+    Each cached object is stored along with the IDs of its children, if
+    they're known to be complete, i.e. the object was retrieved with all
+    its children, and all children loaded afterwards were passed to
+    update(). As children loaded by other processes (or database clients)
+    are not seen, the children are only considered complete for a limited
+    time after retrieval.
+    """
+
+    def __init__(self, max_size=10000, path=None, ttl=60):
+        """
+        Initialize an object cache.
+
+        Args:
+            max_size:   The maximum number of objects to keep in memory.
+            path:       The path to the SQLite database file to keep
+                        the objects on disk in, without limit, or None to
+                        keep them in memory only.
+            ttl:        The number of seconds the children of an object
+                        retrieved from the database are considered
+                        complete for, or None to consider them complete
+                        until evicted. Only use None if every load into
+                        the database goes through this cache.
+        """
+        assert isinstance(max_size, int) and max_size > 0
+        assert path is None or isinstance(path, str)
+        assert ttl is None or isinstance(ttl, (int, float)) and ttl >= 0
+        self.max_size = max_size
+        self.ttl = ttl
+        # An ordered dictionary of (obj_list_name, id) tuples and
+        # (object, child IDs, expiration time) tuples, from least to most
+        # recently used
+        self.entries = OrderedDict()
+        self.conn = None
+        if path is not None:
+            self.conn = sqlite3.connect(path, isolation_level=None)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects (\n"
+                "    obj_list_name TEXT NOT NULL,\n"
+                "    id TEXT NOT NULL,\n"
+                "    obj TEXT NOT NULL,\n"
+                "    child_ids TEXT,\n"
+                "    expires REAL,\n"
+                "    PRIMARY KEY (obj_list_name, id)\n"
+                ")"
+            )
+        # A map of object list names to their parent list names,
+        # empty for the root lists
+        self.parent_map = {
+            child_list_name: obj_list_name
+            for obj_list_name, child_list_names in
+            io.schema.LATEST.tree.items()
+            for child_list_name in child_list_names
+        }
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_env():
+        """
+        Create an object cache configured with environment variables:
+        KCIDB_DB_CACHE_SIZE - the maximum number of objects to keep in
+        memory, KCIDB_DB_CACHE_PATH - the path to the SQLite database file
+        to keep the objects on disk in, and KCIDB_DB_CACHE_TTL - the number
+        of seconds children of retrieved objects are considered complete
+        for.
+
+        Returns:
+            The created cache, or None if neither KCIDB_DB_CACHE_SIZE, nor
+            KCIDB_DB_CACHE_PATH are set, or both are empty.
+        """
+        size = os.environ.get("KCIDB_DB_CACHE_SIZE")
+        path = os.environ.get("KCIDB_DB_CACHE_PATH")
+        if not size and not path:
+            return None
+        return ObjectCache(
+            max_size=int(size or "10000"),
+            path=path or None,
+            ttl=float(os.environ.get("KCIDB_DB_CACHE_TTL", "60"))
+        )
+
+    @property
+    def hit_ratio(self):
+        """
+        The ratio of complement() requests served from the cache to all
+        requests, or None if there were no requests.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def get_stats(self):
+        """
+        Get cache statistics.
+
+        Returns:
+            A dictionary with the number of complement() requests served
+            from the cache ("hits"), not served ("misses"), the hit ratio
+            ("hit_ratio", None if there were no requests), and the number
+            of objects in memory ("size").
+        """
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_ratio=self.hit_ratio, size=len(self.entries))
+
+    def _get(self, obj_list_name, obj_id):
+        """
+        Get a cached object.
+
+        Args:
+            obj_list_name:  The name of the object's list.
+            obj_id:         The ID of the object.
+
+        Returns:
+            The object, a dictionary of its child list names and sets
+            of child IDs (None if not known to be complete), and the time
+            (time.time()) the children stop being considered complete
+            (None if never), or None if the object is not cached.
+        """
+        key = (obj_list_name, obj_id)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            "SELECT obj, child_ids, expires FROM objects "
+            "WHERE obj_list_name = ? AND id = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        child_ids = json.loads(row[1])
+        entry = (
+            json.loads(row[0]),
+            None if child_ids is None else
+            {name: set(ids) for name, ids in child_ids.items()},
+            row[2]
+        )
+        self._put(obj_list_name, obj_id, entry, store=False)
+        return entry
+
+    def _put(self, obj_list_name, obj_id, entry, store=True):
+        """
+        Put an object into the cache.
+
+        Args:
+            obj_list_name:  The name of the object's list.
+            obj_id:         The ID of the object.
+            entry:          The object, a dictionary of its child list
+                            names and sets of child IDs (None if not known
+                            to be complete), and the time the children stop
+                            being considered complete (None if never).
+            store:          True if the object should be stored on disk
+                            (if enabled), False if it's already there.
+        """
+        key = (obj_list_name, obj_id)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        if store and self.conn is not None:
+            obj, child_ids, expires = entry
+            self.conn.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                (obj_list_name, obj_id, json.dumps(obj),
+                 json.dumps(None if child_ids is None else {
+                     name: sorted(ids) for name, ids in child_ids.items()
+                 }),
+                 expires)
+            )
+
+    def _link(self, obj_list_name, obj_id, parent_id, linked):
+        """
+        Add or remove an object from the complete children of its cached
+        parent, if any.
+
+        Args:
+            obj_list_name:  The name of the object's list.
+            obj_id:         The ID of the object.
+            parent_id:      The ID of the object's parent.
+            linked:         True if the object should be added to the
+                            parent's children, False if removed.
+        """
+        parent_list_name = self.parent_map[obj_list_name]
+        parent_entry = self._get(parent_list_name, parent_id)
+        if parent_entry is None or parent_entry[1] is None:
+            return
+        if linked:
+            parent_entry[1][obj_list_name].add(obj_id)
+        else:
+            parent_entry[1][obj_list_name].discard(obj_id)
+        self._put(parent_list_name, parent_id, parent_entry)
+
+    def update(self, data, complete=False):
+        """
+        Update the cache with objects from the database, or loaded into it.
+
+        Args:
+            data:       The JSON data with the objects, adhering to the
+                        latest I/O schema.
+            complete:   True if the data contains all children of each
+                        object in it (e.g. is a complement() result). False
+                        if the objects are being loaded, and their children
+                        are unknown.
+        """
+        assert io.schema.is_valid_latest(data)
+        tree = io.schema.LATEST.tree
+        expires = None if self.ttl is None else time.time() + self.ttl
+        # A dictionary of (obj_list_name, id) tuples of objects, and
+        # dictionaries of their child list names and child ID sets
+        obj_child_ids = {}
+        if complete:
+            for obj_list_name, parent_list_name in self.parent_map.items():
+                if not parent_list_name:
+                    continue
+                for obj in data.get(obj_list_name, []):
+                    obj_child_ids.setdefault(
+                        (parent_list_name,
+                         obj[f"{parent_list_name[:-1]}_id"]), {}
+                    ).setdefault(obj_list_name, set()).add(obj["id"])
+        for obj_list_name, parent_list_name in self.parent_map.items():
+            parent_id_field = f"{parent_list_name[:-1]}_id"
+            for obj in data.get(obj_list_name, []):
+                entry = self._get(obj_list_name, obj["id"])
+                if complete:
+                    child_ids = obj_child_ids.get(
+                        (obj_list_name, obj["id"]), {}
+                    )
+                    child_ids = {
+                        child_list_name:
+                        child_ids.get(child_list_name, set())
+                        for child_list_name in tree[obj_list_name]
+                    }
+                    obj_expires = expires if tree[obj_list_name] else None
+                elif entry is not None:
+                    child_ids, obj_expires = entry[1:]
+                else:
+                    child_ids = None if tree[obj_list_name] else {}
+                    obj_expires = None
+                # Keep the complete children of cached parents up to date
+                if parent_list_name:
+                    if entry is not None and \
+                       entry[0][parent_id_field] != obj[parent_id_field]:
+                        self._link(obj_list_name, obj["id"],
+                                   entry[0][parent_id_field], False)
+                    self._link(obj_list_name, obj["id"],
+                               obj[parent_id_field], True)
+                self._put(obj_list_name, obj["id"],
+                          (copy.deepcopy(obj), child_ids, obj_expires))
+
+    def _add_tree(self, data, obj_list_name, obj_id):
+        """
+        Add a cached object and all its children to the data.
+
+        Args:
+            data:           The data to add the objects to.
+            obj_list_name:  The name of the object's list.
+            obj_id:         The ID of the object.
+
+        Returns:
+            True if the object and all its children were cached and added,
+            False otherwise.
+        """
+        entry = self._get(obj_list_name, obj_id)
+        if entry is None or entry[1] is None or \
+           entry[2] is not None and entry[2] <= time.time():
+            return False
+        obj, child_ids, _ = entry
+        data.setdefault(obj_list_name, {})[obj_id] = copy.deepcopy(obj)
+        return all(
+            self._add_tree(data, child_list_name, child_id)
+            for child_list_name, ids in child_ids.items()
+            for child_id in sorted(ids)
+        )
+
+    def complement(self, data):
+        """
+        Complement I/O data from the cache, if possible.
+        See kcidb.db.Client.complement() for details.
+
+        Args:
+            data:   The JSON data to complement, adhering to the latest I/O
+                    schema. Will not be modified.
+
+        Returns:
+            The complemented JSON data adhering to the latest version of
+            I/O schema, or None if not all the objects are cached.
+        """
+        assert io.schema.is_valid_latest(data)
+        # Find the topmost parents of the objects
+        roots = set()
+        for obj_list_name in self.parent_map:
+            for obj in data.get(obj_list_name, []):
+                root_list_name, root_id = obj_list_name, obj["id"]
+                while True:
+                    entry = self._get(root_list_name, root_id)
+                    if entry is None:
+                        self.misses += 1
+                        return None
+                    parent_list_name = self.parent_map[root_list_name]
+                    if not parent_list_name:
+                        break
+                    root_id = entry[0][f"{parent_list_name[:-1]}_id"]
+                    root_list_name = parent_list_name
+                roots.add((root_list_name, root_id))
+
+        # Collect the parents with all their children
+        objs = {}
+        for obj_list_name, obj_id in roots:
+            if not self._add_tree(objs, obj_list_name, obj_id):
+                self.misses += 1
+                return None
+        self.hits += 1
+        complement = dict(version=dict(major=io.schema.LATEST.major,
+                                       minor=io.schema.LATEST.minor))
+        for obj_list_name in self.parent_map:
+            complement[obj_list_name] = \
+                list(objs.get(obj_list_name, {}).values())
+        assert io.schema.is_valid_latest(complement)
+        return complement
+
+
+class ResultCache:
+    """
+    A cache of query results, keyed by normalized queries, with entries
+    expiring after a time, and the total size bounded. Keeps the results in
+    an SQLite database, in memory, or on disk, to share between processes.
+    """
+
+    def __init__(self, path=":memory:", ttl=60, max_bytes=64 * 1024 * 1024):
+        """
+        Initialize a query result cache.
+
+        Args:
+            path:       The path to the SQLite database file to keep the
+                        results in, or ":memory:" to keep them in memory.
+            ttl:        The number of seconds the results stay valid for.
+            max_bytes:  The maximum total size of the cached results, in
+                        bytes of their JSON. The least recently used results
+                        are removed to stay within it.
+        """
+        assert isinstance(path, str)
+        assert isinstance(ttl, (int, float)) and ttl >= 0
+        assert isinstance(max_bytes, int) and max_bytes > 0
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (\n"
+            "    key TEXT PRIMARY KEY,\n"
+            "    value TEXT NOT NULL,\n"
+            "    size INTEGER NOT NULL,\n"
+            "    expires REAL NOT NULL,\n"
+            "    used REAL NOT NULL\n"
+            ")"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_env():
+        """
+        Create a query result cache configured with environment variables:
+        KCIDB_RESULT_CACHE - the path to the SQLite database file to keep
+        the results in, KCIDB_RESULT_CACHE_TTL - the number of seconds the
+        results stay valid for, and KCIDB_RESULT_CACHE_MAX_BYTES - the
+        maximum total size of the results.
+
+        Returns:
+            The created cache, or None if KCIDB_RESULT_CACHE is not set, or
+            empty.
+        """
+        path = os.environ.get("KCIDB_RESULT_CACHE")
+        if not path:
+            return None
+        return ResultCache(
+            path,
+            ttl=float(os.environ.get("KCIDB_RESULT_CACHE_TTL", "60")),
+            max_bytes=int(os.environ.get("KCIDB_RESULT_CACHE_MAX_BYTES",
+                                         str(64 * 1024 * 1024)))
+        )
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def get_key(database_id, patterns, children, parents, since, until,
+                filters):
+        """
+        Get the cache key for a query. Queries differing only in the order
+        or repetition of the patterns, or in empty pattern lists have the
+        same key. See kcidb.db.Client.query() for the rest of the arguments.
+
+        Args:
+            database_id:    A string identifying the queried database, so
+                            results of other databases sharing the cache
+                            are not returned.
+
+        Returns:
+            The key string.
+        """
+        def encode(value):
+            """Encode a non-JSON value of a query"""
+            if isinstance(value, tuple):
+                return list(value)
+            return str(value)
+
+        return json.dumps(
+            dict(
+                database=database_id,
+                patterns={
+                    obj_list_name: sorted(set(obj_list_patterns))
+                    for obj_list_name, obj_list_patterns in patterns.items()
+                    if obj_list_patterns
+                },
+                children=bool(children),
+                parents=bool(parents),
+                since=since and since.timestamp(),
+                until=until and until.timestamp(),
+                filters=filters or {},
+            ),
+            default=encode, sort_keys=True
+        )
+
+    def get(self, key):
+        """
+        Get a cached query result.
+
+        Args:
+            key:    The key of the query, returned by get_key().
+
+        Returns:
+            The cached JSON data, or None if not cached, or expired.
+        """
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value FROM results WHERE key = ? AND expires > ?",
+            (key, now)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE results SET used = ? WHERE key = ?",
+                          (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, data):
+        """
+        Cache a query result.
+
+        Args:
+            key:    The key of the query, returned by get_key().
+            data:   The JSON data returned by the query.
+        """
+        value = json.dumps(data)
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute("DELETE FROM results WHERE expires <= ?",
+                              (now,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl, now)
+            )
+            # Remove the least recently used results beyond the size limit
+            self.conn.execute(
+                "DELETE FROM results WHERE key IN (\n"
+                "    SELECT key FROM (\n"
+                "        SELECT key, SUM(size) OVER (\n"
+                "            ORDER BY used DESC, key = ? DESC\n"
+                "            ROWS UNBOUNDED PRECEDING\n"
+                "        ) AS total FROM results\n"
+                "    ) WHERE total > ?\n"
+                ")",
+                (key, self.max_bytes)
+            )
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def invalidate(self, key=None):
+        """
+        Remove cached query results, e.g. after the database changes.
+
+        Args:
+            key:    The key of the query to remove the result of, returned by
+                    get_key(), or None to remove all results.
+        """
+        if key is None:
+            self.conn.execute("DELETE FROM results")
+        else:
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
@@ -0,0 +1,456 @@
+"""Kernel CI report database - miscellaneous definitions"""
+
+import decimal
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from kcidb.db import schema
+
+# A regex matching characters to escape in LIKE patterns
+_LIKE_PATTERN_ESCAPE_RE = re.compile(r"([%_\\])")
+
+
+def escape_like_pattern(string):
+    """
+    Escape a string for use as a literal in a LIKE pattern.
+
+    Args:
+        string: The string to escape.
+
+    Returns:
+        The escaped string.
+    """
+    return _LIKE_PATTERN_ESCAPE_RE.sub(r"\\\1", string)
+
+
+# A regex matching ISO-8601 timestamps accepted by parse_timestamp()
+_TIMESTAMP_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?"
+    r"(Z|[+-]\d{2}:?\d{2})?"
+)
+
+
+def parse_timestamp(string):
+    """
+    Parse an ISO-8601 timestamp, the way datetime.fromisoformat() does in
+    later Python versions, but also accepting "Z" for UTC, and fractions of
+    seconds of any length (truncated to microseconds).
+
+    Args:
+        string: The string to parse.
+
+    Returns:
+        The parsed datetime.datetime object, "aware" if the string specified
+        the timezone, "naive" otherwise.
+
+    Raises:
+        `ValueError` if the string is not a valid timestamp.
+    """
+    assert isinstance(string, str)
+    match = _TIMESTAMP_RE.fullmatch(string)
+    if not match:
+        raise ValueError(f"Invalid ISO-8601 timestamp: {string!r}")
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    tzinfo = None
+    if zone == "Z":
+        tzinfo = timezone.utc
+    elif zone:
+        offset = timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        tzinfo = timezone(-offset if zone[0] == "-" else offset)
+    return datetime(int(year), int(month), int(day),
+                    int(hour or 0), int(minute or 0), int(second or 0),
+                    int((fraction or "0")[:6].ljust(6, "0")), tzinfo)
+
+
+def get_filter_field(obj_list_name, field_name):
+    """
+    Get the schema of an object list table field, which can be filtered
+    on, i.e. is a top-level field with a single scalar value.
+
+    Args:
+        obj_list_name:  Name of the object list (and its table) the field
+                        belongs to.
+        field_name:     Name of the field.
+
+    Returns:
+        The field schema (a google.cloud.bigquery.schema.SchemaField),
+        or None if there's no such field, or it can't be filtered on.
+    """
+    for field in schema.TABLE_MAP.get(obj_list_name, []):
+        if field.name == field_name:
+            if field.mode == "REPEATED" or field.field_type == "RECORD":
+                return None
+            return field
+    return None
+
+
+def _is_valid_filter_value(field, value):
+    """
+    Check if a value is valid for filtering a field on.
+
+    Args:
+        field:  The schema of the field to filter.
+        value:  The value to check.
+
+    Returns:
+        True if the value is valid, False otherwise.
+    """
+    if field.field_type == "STRING":
+        return isinstance(value, str)
+    if field.field_type == "BOOL":
+        return isinstance(value, bool)
+    if field.field_type == "TIMESTAMP":
+        return isinstance(value, datetime) and value.tzinfo is not None
+    if field.field_type == "NUMERIC":
+        return isinstance(value, (int, float, decimal.Decimal)) and \
+            not isinstance(value, bool)
+    return False
+
+
+def is_valid_filters(filters):
+    """
+    Check if object field filters are valid.
+
+    Args:
+        filters:    The filters to check.
+
+    Returns:
+        True if the filters are valid, False otherwise.
+    """
+    if not isinstance(filters, dict):
+        return False
+    for obj_list_name, field_filters in filters.items():
+        if not isinstance(field_filters, dict):
+            return False
+        for field_name, field_filter in field_filters.items():
+            field = get_filter_field(obj_list_name, field_name)
+            if field is None or \
+               not isinstance(field_filter, tuple) or \
+               len(field_filter) != 2:
+                return False
+            op, value = field_filter
+            if op == "=":
+                valid = _is_valid_filter_value(field, value)
+            elif op == "in":
+                valid = isinstance(value, list) and all(
+                    _is_valid_filter_value(field, v)
+                    for v in value
+                )
+            elif op == "prefix":
+                valid = field.field_type == "STRING" and \
+                    isinstance(value, str)
+            elif op == "range":
+                valid = isinstance(value, tuple) and \
+                    len(value) == 2 and \
+                    field.field_type in ("TIMESTAMP", "NUMERIC") and \
+                    all(v is None or
+                        _is_valid_filter_value(field, v)
+                        for v in value)
+            else:
+                valid = False
+            if not valid:
+                return False
+    return True
+
+
+def get_filters_shape(filters):
+    """
+    Get the shape of object field filters: everything determining the text
+    of the SQL generated for them, but not their values.
+
+    Args:
+        filters:    The filters to get the shape of, as accepted by
+                    kcidb.db.Client.query().
+
+    Returns:
+        A hashable tuple of tuples, each containing an object list name,
+        and a tuple of tuples, each containing a field name, the filter
+        operator, and, for "range" filters, a tuple of two booleans, True
+        if the corresponding bound is specified, or None for other
+        operators.
+    """
+    assert is_valid_filters(filters)
+    return tuple(
+        (
+            obj_list_name,
+            tuple(
+                (
+                    field_name, op,
+                    tuple(v is not None for v in value)
+                    if op == "range" else None
+                )
+                for field_name, (op, value) in field_filters.items()
+            )
+        )
+        for obj_list_name, field_filters in filters.items()
+    )
+
+
+def get_slot_value(slot, patterns, since, until, filters):
+    """
+    Get the value of a query parameter slot, from a query parameter layout
+    produced by a driver's query template generator.
+
+    Args:
+        slot:       The slot to get the value of. A tuple, starting with
+                    the slot type, either "patterns" followed by an object
+                    list name, "since", "until", or "filter" followed by
+                    an object list name, a field name, the filter operator
+                    and the index of the "range" bound (None for other
+                    operators).
+        patterns:   A dictionary of object list names, and lists of LIKE
+                    patterns, for IDs of objects to match.
+        since:      The earliest (inclusive) time to match, or None.
+        until:      The latest (exclusive) time to match, or None.
+        filters:    A dictionary of object list names, and dictionaries of
+                    their field names and filters, as accepted by
+                    kcidb.db.Client.query().
+
+    Returns:
+        The raw (unconverted) value for the slot.
+    """
+    assert isinstance(slot, tuple) and slot
+    if slot[0] == "patterns":
+        return patterns.get(slot[1], [])
+    if slot[0] == "since":
+        return since
+    if slot[0] == "until":
+        return until
+    assert slot[0] == "filter"
+    obj_list_name, field_name, _, index = slot[1:]
+    value = filters[obj_list_name][field_name][1]
+    return value if index is None else value[index]
+
+
+def unpack_node(node):
+    """
+    Unpack a retrieved data node (and all its children) to
+    the JSON-compatible and schema-complying representation.
+
+    Args:
+        node:   The node to unpack.
+
+    Returns:
+        The unpacked node.
+    """
+    if isinstance(node, decimal.Decimal):
+        node = float(node)
+    elif isinstance(node, datetime):
+        node = node.isoformat()
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            node[index] = unpack_node(value)
+    elif isinstance(node, dict):
+        for key, value in list(node.items()):
+            if value is None:
+                del node[key]
+            elif key == "misc":
+                node[key] = json.loads(value)
+            else:
+                node[key] = unpack_node(value)
+    return node
+
+
+def pack_node(node):
+    """
+    Pack a loaded data node (and all its children) to
+    the BigQuery storage-compatible representation.
+
+    Args:
+        node:   The node to pack.
+
+    Returns:
+        The packed node.
+    """
+    if isinstance(node, list):
+        node = node.copy()
+        for index, value in enumerate(node):
+            node[index] = pack_node(value)
+    elif isinstance(node, dict):
+        node = node.copy()
+        for key, value in list(node.items()):
+            # Flatten the "misc" fields
+            if key == "misc":
+                node[key] = json.dumps(value)
+            else:
+                node[key] = pack_node(value)
+    return node
+
+
+class Driver:
+    """
+    An abstract Kernel CI report database driver. Receives arguments
+    already validated by kcidb.db.Client, which also checks the schema
+    version before accessing the data. Implementations raise
+    NotImplementedError for unsupported operations.
+    """
+
+    def __init__(self):
+        """
+        Initialize the driver.
+        """
+        # A function to call with a dictionary of statistics after
+        # executing each database job, or None
+        self.stats_hook = None
+        # Thread-local state, with the name of the logical operation
+        # being executed, if any
+        self.local = threading.local()
+
+    @contextmanager
+    def operation(self, name):
+        """
+        Attribute the jobs executed within the context to a logical
+        operation (e.g. "complement"), unless already within one.
+
+        Args:
+            name:   The name of the operation.
+        """
+        assert isinstance(name, str)
+        outer_name = getattr(self.local, "operation", None)
+        if outer_name is None:
+            self.local.operation = name
+        try:
+            yield
+        finally:
+            self.local.operation = outer_name
+
+    # pylint: disable=too-many-arguments
+    def record_stats(self, operation, table, sql, rows, started,
+                     bytes_processed=None, bytes_billed=None,
+                     slot_millis=None):
+        """
+        Report statistics of an executed database job to the statistics
+        hook, if any.
+
+        Args:
+            operation:          The name of the driver operation executing
+                                the job (e.g. "query"), used unless the job
+                                is executed within a logical operation
+                                (see operation()).
+            table:              The name of the table the job accessed.
+            sql:                The text of the job's SQL statement, or
+                                None, if the job had none.
+            rows:               The number of rows the job returned or
+                                loaded, or None if unknown.
+            started:            The time.monotonic() value taken before
+                                starting the job.
+            bytes_processed:    The number of bytes the job processed, or
+                                None if unknown.
+            bytes_billed:       The number of bytes the job was billed for,
+                                or None if unknown.
+            slot_millis:        The number of slot milliseconds the job
+                                consumed, or None if unknown.
+        """
+        if self.stats_hook is None:
+            return
+        # pylint: disable=not-callable
+        self.stats_hook(dict(
+            operation=getattr(self.local, "operation", None) or operation,
+            table=table,
+            # Statements only differ in text between query shapes
+            shape=None if sql is None else
+            hashlib.sha1(sql.encode()).hexdigest()[:12],
+            bytes_processed=bytes_processed,
+            bytes_billed=bytes_billed,
+            slot_millis=slot_millis,
+            rows=rows,
+            latency=time.monotonic() - started,
+        ))
+
+    def get_schema_version(self):
+        """
+        Get the version of the I/O schema the database schema corresponds
+        to. Should return the first I/O schema version, if the database is
+        not initialized.
+
+        Returns:
+            Major version number, minor version number.
+        """
+        raise NotImplementedError
+
+    def init(self):
+        """
+        Initialize the database. The database must be empty.
+        """
+        raise NotImplementedError
+
+    def cleanup(self):
+        """
+        Cleanup (empty) the database, removing all data.
+        """
+        raise NotImplementedError
+
+    def dump_incremental(self, since):
+        """
+        Dump data loaded into the database after a watermark.
+        See kcidb.db.Client.dump_incremental() for details.
+        """
+        raise NotImplementedError
+
+    def dump_arrow(self, since):
+        """
+        Dump data from the database as Arrow record batches.
+        See kcidb.db.Client.dump_arrow() for details.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children, parents, since, until, filters):
+        """
+        Match and fetch objects from the database.
+        See kcidb.db.Client.query() for details.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=too-many-arguments
+    def query_page(self, patterns, children, parents, since, until, filters,
+                   page_size, token):
+        """
+        Match and fetch a page of objects from the database.
+        See kcidb.db.Client.query_page() for details.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=too-many-arguments
+    def query_arrow(self, patterns, children, parents, since, until,
+                    filters):
+        """
+        Match and fetch objects from the database as Arrow record batches.
+        See kcidb.db.Client.query_arrow() for details.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=too-many-arguments
+    def aggregate(self, obj_list_name, group_by, patterns, children, parents,
+                  since, until, filters, path_depth):
+        """
+        Count matching objects, grouped by keys.
+        See kcidb.db.Client.aggregate() for details.
+        """
+        raise NotImplementedError
+
+    def get_rollups(self, obj_list_name, ids):
+        """
+        Get aggregated data for objects from the rollup tables.
+        See kcidb.db.Client.get_rollups() for details.
+        """
+        raise NotImplementedError
+
+    def load(self, data, upsert, rollup):
+        """
+        Load data adhering to the latest I/O schema into the database.
+        See kcidb.db.Client.load() for details.
+        """
+        raise NotImplementedError
+
+    def compact(self):
+        """
+        Remove rows with duplicate IDs from the database.
+        See kcidb.db.Client.compact() for details.
+        """
+        raise NotImplementedError
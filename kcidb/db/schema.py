@@ -235,3 +235,144 @@ TABLE_MAP = dict(
         ),
     ]
 )
+
+# A map of table names to the names of their TIMESTAMP fields to partition
+# them by, by day, so queries limited by time could skip unneeded data
+TABLE_PARTITIONING_MAP = dict(
+    revisions="discovery_time",
+    builds="start_time",
+    tests="start_time",
+)
+
+# A map of table names to lists of names of their fields to cluster them by,
+# in order of priority, so queries matching IDs and parent IDs could skip
+# unneeded data
+TABLE_CLUSTERING_MAP = dict(
+    revisions=["id"],
+    builds=["id", "revision_id"],
+    tests=["id", "build_id"],
+)
+
+# Fields with counts of tests with each status, and the worst status
+TEST_STATUS_FIELDS = (
+    Field(
+        "test_count", "INTEGER",
+        description="Number of tests",
+    ),
+    Field(
+        "error_count", "INTEGER",
+        description="Number of tests with \"ERROR\" status",
+    ),
+    Field(
+        "fail_count", "INTEGER",
+        description="Number of tests with \"FAIL\" status",
+    ),
+    Field(
+        "pass_count", "INTEGER",
+        description="Number of tests with \"PASS\" status",
+    ),
+    Field(
+        "done_count", "INTEGER",
+        description="Number of tests with \"DONE\" status",
+    ),
+    Field(
+        "skip_count", "INTEGER",
+        description="Number of tests with \"SKIP\" status",
+    ),
+    Field(
+        "none_count", "INTEGER",
+        description="Number of tests without status",
+    ),
+    Field(
+        "worst_status", "STRING",
+        description="The status of the test with the worst status, "
+                    "considering unwaived tests worse than waived ones, "
+                    "if any",
+    ),
+    Field(
+        "worst_waived", "BOOL",
+        description="The \"waived\" value of the test with the worst "
+                    "status, if any",
+    ),
+)
+
+# A map of rollup table names to their BigQuery schemas.
+# Rollup tables contain aggregated data about objects of the corresponding
+# object lists (named after the table name prefix), one row per object,
+# updated incrementally by loading.
+ROLLUP_TABLE_MAP = dict(
+    revision_rollups=[
+        Field(
+            "revision_id", "STRING",
+            description="Revision ID",
+        ),
+        Field(
+            "build_count", "INTEGER",
+            description="Number of the revision's builds",
+        ),
+        Field(
+            "valid_build_count", "INTEGER",
+            description="Number of the revision's valid builds",
+        ),
+        Field(
+            "invalid_build_count", "INTEGER",
+            description="Number of the revision's invalid builds",
+        ),
+        *TEST_STATUS_FIELDS,
+        Field(
+            "build_duration", "NUMERIC",
+            description="Total number of seconds it took to complete "
+                        "the revision's builds",
+        ),
+        Field(
+            "test_duration", "NUMERIC",
+            description="Total number of seconds it took to run "
+                        "the revision's tests",
+        ),
+        Field(
+            "updated_at", "TIMESTAMP",
+            description="The time the row was last updated",
+        ),
+    ],
+    build_rollups=[
+        Field(
+            "build_id", "STRING",
+            description="Build ID",
+        ),
+        Field(
+            "revision_id", "STRING",
+            description="ID of the build's revision, if known",
+        ),
+        *TEST_STATUS_FIELDS,
+        Field(
+            "test_duration", "NUMERIC",
+            description="Total number of seconds it took to run "
+                        "the build's tests",
+        ),
+        Field(
+            "updated_at", "TIMESTAMP",
+            description="The time the row was last updated",
+        ),
+    ],
+)
+
+# A map of rollup table names to lists of names of their fields to cluster
+# them by
+ROLLUP_TABLE_CLUSTERING_MAP = dict(
+    revision_rollups=["revision_id"],
+    build_rollups=["build_id", "revision_id"],
+)
+
+# The service field recording the time an object was loaded into
+# the database, not exposed via I/O data
+INGESTION_TIME_FIELD = Field(
+    "_ingestion_time", "TIMESTAMP",
+    description="The time the object was loaded into the database",
+)
+
+# A map of table names to their complete BigQuery schemas, as stored:
+# the I/O schema fields, followed by the service fields
+STORAGE_TABLE_MAP = {
+    table_name: [*table_schema, INGESTION_TIME_FIELD]
+    for table_name, table_schema in TABLE_MAP.items()
+}
@@ -0,0 +1,582 @@
+"""Kernel CI report database - SQLite driver"""
+
+import re
+import json
+import functools
+import sqlite3
+import textwrap
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from kcidb.db import schema, misc
+from kcidb import io
+
+# A map of BigQuery field types to SQLite column types.
+# Record and repeated fields are stored as JSON text.
+TYPE_MAP = dict(
+    STRING="TEXT",
+    INTEGER="INTEGER",
+    FLOAT="REAL",
+    NUMERIC="REAL",
+    BOOL="INTEGER",
+    TIMESTAMP="TEXT",
+    RECORD="TEXT",
+)
+
+# A regex matching RFC3339 timestamps
+_TIMESTAMP_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2})[Tt ](\d{2}:\d{2}:\d{2})(?:\.(\d+))?"
+    r"([Zz]|[+-]\d{2}:\d{2})?"
+)
+
+
+class Driver(misc.Driver):
+    """Kernel CI report database driver for SQLite"""
+    # pylint: disable=abstract-method
+
+    def __init__(self, path):
+        """
+        Initialize an SQLite database driver.
+
+        Args:
+            path:   The path to the SQLite database file, created if it
+                    doesn't exist, or ":memory:" for a temporary in-memory
+                    database.
+        """
+        assert isinstance(path, str)
+        super().__init__()
+        # Manage transactions explicitly, and allow using the connection
+        # from other threads, serializing transactions with a lock
+        self.conn = sqlite3.connect(path, isolation_level=None,
+                                    check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.row_factory = sqlite3.Row
+        # Match IDs case-sensitively, like BigQuery
+        self.conn.execute("PRAGMA case_sensitive_like = ON")
+
+    @contextmanager
+    def _transaction(self, mode="DEFERRED"):
+        """
+        Run the code in the context within a transaction, committing it on
+        success, and rolling it back on an exception. Transactions from
+        different threads are serialized.
+
+        Args:
+            mode:   The transaction mode: "DEFERRED" for reading, or
+                    "IMMEDIATE" for writing.
+        """
+        with self.lock:
+            self.conn.execute(f"BEGIN {mode}")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    @staticmethod
+    def _pack_timestamp(value):
+        """
+        Pack a timestamp into the stored representation: an ISO-8601 string
+        in UTC, with microseconds, comparable as text.
+
+        Args:
+            value:  The timestamp to pack: an "aware" datetime.datetime
+                    object, or an RFC3339 string. Strings without timezone
+                    are assumed to be in UTC.
+
+        Returns:
+            The packed timestamp string.
+        """
+        if isinstance(value, str):
+            match = _TIMESTAMP_RE.fullmatch(value)
+            if not match:
+                raise ValueError(f"Invalid timestamp: {value!r}")
+            date, clock, fraction, zone = match.groups()
+            value = misc.parse_timestamp(
+                f"{date}T{clock}.{(fraction or '').ljust(6, '0')[:6]}" +
+                ("+00:00" if zone is None or zone in "Zz" else zone)
+            )
+        assert isinstance(value, datetime) and value.tzinfo
+        return value.astimezone(timezone.utc).isoformat(
+            timespec="microseconds"
+        )
+
+    @staticmethod
+    def _pack_value(field, value):
+        """
+        Pack a value of a top-level field into the stored representation.
+
+        Args:
+            field:  The schema of the field.
+            value:  The value to pack, as packed by misc.pack_node(),
+                    or None.
+
+        Returns:
+            The packed value.
+        """
+        if value is None:
+            return None
+        if field.mode == "REPEATED" or field.field_type == "RECORD":
+            return json.dumps(value)
+        if field.field_type == "TIMESTAMP":
+            return Driver._pack_timestamp(value)
+        if field.field_type in ("NUMERIC", "FLOAT"):
+            return float(value)
+        if field.field_type == "BOOL":
+            return int(value)
+        return value
+
+    @staticmethod
+    def _unpack_row(obj_list_name, row):
+        """
+        Unpack a retrieved object table row to the JSON-compatible and
+        schema-complying representation, dropping the service fields.
+
+        Args:
+            obj_list_name:  The name of the object list the row belongs to.
+            row:            The row to unpack.
+
+        Returns:
+            The unpacked object.
+        """
+        node = {}
+        for field in schema.TABLE_MAP[obj_list_name]:
+            value = row[field.name]
+            if value is None:
+                continue
+            if field.mode == "REPEATED" or field.field_type == "RECORD":
+                value = json.loads(value)
+            elif field.field_type == "TIMESTAMP":
+                value = misc.parse_timestamp(value).isoformat()
+            elif field.field_type == "BOOL":
+                value = bool(value)
+            node[field.name] = value
+        return misc.unpack_node(node)
+
+    def get_schema_version(self):
+        """
+        Get the version of the I/O schema the database schema corresponds to.
+
+        Returns:
+            Major version number, minor version number.
+        """
+        with self._transaction():
+            if self.conn.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name = '_version'"
+            ).fetchone() is None:
+                return io.schema.V1.major, io.schema.V1.minor
+            row = self.conn.execute(
+                "SELECT major, minor FROM _version"
+            ).fetchone()
+        return row["major"], row["minor"]
+
+    def init(self):
+        """
+        Initialize the database. The database must be empty.
+        Tables are indexed by object IDs and parent IDs.
+        """
+        with self._transaction("IMMEDIATE"):
+            for table_name, table_schema in schema.STORAGE_TABLE_MAP.items():
+                columns = ",\n".join(
+                    f"    {field.name} " + (
+                        "TEXT" if field.mode == "REPEATED"
+                        else TYPE_MAP[field.field_type]
+                    )
+                    for field in table_schema
+                )
+                self.conn.execute(f"CREATE TABLE {table_name} (\n"
+                                  f"{columns}\n"
+                                  f")")
+                self.conn.execute(f"CREATE INDEX {table_name}_id "
+                                  f"ON {table_name} (id)")
+            for obj_list_name, child_list_names in \
+                    io.schema.LATEST.tree.items():
+                for child_list_name in child_list_names:
+                    if obj_list_name:
+                        column = f"{obj_list_name[:-1]}_id"
+                        self.conn.execute(
+                            f"CREATE INDEX {child_list_name}_{column} "
+                            f"ON {child_list_name} ({column})"
+                        )
+            self.conn.execute("CREATE TABLE _version "
+                              "(major INTEGER, minor INTEGER)")
+            self.conn.execute("INSERT INTO _version VALUES (?, ?)",
+                              (io.schema.LATEST.major,
+                               io.schema.LATEST.minor))
+
+    def cleanup(self):
+        """
+        Cleanup (empty) the database, removing all data.
+        """
+        with self._transaction("IMMEDIATE"):
+            for table_name in [*schema.TABLE_MAP, "_version"]:
+                self.conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+    def dump_incremental(self, since):
+        """
+        Dump data loaded into the database after a watermark.
+        See kcidb.db.Client.dump_incremental() for details.
+        """
+        time_column = schema.INGESTION_TIME_FIELD.name
+        watermark = None if since is None else Driver._pack_timestamp(since)
+        data = dict(version=dict(major=io.schema.LATEST.major,
+                                 minor=io.schema.LATEST.minor))
+        with self._transaction():
+            for obj_list_name in schema.TABLE_MAP:
+                if since is None:
+                    params = []
+                    sql = f"SELECT * FROM {obj_list_name}"
+                else:
+                    params = [Driver._pack_timestamp(since)]
+                    sql = f"SELECT * FROM {obj_list_name} " \
+                        f"WHERE {time_column} > ?"
+                data[obj_list_name] = []
+                started = time.monotonic()
+                for row in self.conn.execute(sql, params):
+                    # Loads take timestamps within write transactions,
+                    # so later loads can't get earlier ones
+                    row_time = row[time_column]
+                    if watermark is None or row_time > watermark:
+                        watermark = row_time
+                    data[obj_list_name].append(
+                        Driver._unpack_row(obj_list_name, row)
+                    )
+                self.record_stats("dump", obj_list_name, sql,
+                                  len(data[obj_list_name]), started)
+
+        assert io.schema.is_valid_latest(data)
+        return data, \
+            None if watermark is None else misc.parse_timestamp(watermark)
+
+    @staticmethod
+    def _get_conditions(obj_list_name, bounds, filters_shape):
+        """
+        Generate a condition template limiting rows of an object list table
+        to those with their time within specified bounds, and fields
+        satisfying specified filters.
+
+        Args:
+            obj_list_name:  Name of the object list (and its table) to
+                            generate the condition for.
+            bounds:         A tuple of two booleans, True if the lower
+                            (inclusive), and the upper (exclusive) time bound
+                            is specified, respectively.
+            filters_shape:  The shape of the filters, as returned by
+                            misc.get_filters_shape().
+
+        Returns:
+            The condition text (empty, if not limited), and the list of its
+            parameter slots (see misc.get_slot_value()).
+        """
+        time_column = \
+            f"{obj_list_name}.{schema.TABLE_PARTITIONING_MAP[obj_list_name]}"
+        conditions = []
+        slots = []
+        if bounds[0]:
+            conditions.append(f"{time_column} >= ?")
+            slots.append(("since",))
+        if bounds[1]:
+            conditions.append(f"{time_column} < ?")
+            slots.append(("until",))
+        for field_name, op, range_bounds in \
+                dict(filters_shape).get(obj_list_name, ()):
+            column = f"{obj_list_name}.{field_name}"
+            slot = ("filter", obj_list_name, field_name, op, None)
+            if op == "=":
+                conditions.append(f"{column} = ?")
+                slots.append(slot)
+            elif op == "in":
+                conditions.append(
+                    f"{column} IN (SELECT value FROM json_each(?))"
+                )
+                slots.append(slot)
+            elif op == "prefix":
+                conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+                slots.append(slot)
+            elif op == "range":
+                if range_bounds[0]:
+                    conditions.append(f"{column} >= ?")
+                    slots.append(slot[:-1] + (0,))
+                if range_bounds[1]:
+                    conditions.append(f"{column} < ?")
+                    slots.append(slot[:-1] + (1,))
+        return " AND ".join(conditions), slots
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _get_query_template(children, parents, bounds, filters_shape):
+        """
+        Generate templates of SELECT statements fetching objects matching
+        queries of a particular shape. Memoized, as the statement text only
+        depends on the query shape, and not on the values queried.
+
+        Args:
+            children:       True if children of matched objects should be
+                            matched as well.
+            parents:        True if parents of matched objects should be
+                            matched as well.
+            bounds:         A tuple of two booleans, True if the lower
+                            (inclusive), and the upper (exclusive) time bound
+                            is specified, respectively.
+            filters_shape:  The shape of the filters, as returned by
+                            misc.get_filters_shape().
+
+        Returns:
+            A dictionary of object list names and tuples containing a SELECT
+            statement and the tuple of its parameter slots (see
+            misc.get_slot_value()), fetching the matching objects of the
+            list.
+        """
+        # A dictionary of object list names and lists containing a SELECT
+        # statement and the list of its parameter slots, returning IDs of
+        # the objects to fetch
+        obj_list_queries = {}
+        for obj_list_name in io.schema.LATEST.tree:
+            if not obj_list_name:
+                continue
+            # JOIN selecting objects with IDs matching the patterns
+            query = [
+                f"SELECT {obj_list_name}.id AS id "
+                f"FROM {obj_list_name} "
+                f"INNER JOIN json_each(?) AS id_pattern "
+                f"ON {obj_list_name}.id LIKE id_pattern.value ESCAPE '\\'",
+                [("patterns", obj_list_name)]
+            ]
+            # Limit them by time and filters, if requested
+            condition, slots = \
+                Driver._get_conditions(obj_list_name, bounds, filters_shape)
+            if condition:
+                query[0] += f" WHERE {condition}"
+                query[1] += slots
+            query[0] += "\n"
+            obj_list_queries[obj_list_name] = query
+
+        # Add referenced parents if requested
+        if parents:
+            def add_parents(obj_list_name):
+                """Add parent IDs to query results"""
+                obj_name = obj_list_name[:-1]
+                query = obj_list_queries[obj_list_name]
+                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
+                    add_parents(child_list_name)
+                    child_query = obj_list_queries[child_list_name]
+                    query[0] += \
+                        "UNION\n" \
+                        f"SELECT {child_list_name}.{obj_name}_id AS id " \
+                        f"FROM {child_list_name} " + \
+                        f"WHERE {child_list_name}.id IN (\n" + \
+                        textwrap.indent(child_query[0], " " * 4) + \
+                        ")\n"
+                    query[1] += child_query[1]
+
+            for obj_list_name in io.schema.LATEST.tree[""]:
+                add_parents(obj_list_name)
+
+        # Add referenced children if requested
+        if children:
+            def add_children(obj_list_name):
+                """Add child IDs to query results"""
+                obj_name = obj_list_name[:-1]
+                query = obj_list_queries[obj_list_name]
+                for child_list_name in io.schema.LATEST.tree[obj_list_name]:
+                    child_query = obj_list_queries[child_list_name]
+                    child_query[0] += \
+                        "UNION\n" \
+                        f"SELECT {child_list_name}.id AS id " \
+                        f"FROM {child_list_name} " + \
+                        f"WHERE {child_list_name}.{obj_name}_id IN (\n" + \
+                        textwrap.indent(query[0], " " * 4) + \
+                        ")\n"
+                    child_query[1] += query[1]
+                    add_children(child_list_name)
+
+            for obj_list_name in io.schema.LATEST.tree[""]:
+                add_children(obj_list_name)
+
+        return {
+            obj_list_name: (
+                f"SELECT * FROM {obj_list_name} WHERE id IN (\n" +
+                textwrap.indent(query[0], " " * 4) +
+                ")\n",
+                tuple(query[1])
+            )
+            for obj_list_name, query in obj_list_queries.items()
+        }
+
+    @staticmethod
+    def _get_slot_param(slot, value):
+        """
+        Create a query parameter for a parameter slot's value.
+
+        Args:
+            slot:   The parameter slot (see misc.get_slot_value()).
+            value:  The raw value of the slot.
+
+        Returns:
+            The query parameter value.
+        """
+        if slot[0] == "patterns":
+            return json.dumps(value)
+        if slot[0] in ("since", "until"):
+            return Driver._pack_timestamp(value)
+        field = misc.get_filter_field(slot[1], slot[2])
+        if slot[3] == "in":
+            return json.dumps([Driver._pack_value(field, v) for v in value])
+        if slot[3] == "prefix":
+            return misc.escape_like_pattern(value) + "%"
+        return Driver._pack_value(field, value)
+
+    # pylint: disable=too-many-arguments
+    @staticmethod
+    def _get_query_sql(patterns, children, parents, since, until, filters):
+        """
+        Generate SELECT statements fetching objects matching a query.
+
+        Args:
+            patterns:   A dictionary of object list names, and lists of LIKE
+                        patterns, for IDs of objects to match.
+            children:   True if children of matched objects should be matched
+                        as well.
+            parents:    True if parents of matched objects should be matched
+                        as well.
+            since:      An "aware" datetime.datetime object specifying the
+                        earliest (inclusive) time of the objects to match,
+                        or None for no lower bound.
+            until:      An "aware" datetime.datetime object specifying the
+                        latest (exclusive) time of the objects to match,
+                        or None for no upper bound.
+            filters:    A dictionary of object list names, and dictionaries
+                        of their field names and filters, as accepted by
+                        kcidb.db.Client.query().
+
+        Returns:
+            A dictionary of object list names and tuples containing a SELECT
+            statement and the list of its parameters, fetching the matching
+            objects of the list.
+        """
+        obj_list_templates = Driver._get_query_template(
+            bool(children), bool(parents),
+            (since is not None, until is not None),
+            misc.get_filters_shape(filters)
+        )
+        return {
+            obj_list_name: (
+                sql,
+                [
+                    Driver._get_slot_param(
+                        slot,
+                        misc.get_slot_value(slot, patterns,
+                                            since, until, filters)
+                    )
+                    for slot in slots
+                ]
+            )
+            for obj_list_name, (sql, slots) in obj_list_templates.items()
+        }
+
+    # pylint: disable=too-many-arguments
+    def query(self, patterns, children, parents, since, until, filters):
+        """
+        Match and fetch objects from the database.
+        See kcidb.db.Client.query() for details.
+        """
+        data = dict(version=dict(major=io.schema.LATEST.major,
+                                 minor=io.schema.LATEST.minor))
+        with self._transaction():
+            for obj_list_name, (sql, params) in \
+                    Driver._get_query_sql(patterns, children, parents,
+                                          since, until, filters).items():
+                started = time.monotonic()
+                data[obj_list_name] = [
+                    Driver._unpack_row(obj_list_name, row)
+                    for row in self.conn.execute(sql, params)
+                ]
+                self.record_stats("query", obj_list_name, sql,
+                                  len(data[obj_list_name]), started)
+
+        assert io.schema.is_valid_latest(data)
+        return data
+
+    def load(self, data, upsert, rollup):
+        """
+        Load data adhering to the latest I/O schema into the database.
+        See kcidb.db.Client.load() for details.
+        """
+        if rollup:
+            raise NotImplementedError("SQLite databases have no rollups")
+        stats = {}
+        with self._transaction("IMMEDIATE"):
+            # Take the time within the write transaction, so later loads
+            # can't get an earlier time
+            ingestion_time = \
+                Driver._pack_timestamp(datetime.now(timezone.utc))
+            for obj_list_name, table_schema in \
+                    schema.STORAGE_TABLE_MAP.items():
+                if obj_list_name not in data:
+                    continue
+                started = time.monotonic()
+                obj_list = misc.pack_node(data[obj_list_name])
+                inserted = len(obj_list)
+                merged = 0
+                if upsert:
+                    # Keep only the last object with each ID
+                    obj_list = list({
+                        obj["id"]: obj for obj in obj_list
+                    }.values())
+                    ids = json.dumps([obj["id"] for obj in obj_list])
+                    condition = "id IN (SELECT value FROM json_each(?))"
+                    # Count objects, not their duplicate rows, as merged
+                    merged = self.conn.execute(
+                        f"SELECT COUNT(DISTINCT id) FROM {obj_list_name} "
+                        f"WHERE {condition}", (ids,)
+                    ).fetchone()[0]
+                    inserted = len(obj_list) - merged
+                    self.conn.execute(
+                        f"DELETE FROM {obj_list_name} WHERE {condition}",
+                        (ids,)
+                    )
+                for obj in obj_list:
+                    obj[schema.INGESTION_TIME_FIELD.name] = ingestion_time
+                self.conn.executemany(
+                    f"INSERT INTO {obj_list_name} (" +
+                    ", ".join(field.name for field in table_schema) +
+                    ") VALUES (" +
+                    ", ".join("?" for field in table_schema) +
+                    ")",
+                    [
+                        [
+                            Driver._pack_value(field, obj.get(field.name))
+                            for field in table_schema
+                        ]
+                        for obj in obj_list
+                    ]
+                )
+                stats[obj_list_name] = (inserted, merged)
+                self.record_stats("load", obj_list_name, None,
+                                  len(obj_list), started)
+        return stats
+
+    def compact(self):
+        """
+        Remove rows with duplicate IDs from the database tables, in place,
+        keeping the last loaded row for each ID.
+        See kcidb.db.Client.compact() for details.
+        """
+        stats = {}
+        with self._transaction("IMMEDIATE"):
+            for obj_list_name in schema.TABLE_MAP:
+                # Rows are numbered in the order of loading
+                merged = self.conn.execute(
+                    f"DELETE FROM {obj_list_name} WHERE rowid NOT IN (\n"
+                    f"    SELECT MAX(rowid) FROM {obj_list_name} "
+                    f"GROUP BY id\n"
+                    f")"
+                ).rowcount
+                kept = self.conn.execute(
+                    f"SELECT COUNT(*) FROM {obj_list_name}"
+                ).fetchone()[0]
+                stats[obj_list_name] = (kept, merged)
+        return stats
@@ -1,19 +1,107 @@
 """Kernel CI report message queue"""
+# pylint: disable=too-many-lines
 
 import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import importlib
+import importlib.util
 import json
+import os
 import sys
+import threading
+import time
+import zlib
 from google.cloud import pubsub
+from google import pubsub_v1
+from google.cloud.pubsub_v1.subscriber import scheduler
 from google.api_core.exceptions import DeadlineExceeded
 from kcidb import io
+from kcidb.mq import backend as local
+from kcidb.mq import dead_letter
+
+# Supported message data encodings, signalled with the "encoding" message
+# attribute. Messages without the attribute are encoded as plain JSON.
+# The "msgpack" encodings require the optional "msgpack" package.
+ENCODINGS = ("json", "json+zlib", "msgpack", "msgpack+zlib")
+
+
+def import_msgpack():
+    """
+    Import the msgpack module, explaining how to get it, if it's missing.
+
+    Returns:
+        The imported module.
+    """
+    try:
+        return importlib.import_module("msgpack")
+    except ImportError as exc:
+        raise Exception("The msgpack encodings require the \"msgpack\" "
+                        "package, install it with the \"kcidb[msgpack]\" "
+                        "extra") from exc
+
+
+def encode(value, encoding):
+    """
+    Encode a JSON value into message data.
+
+    Args:
+        value:      The JSON value to encode.
+        encoding:   The encoding to use, one of ENCODINGS.
+
+    Returns:
+        The encoded message data.
+    """
+    assert encoding in ENCODINGS
+    format_name, _, compression = encoding.partition("+")
+    if format_name == "msgpack":
+        message_data = import_msgpack().packb(value)
+    else:
+        message_data = json.dumps(value).encode()
+    if compression:
+        message_data = zlib.compress(message_data)
+    return message_data
+
+
+def decode(message_data, encoding=None):
+    """
+    Decode message data into a JSON value.
+
+    Args:
+        message_data:   The message data to decode.
+        encoding:       The encoding of the data, one of ENCODINGS, or
+                        None for plain JSON.
+
+    Returns:
+        The decoded JSON value.
+    """
+    assert encoding is None or encoding in ENCODINGS
+    format_name, _, compression = (encoding or "json").partition("+")
+    if compression:
+        message_data = zlib.decompress(message_data)
+    if format_name == "msgpack":
+        return import_msgpack().unpackb(message_data)
+    return json.loads(message_data.decode())
 
 
 class Publisher:
     """Kernel CI message queue publisher"""
     # pylint: disable=no-member
 
+    # Maximum size of encoded message data, leaving room for attributes
+    # and the request envelope within the Pub/Sub limits
+    MAX_MESSAGE_SIZE = 9 * 1000 * 1000
+
+    # Maximum size of a message attribute value
+    _MAX_ATTRIBUTE_SIZE = 1024
+
+    # Maximum number of per-origin message attributes, staying well within
+    # the Pub/Sub limit of 100 attributes
+    _MAX_ORIGIN_ATTRIBUTES = 64
+
     @staticmethod
-    def encode_data(io_data):
+    def encode_data(io_data, encoding="json"):
         """
         Encode JSON data, adhering to a version of I/O schema, into message
         data.
@@ -21,14 +109,272 @@ class Publisher:
         Args:
             io_data:    JSON data to be encoded, adhering to an I/O schema
                         version.
+            encoding:   The encoding to use, one of ENCODINGS.
 
         Returns
             The encoded message data.
         """
-        assert io.schema.is_valid(io_data)
-        return json.dumps(io.schema.upgrade(io_data)).encode()
+        return encode(io.schema.upgrade(io_data), encoding)
 
-    def __init__(self, project_id, topic_name):
+    @staticmethod
+    def get_fingerprint(io_data):
+        """
+        Get the fingerprint of JSON data: a hash of its canonical encoding,
+        the same for data differing only in the order of object
+        properties, or in the I/O schema version used to express it.
+
+        Args:
+            io_data:    JSON data to fingerprint, adhering to an I/O schema
+                        version.
+
+        Returns:
+            The fingerprint string.
+        """
+        return Publisher._get_fingerprint(io.schema.upgrade(io_data))
+
+    @staticmethod
+    def _get_fingerprint(data):
+        """
+        Get the fingerprint of JSON data adhering to the latest I/O schema
+        version, without validating it. See get_fingerprint().
+
+        Args:
+            data:   JSON data to fingerprint.
+
+        Returns:
+            The fingerprint string.
+        """
+        return hashlib.sha256(json.dumps(
+            data, sort_keys=True, separators=(",", ":")
+        ).encode()).hexdigest()
+
+    @staticmethod
+    def get_attributes(io_data):
+        """
+        Get message attributes summarizing JSON data, letting subscriptions
+        and subscribers filter messages without decoding them.
+
+        Args:
+            io_data:    JSON data to summarize, adhering to the latest I/O
+                        schema version.
+
+        Returns:
+            A dictionary of attribute names and their string values:
+            * "schema_version" - the I/O schema version of the data, as
+              "MAJOR.MINOR",
+            * "<LIST>_count" - the number of objects in each object list,
+              e.g. "tests_count",
+            * "origins" - a comma-separated, sorted list of origins of the
+              objects in the data, and the objects they refer to,
+            * "origin_<ORIGIN>" - an empty value for each of those origins,
+              if there are not too many, allowing filters like
+              'attributes:origin_redhat',
+            * "revisions_digest" - a short hash of the sorted IDs of the
+              revisions the data contains or refers to, if any.
+        """
+        assert io.schema.is_valid_latest(io_data)
+        return Publisher._get_attributes(io_data)
+
+    @staticmethod
+    def _get_attributes(io_data):
+        """
+        Get message attributes summarizing JSON data adhering to the latest
+        I/O schema version, without validating it. See get_attributes().
+
+        Args:
+            io_data:    JSON data to summarize.
+
+        Returns:
+            A dictionary of attribute names and their string values.
+        """
+        version = io_data["version"]
+        attributes = dict(
+            schema_version=f"{version['major']}.{version['minor']}"
+        )
+        ids = set()
+        revision_ids = set()
+        for obj_list_name in io.schema.LATEST.tree:
+            if not obj_list_name:
+                continue
+            obj_list = io_data.get(obj_list_name, [])
+            attributes[f"{obj_list_name}_count"] = str(len(obj_list))
+            for obj in obj_list:
+                ids |= {value for key, value in obj.items()
+                        if key == "id" or key.endswith("_id")}
+                if obj_list_name == "revisions":
+                    revision_ids.add(obj["id"])
+                elif "revision_id" in obj:
+                    revision_ids.add(obj["revision_id"])
+        origins = sorted({obj_id.split(":", 1)[0] for obj_id in ids})
+        origins_value = ",".join(origins)
+        if len(origins_value) <= Publisher._MAX_ATTRIBUTE_SIZE:
+            attributes["origins"] = origins_value
+        if len(origins) <= Publisher._MAX_ORIGIN_ATTRIBUTES:
+            attributes.update({f"origin_{origin}": ""
+                               for origin in origins})
+        if revision_ids:
+            attributes["revisions_digest"] = hashlib.sha1(
+                json.dumps(sorted(revision_ids)).encode()
+            ).hexdigest()[:16]
+        return attributes
+
+    @staticmethod
+    def split_data(io_data, max_size):
+        """
+        Split JSON data into pieces, each encoded into at most the
+        specified number of bytes as plain JSON (see encode_data()), and
+        so less with other encodings, as a rule. Objects are kept in
+        the same piece with their descendants (e.g. a build with its
+        tests) as long as they fit, and are otherwise packed with as many
+        of them as fit. Every piece contains the schema version. The
+        splitting is deterministic.
+
+        Args:
+            io_data:    JSON data to split, adhering to an I/O schema
+                        version. Will not be modified.
+            max_size:   Maximum size of each encoded piece, in bytes.
+
+        Returns:
+            A list of JSON data pieces, adhering to the latest I/O schema
+            version. A single piece, if the data fits whole.
+
+        Raises:
+            Exception if an object doesn't fit into a piece by itself.
+        """
+        assert isinstance(max_size, int) and max_size > 0
+        return Publisher._split_data(io.schema.upgrade(io_data), max_size)
+
+    # pylint: disable=too-many-locals
+    @staticmethod
+    def _split_data(data, max_size):
+        """
+        Split JSON data adhering to the latest I/O schema version into
+        pieces, without validating it. See split_data().
+
+        Args:
+            data:       JSON data to split. Will not be modified.
+            max_size:   Maximum size of each encoded piece, in bytes.
+
+        Returns:
+            A list of JSON data pieces. A single piece, if the data fits
+            whole.
+
+        Raises:
+            Exception if an object doesn't fit into a piece by itself.
+        """
+        if len(json.dumps(data)) <= max_size:
+            return [data]
+        tree = io.schema.LATEST.tree
+        obj_list_names = [name for name in tree if name]
+
+        # A dictionary of object list names and parent IDs (None for
+        # top-level objects), and lists of the objects
+        children = {}
+        for parent_list_name, child_list_names in tree.items():
+            for child_list_name in child_list_names:
+                for obj in data.get(child_list_name, []):
+                    parent_id = obj[parent_list_name[:-1] + "_id"] \
+                        if parent_list_name else None
+                    children.setdefault((child_list_name, parent_id),
+                                        []).append(obj)
+
+        def get_node(obj_list_name, obj):
+            """
+            Get a tree node for an object: a tuple containing the object
+            list name, the object, its encoded size, and the list of child
+            nodes, taking the children out of the dictionary.
+            """
+            return (
+                obj_list_name, obj, len(json.dumps(obj)),
+                [
+                    get_node(child_list_name, child)
+                    for child_list_name in tree[obj_list_name]
+                    for child in children.pop((child_list_name, obj["id"]),
+                                              [])
+                ]
+            )
+
+        # Build the object trees, starting with top-level objects, and
+        # continuing with orphans (with parents outside the data), top-down
+        roots = []
+        for obj_list_name in obj_list_names:
+            for key in [key for key in children if key[0] == obj_list_name]:
+                roots.extend(get_node(obj_list_name, obj)
+                             for obj in children.pop(key, []))
+
+        # The encoded size of the version-only piece, and of empty lists
+        base_size = len(json.dumps(dict(version=data["version"])))
+        list_sizes = {name: len(json.dumps({name: []}))
+                      for name in obj_list_names}
+        pieces = []
+        # The lists of objects of the piece being filled, and its size
+        piece = {}
+        piece_size = base_size
+
+        def get_flat(node):
+            """Get a list of (list name, object, size) for a tree node"""
+            return [node[:3]] + [item for child in node[3]
+                                 for item in get_flat(child)]
+
+        def get_size(items, obj_list_names):
+            """
+            Get the size added by objects to a piece, given the names of
+            its non-empty object lists.
+            """
+            obj_list_names = set(obj_list_names)
+            size = 0
+            for obj_list_name, _, obj_size in items:
+                if obj_list_name in obj_list_names:
+                    size += 2 + obj_size
+                else:
+                    size += list_sizes[obj_list_name] + obj_size
+                    obj_list_names.add(obj_list_name)
+            return size
+
+        def flush():
+            """Finish the piece being filled, if not empty"""
+            nonlocal piece, piece_size
+            if piece:
+                pieces.append(dict(
+                    version=data["version"],
+                    **{name: piece[name] for name in obj_list_names
+                       if name in piece}
+                ))
+            piece = {}
+            piece_size = base_size
+
+        def add(node):
+            """Add an object tree node to the pieces"""
+            nonlocal piece_size
+            items = get_flat(node)
+            if piece_size + get_size(items, piece) > max_size:
+                flush()
+            if piece_size + get_size(items, piece) > max_size:
+                if not node[3]:
+                    raise Exception(f"Object {node[1]['id']!r} in "
+                                    f"{node[0]!r} doesn't fit into "
+                                    f"{max_size} bytes")
+                # Split the tree, keeping the object with its first
+                # children, as many as fit
+                add(node[:3] + ([],))
+                for child in node[3]:
+                    add(child)
+                return
+            piece_size += get_size(items, piece)
+            for obj_list_name, obj, _ in items:
+                piece.setdefault(obj_list_name, []).append(obj)
+
+        for root in roots:
+            add(root)
+        flush()
+        return pieces
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, project_id, topic_name,
+                 batch_max_messages=None, batch_max_bytes=None,
+                 batch_max_latency=None,
+                 flow_max_messages=None, flow_max_bytes=None,
+                 flow_block=True, encoding="json", backend=None):
         """
         Initialize a Kernel CI message queue publisher.
 
@@ -36,9 +382,73 @@ class Publisher:
             project_id:         ID of the Google Cloud project to which the
                                 message queue belongs.
             topic_name:         Name of the message queue topic to publish to.
+            batch_max_messages: Maximum number of messages to send in one
+                                batch, or None for the client default.
+            batch_max_bytes:    Maximum size of a batch of messages, in bytes,
+                                or None for the client default.
+            batch_max_latency:  Maximum time to wait for a batch to fill up,
+                                in seconds, or None for the client default.
+            flow_max_messages:  Maximum number of messages published, but
+                                not yet sent, or None for no limit.
+            flow_max_bytes:     Maximum size of messages published, but not
+                                yet sent, in bytes, or None for no limit.
+            flow_block:         True if publishing should block when either
+                                flow limit is exceeded, until enough messages
+                                are sent. False if it should raise an
+                                exception instead.
+            encoding:           The encoding to publish message data in,
+                                one of ENCODINGS.
+            backend:            The local message queue backend
+                                (kcidb.mq.backend.Backend) to use instead of
+                                Google Cloud Pub/Sub, or None. Batching and
+                                flow control settings are ignored for local
+                                backends.
         """
-        self.client = pubsub.PublisherClient()
+        assert batch_max_messages is None or \
+            isinstance(batch_max_messages, int) and batch_max_messages > 0
+        assert batch_max_bytes is None or \
+            isinstance(batch_max_bytes, int) and batch_max_bytes > 0
+        assert batch_max_latency is None or \
+            isinstance(batch_max_latency, (int, float)) and \
+            batch_max_latency >= 0
+        assert flow_max_messages is None or \
+            isinstance(flow_max_messages, int) and flow_max_messages > 0
+        assert flow_max_bytes is None or \
+            isinstance(flow_max_bytes, int) and flow_max_bytes > 0
+        assert encoding in ENCODINGS
+        assert backend is None or isinstance(backend, local.Backend)
+        self.encoding = encoding
+        batch_settings = pubsub.types.BatchSettings(**{
+            name: value for name, value in (
+                ("max_messages", batch_max_messages),
+                ("max_bytes", batch_max_bytes),
+                ("max_latency", batch_max_latency),
+            ) if value is not None
+        })
+        if backend is not None:
+            self.client = backend
+        elif flow_max_messages is None and flow_max_bytes is None:
+            self.client = pubsub.PublisherClient(batch_settings)
+        else:
+            self.client = pubsub.PublisherClient(
+                batch_settings,
+                pubsub.types.PublisherOptions(
+                    flow_control=pubsub.types.PublishFlowControl(
+                        message_limit=flow_max_messages,
+                        byte_limit=flow_max_bytes,
+                        limit_exceeded_behavior=(
+                            pubsub.types.LimitExceededBehavior.BLOCK
+                            if flow_block else
+                            pubsub.types.LimitExceededBehavior.ERROR
+                        )
+                    )
+                )
+            )
         self.topic_path = self.client.topic_path(project_id, topic_name)
+        # Futures of messages published since the last flush, and the
+        # lock protecting them
+        self.futures = []
+        self.futures_lock = threading.Lock()
 
     def init(self):
         """
@@ -52,24 +462,131 @@ class Publisher:
         """
         self.client.delete_topic(self.topic_path)
 
+    def _submit(self, data_iter):
+        """
+        Submit data to the client for publishing. Data too large for a
+        single message is split into several (see split_data()).
+
+        Args:
+            data_iter:  An iterable of JSON data to publish to the message
+                        queue, each adhering to a version of I/O schema.
+
+        Returns:
+            The list of futures of the published messages, in order.
+        """
+        futures = []
+        for data in data_iter:
+            # Validate and upgrade only once, the rest works on the result
+            data = io.schema.upgrade(data)
+            message_data = encode(data, self.encoding)
+            # Only split data not fitting after encoding
+            if len(message_data) <= Publisher.MAX_MESSAGE_SIZE:
+                messages = [(message_data, data)]
+            else:
+                messages = [
+                    (encode(piece, self.encoding), piece)
+                    for piece in Publisher._split_data(
+                        data, Publisher.MAX_MESSAGE_SIZE
+                    )
+                ]
+            for message_data, piece in messages:
+                futures.append(self.client.publish(
+                    self.topic_path, message_data,
+                    encoding=self.encoding,
+                    fingerprint=Publisher._get_fingerprint(piece),
+                    **Publisher._get_attributes(piece)
+                ))
+        return futures
+
+    @staticmethod
+    def _get_results(futures):
+        """
+        Wait for published messages to be sent, and get the results.
+
+        Args:
+            futures:    A list of futures of the published messages.
+
+        Returns:
+            A list containing, for each message, in order, either its
+            message ID (a string), if it was sent successfully, or the
+            exception it failed with.
+        """
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            # The client can fail the futures with any exception
+            except Exception as exc:  # pylint: disable=broad-except
+                results.append(exc)
+        return results
+
+    def publish_many(self, data_iter):
+        """
+        Publish data to the message queue, without waiting for it to be
+        sent. Call flush() to wait for that and to get the results, or
+        wait for the returned futures. Data too large for a single message
+        is split into several (see split_data()).
+
+        Args:
+            data_iter:  An iterable of JSON data to publish to the message
+                        queue, each adhering to a version of I/O schema.
+
+        Returns:
+            The list of futures of the messages published by this call, in
+            order, resolving to message IDs.
+        """
+        futures = self._submit(data_iter)
+        with self.futures_lock:
+            self.futures.extend(futures)
+        return futures
+
+    def flush(self):
+        """
+        Wait for all data published since the previous flush to be sent.
+
+        Returns:
+            A list containing, for each message published since the
+            previous flush, in order, either its message ID (a string), if
+            it was sent successfully, or the exception it failed with.
+        """
+        with self.futures_lock:
+            futures = self.futures
+            self.futures = []
+        return Publisher._get_results(futures)
+
     def publish(self, data):
         """
-        Publish data to the message queue.
+        Publish data to the message queue, and wait for it to be sent.
+        Doesn't affect data published with publish_many(), and
+        not flushed yet.
 
         Args:
             data:   The JSON data to publish to the message queue.
                     Must adhere to a version of I/O schema.
+
+        Returns:
+            The list of IDs of the published messages, more than one, if
+            the data had to be split.
+
+        Raises:
+            The exception sending the data failed with.
         """
-        assert io.schema.is_valid(data)
-        self.client.publish(self.topic_path, Publisher.encode_data(data))
+        results = Publisher._get_results(self._submit([data]))
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
 
 
 class Subscriber:
     """Kernel CI message queue subscriber"""
-    # pylint: disable=no-member
+    # pylint: disable=no-member,too-many-instance-attributes
+
+    # Maximum number of ack IDs to acknowledge in one request
+    _MAX_ACK_IDS = 1000
 
     @staticmethod
-    def decode_data(message_data):
+    def decode_data(message_data, encoding=None):
         """
         Decode message data to extract the JSON data adhering to the latest
         I/O schema.
@@ -78,14 +595,21 @@ class Subscriber:
             message_data:   The message data from the message queue
                             ("data" field of pubsub.types.PubsubMessage) to be
                             decoded.
+            encoding:       The encoding of the message data (the value of
+                            the "encoding" message attribute), one of
+                            ENCODINGS, or None for plain JSON.
 
         Returns
             The decoded JSON data adhering to the latest I/O schema.
         """
-        data = json.loads(message_data.decode())
+        data = decode(message_data, encoding)
         return io.schema.upgrade(data, copy=False)
 
-    def __init__(self, project_id, topic_name, subscription_name):
+    # pylint: disable=too-many-arguments
+    def __init__(self, project_id, topic_name, subscription_name,
+                 backend=None, lease_extension=60, max_lease=3600,
+                 dead_letter_sink=None, max_attempts=5,
+                 min_backoff=10, max_backoff=600):
         """
         Initialize a Kernel CI message queue subscriber.
 
@@ -95,58 +619,664 @@ class Subscriber:
             topic_name:         Name of the message queue topic to subscribe
                                 to.
             subscription_name:  Name of the subscription to use.
+            backend:            The local message queue backend
+                                (kcidb.mq.backend.Backend) to use instead of
+                                Google Cloud Pub/Sub, or None.
+            lease_extension:    Number of seconds to extend the
+                                acknowledgement deadline of pulled messages
+                                by, in the background, until they're
+                                acknowledged, or None to not extend it.
+                                At most 600.
+            max_lease:          Maximum number of seconds to keep extending
+                                the deadline of a message for, before
+                                letting it be delivered again.
+            dead_letter_sink:   The sink (kcidb.mq.dead_letter.Sink) to move
+                                messages failing to process too many times
+                                to, or None to keep retrying them.
+            max_attempts:       The number of attempts to process a message,
+                                before moving it to the dead-letter sink.
+            min_backoff:        Number of seconds to delay the delivery of a
+                                message after its first failure, doubled
+                                after each next one.
+            max_backoff:        Maximum number of seconds to delay the
+                                delivery of a failed message. At most 600.
         """
-        self.client = pubsub.SubscriberClient()
+        assert backend is None or isinstance(backend, local.Backend)
+        assert lease_extension is None or \
+            isinstance(lease_extension, (int, float)) and \
+            0 < lease_extension <= 600
+        assert isinstance(max_lease, (int, float)) and max_lease > 0
+        assert dead_letter_sink is None or \
+            isinstance(dead_letter_sink, dead_letter.Sink)
+        assert isinstance(max_attempts, int) and max_attempts > 0
+        assert isinstance(min_backoff, int) and \
+            isinstance(max_backoff, int) and \
+            0 <= min_backoff <= max_backoff <= 600
+        # The local backend, or the Pub/Sub client, created on first use
+        self._client = backend
+        self.lease_extension = lease_extension
+        self.max_lease = max_lease
+        # IDs of pulled, but not yet (n)acked messages, and the
+        # time.monotonic() they were pulled at, the lock guarding them, and
+        # the thread extending their deadlines, while there are any
+        self.leases = {}
+        self.leases_lock = threading.Lock()
+        self.lease_thread = None
+        self.dead_letter_sink = dead_letter_sink
+        self.max_attempts = max_attempts
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # IDs of pulled, but not yet (n)acked messages, and tuples of the
+        # messages (pubsub.types.PubsubMessage) and their delivery attempt
+        # numbers, guarded by leases_lock
+        self.messages = {}
+        # The counter of delivery attempts for messages arriving without
+        # one (subscriptions without a dead-letter policy)
+        self.attempt_counter = dead_letter.AttemptCounter()
+        paths = pubsub.SubscriberClient if backend is None else backend
         self.subscription_path = \
-            self.client.subscription_path(project_id, subscription_name)
-        self.topic_path = self.client.topic_path(project_id, topic_name)
+            paths.subscription_path(project_id, subscription_name)
+        self.topic_path = paths.topic_path(project_id, topic_name)
 
-    def init(self):
+    @property
+    def client(self):
+        """The local backend, or the Pub/Sub client"""
+        if self._client is None:
+            self._client = pubsub.SubscriberClient()
+        return self._client
+
+    def init(self, filter_expr=None):
         """
         Initialize subscription setup.
+
+        Args:
+            filter_expr:    The Pub/Sub filter expression for messages to
+                            deliver to the subscription, matching their
+                            attributes (see Publisher.get_attributes()),
+                            or None to deliver all messages.
         """
-        self.client.create_subscription(self.subscription_path,
-                                        self.topic_path)
+        assert filter_expr is None or isinstance(filter_expr, str)
+        request = dict(name=self.subscription_path, topic=self.topic_path)
+        if filter_expr is not None:
+            request["filter"] = filter_expr
+        # Have rejected messages delivered again with a backoff
+        if self.dead_letter_sink is not None:
+            request["retry_policy"] = dict(
+                minimum_backoff=dict(seconds=self.min_backoff),
+                maximum_backoff=dict(seconds=self.max_backoff),
+            )
+        self.client.create_subscription(request=request)
 
     def cleanup(self):
         """
         Cleanup subscription setup.
         """
-        self.client.delete_subscription(self.subscription_path)
+        self.client.delete_subscription(
+            request=dict(subscription=self.subscription_path)
+        )
 
-    def pull(self):
+    def get_attempt(self, message, delivery_attempt):
         """
-        Pull published data from the message queue.
+        Get the number of a delivery attempt of a received message.
+
+        Args:
+            message:            The received message, having "message_id".
+            delivery_attempt:   The delivery attempt number received with
+                                the message, or zero/None, if the
+                                subscription doesn't count them.
 
         Returns:
-            Two values:
+            The delivery attempt number, starting from one.
+        """
+        return delivery_attempt or \
+            self.attempt_counter.increment(message.message_id)
+
+    def pull(self, max_messages=1):
+        """
+        Pull published data from the message queue, waiting for at least
+        one message to arrive. The acknowledgement deadline of the
+        messages is extended in the background (if enabled), until they're
+        acknowledged or rejected, or the maximum lease time passes.
+        If a dead-letter sink is specified, messages failing to decode are
+        handled as failed (see fail()), instead of raising an exception.
+
+        Args:
+            max_messages:   Maximum number of messages to pull at once.
+
+        Returns:
+            A list of tuples, one per pulled message, each containing:
             * The ID to use when acknowledging the reception of the data.
             * The JSON data from the message queue, adhering to the latest I/O
               schema.
         """
-        while True:
+        assert isinstance(max_messages, int) and max_messages > 0
+        items = []
+        while not items:
             try:
                 # Setting *some* timeout, because infinite timeout doesn't
                 # seem to be supported
-                response = self.client.pull(self.subscription_path, 1,
-                                            timeout=300)
-                if response.received_messages:
-                    break
+                response = self.client.pull(
+                    request=dict(subscription=self.subscription_path,
+                                 max_messages=max_messages),
+                    timeout=300
+                )
             except DeadlineExceeded:
+                continue
+            with self.leases_lock:
+                for message in response.received_messages:
+                    self.messages[message.ack_id] = (
+                        message.message,
+                        self.get_attempt(message.message,
+                                         message.delivery_attempt)
+                    )
+            self._lease(message.ack_id
+                        for message in response.received_messages)
+            for message in response.received_messages:
+                try:
+                    data = Subscriber.decode_data(
+                        message.message.data,
+                        message.message.attributes.get("encoding")
+                    )
+                    assert io.schema.is_valid_latest(data)
+                # Any decoding failure makes a message undeliverable
+                except Exception as exc:  # pylint: disable=broad-except
+                    if self.dead_letter_sink is not None:
+                        self.fail(message.ack_id, exc)
+                        continue
+                    # Let the messages expire, as before leasing
+                    self._release(message.ack_id
+                                  for message in response.received_messages)
+                    raise
+                items.append((message.ack_id, data))
+        return items
+
+    def _modify_ack_deadline(self, ack_ids, seconds):
+        """
+        Set the acknowledgement deadline of pulled messages.
+
+        Args:
+            ack_ids:    A list of the IDs received with the messages.
+            seconds:    Number of seconds from now to set the deadline to.
+        """
+        for index in range(0, len(ack_ids), Subscriber._MAX_ACK_IDS):
+            self.client.modify_ack_deadline(request=dict(
+                subscription=self.subscription_path,
+                ack_ids=ack_ids[index:index + Subscriber._MAX_ACK_IDS],
+                ack_deadline_seconds=seconds
+            ))
+
+    def _lease(self, ack_ids):
+        """
+        Start extending the acknowledgement deadline of pulled messages,
+        if enabled.
+
+        Args:
+            ack_ids:    An iterable of the IDs received with the messages.
+        """
+        if self.lease_extension is None:
+            return
+        ack_ids = list(ack_ids)
+        self._modify_ack_deadline(ack_ids, self.lease_extension)
+        now = time.monotonic()
+        with self.leases_lock:
+            for ack_id in ack_ids:
+                self.leases[ack_id] = now
+            if self.leases and self.lease_thread is None:
+                self.lease_thread = threading.Thread(
+                    target=self._extend_leases, daemon=True
+                )
+                self.lease_thread.start()
+
+    def _extend_leases(self):
+        """
+        Keep extending the acknowledgement deadline of leased messages,
+        until there are none, dropping those leased for too long.
+        """
+        while True:
+            # Extend well before the deadline, in case requests are slow
+            time.sleep(self.lease_extension / 2)
+            now = time.monotonic()
+            with self.leases_lock:
+                for ack_id, leased in list(self.leases.items()):
+                    if now - leased >= self.max_lease:
+                        del self.leases[ack_id]
+                if not self.leases:
+                    self.lease_thread = None
+                    return
+                ack_ids = list(self.leases)
+            try:
+                self._modify_ack_deadline(ack_ids, self.lease_extension)
+            # Expired messages are simply delivered again
+            except Exception:  # pylint: disable=broad-except
                 pass
-        message = response.received_messages[0]
-        data = Subscriber.decode_data(message.message.data)
-        assert io.schema.is_valid_latest(data)
-        return message.ack_id, data
 
-    def ack(self, ack_id):
+    def _release(self, ack_ids):
+        """
+        Stop extending the acknowledgement deadline of pulled messages,
+        and stop tracking them.
+
+        Args:
+            ack_ids:    An iterable of the IDs received with the messages.
+
+        Returns:
+            A list of tuples of released messages and their delivery
+            attempt numbers, for the tracked ones.
+        """
+        released = []
+        with self.leases_lock:
+            for ack_id in ack_ids:
+                self.leases.pop(ack_id, None)
+                if ack_id in self.messages:
+                    released.append(self.messages.pop(ack_id))
+        return released
+
+    def subscribe(self, callback, concurrency=10):
+        """
+        Start receiving published data from the message queue over a
+        streaming connection, in the background, handing it to a callback.
+        Data is acknowledged if the callback returns, and is redelivered
+        later, if it raises an exception, with the backoff set up by
+        init(), or moved to the dead-letter sink, if specified, after too
+        many attempts. Its deadline is extended while the callback runs,
+        for at most the maximum lease time.
+
+        Args:
+            callback:       The function to call with each received JSON
+                            data, adhering to the latest I/O schema.
+                            Called from worker threads.
+            concurrency:    Maximum number of messages to process (and keep
+                            leased) at once, and the number of worker
+                            threads to process them with.
+
+        Returns:
+            The streaming pull future, which can be used to wait for the
+            subscription to fail (result()), or to stop it (cancel()).
+        """
+        assert callable(callback)
+        assert isinstance(concurrency, int) and concurrency > 0
+
+        def process(message):
+            """Process a received message"""
+            attempt = self.get_attempt(message, message.delivery_attempt)
+            try:
+                data = Subscriber.decode_data(
+                    message.data, message.attributes.get("encoding")
+                )
+                assert io.schema.is_valid_latest(data)
+                callback(data)
+            except Exception as exc:  # pylint: disable=broad-except
+                if self.dead_letter_sink is None or \
+                   attempt < self.max_attempts:
+                    message.nack()
+                    raise
+                self.dead_letter_sink.put(message.data,
+                                          dict(message.attributes),
+                                          repr(exc), attempt)
+            except BaseException:
+                message.nack()
+                raise
+            self.attempt_counter.forget(message.message_id)
+            message.ack()
+
+        return self.client.subscribe(
+            self.subscription_path, process,
+            flow_control=pubsub.types.FlowControl(
+                max_messages=concurrency,
+                max_lease_duration=self.max_lease
+            ),
+            scheduler=scheduler.ThreadScheduler(
+                executor=concurrent.futures.ThreadPoolExecutor(
+                    max_workers=concurrency
+                )
+            )
+        )
+
+    def ack(self, *ack_ids):
         """
         Acknowledge reception of data.
 
         Args:
-            ack_id: The ID received with the data to be acknowledged.
+            ack_ids:    The IDs received with the data to be acknowledged.
+        """
+        for message, _ in self._release(ack_ids):
+            self.attempt_counter.forget(message.message_id)
+        for index in range(0, len(ack_ids), Subscriber._MAX_ACK_IDS):
+            self.client.acknowledge(request=dict(
+                subscription=self.subscription_path,
+                ack_ids=list(ack_ids[index:index + Subscriber._MAX_ACK_IDS])
+            ))
+
+    def nack(self, *ack_ids):
+        """
+        Reject data, e.g. on failure to process it, so it's delivered
+        again right away, instead of after the deadline.
+
+        Args:
+            ack_ids:    The IDs received with the data to be rejected.
+        """
+        self._release(ack_ids)
+        self._modify_ack_deadline(list(ack_ids), 0)
+
+    def fail(self, ack_id, error):
+        """
+        Report a failure to process pulled data. The data is delivered
+        again after a delay, growing exponentially with each failed
+        attempt, or, if a dead-letter sink is specified, and the maximum
+        number of attempts is reached, is moved there, along with the
+        error, and acknowledged.
+
+        Args:
+            ack_id: The ID received with the data which failed to process.
+            error:  The exception, or the string describing the failure.
+
+        Returns:
+            True if the data was moved to the dead-letter sink, False
+            otherwise.
+        """
+        assert isinstance(error, (str, Exception))
+        with self.leases_lock:
+            message, attempt = self.messages.get(ack_id, (None, 1))
+        if message is not None and self.dead_letter_sink is not None and \
+           attempt >= self.max_attempts:
+            self.dead_letter_sink.put(
+                message.data, dict(message.attributes),
+                error if isinstance(error, str) else repr(error), attempt
+            )
+            self.ack(ack_id)
+            return True
+        self._release([ack_id])
+        self._modify_ack_deadline(
+            [ack_id],
+            dead_letter.get_backoff(attempt,
+                                    self.min_backoff, self.max_backoff)
+        )
+        return False
+
+
+class AsyncPublisher(Publisher):
+    """
+    Kernel CI message queue publisher for asyncio code, with awaitable
+    publishing results. Should be created with flow_block=False, if flow
+    control is enabled, as blocking would stall the event loop.
+    """
+
+    # pylint: disable=invalid-overridden-method
+    async def publish_many(self, data_iter):
         """
-        self.client.acknowledge(self.subscription_path, [ack_id])
+        Publish data to the message queue, without waiting for it to be
+        sent, letting other tasks run between publishing each data. Await
+        flush() to wait for that and to get the results. Data too large for
+        a single message is split into several (see
+        Publisher.split_data()).
+
+        Args:
+            data_iter:  An iterable of JSON data to publish to the message
+                        queue, each adhering to a version of I/O schema.
+
+        Returns:
+            The list of futures (concurrent.futures.Future) of the
+            messages published by this call, in order, resolving to message
+            IDs.
+        """
+        futures = []
+        for data in data_iter:
+            futures += super().publish_many([data])
+            await asyncio.sleep(0)
+        return futures
+
+    # pylint: disable=invalid-overridden-method
+    async def flush(self):
+        """
+        Wait for all data published since the previous flush to be sent,
+        without blocking the event loop.
+
+        Returns:
+            A list containing, for each message published since the
+            previous flush, in order, either its message ID (a string), if
+            it was sent successfully, or the exception it failed with.
+        """
+        with self.futures_lock:
+            futures = self.futures
+            self.futures = []
+        return list(await asyncio.gather(
+            *(asyncio.wrap_future(future) for future in futures),
+            return_exceptions=True
+        ))
+
+    # pylint: disable=invalid-overridden-method
+    async def publish(self, data):
+        """
+        Publish data to the message queue, and wait for it to be sent,
+        without blocking the event loop. Doesn't affect data published
+        with publish_many(), and not flushed yet.
+
+        Args:
+            data:   The JSON data to publish to the message queue.
+                    Must adhere to a version of I/O schema.
+
+        Returns:
+            The list of IDs of the published messages, more than one, if
+            the data had to be split.
+
+        Raises:
+            The exception sending the data failed with.
+        """
+        assert io.schema.is_valid(data)
+        results = list(await asyncio.gather(
+            *(asyncio.wrap_future(future)
+              for future in self._submit([data])),
+            return_exceptions=True
+        ))
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+
+class AsyncSubscriber(Subscriber):
+    """
+    Kernel CI message queue subscriber for asyncio code, pulling and
+    (n)acknowledging over an asynchronous connection. Doesn't support
+    local backends, extending the deadline of pulled messages (the
+    subscription's acknowledgement deadline applies), and streaming
+    (subscribe()). Setting up subscriptions (init() and cleanup()) blocks.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, project_id, topic_name, subscription_name,
+                 dead_letter_sink=None, max_attempts=5,
+                 min_backoff=10, max_backoff=600):
+        """
+        Initialize a Kernel CI message queue subscriber for asyncio code.
+
+        Args:
+            project_id:         ID of the Google Cloud project to which the
+                                message queue belongs.
+            topic_name:         Name of the message queue topic to subscribe
+                                to.
+            subscription_name:  Name of the subscription to use.
+            dead_letter_sink:   The sink (kcidb.mq.dead_letter.Sink) to move
+                                messages failing to process too many times
+                                to, or None to keep retrying them.
+                                Written to in a worker thread.
+            max_attempts:       The number of attempts to process a message,
+                                before moving it to the dead-letter sink.
+            min_backoff:        Number of seconds to delay the delivery of a
+                                message after its first failure, doubled
+                                after each next one.
+            max_backoff:        Maximum number of seconds to delay the
+                                delivery of a failed message. At most 600.
+        """
+        super().__init__(project_id, topic_name, subscription_name,
+                         lease_extension=None,
+                         dead_letter_sink=dead_letter_sink,
+                         max_attempts=max_attempts,
+                         min_backoff=min_backoff, max_backoff=max_backoff)
+        # The asynchronous client, created on first use, within the
+        # event loop
+        self.async_client = None
+
+    def get_async_client(self):
+        """
+        Get the asynchronous client, creating it, if not created yet.
+        Must be called within the running event loop.
+
+        Returns:
+            The asynchronous client (pubsub_v1.SubscriberAsyncClient).
+        """
+        if self.async_client is None:
+            self.async_client = pubsub_v1.SubscriberAsyncClient()
+        return self.async_client
+
+    # pylint: disable=invalid-overridden-method
+    async def pull(self, max_messages=1):
+        """
+        Pull published data from the message queue, waiting for at least
+        one message to arrive, without blocking the event loop.
+        If a dead-letter sink is specified, messages failing to decode are
+        handled as failed (see fail()), instead of raising an exception.
+
+        Args:
+            max_messages:   Maximum number of messages to pull at once.
+
+        Returns:
+            A list of tuples, one per pulled message, each containing:
+            * The ID to use when acknowledging the reception of the data.
+            * The JSON data from the message queue, adhering to the latest I/O
+              schema.
+        """
+        assert isinstance(max_messages, int) and max_messages > 0
+        client = self.get_async_client()
+        items = []
+        while not items:
+            try:
+                # Setting *some* timeout, because infinite timeout doesn't
+                # seem to be supported
+                response = await client.pull(
+                    request=dict(subscription=self.subscription_path,
+                                 max_messages=max_messages),
+                    timeout=300
+                )
+            except DeadlineExceeded:
+                continue
+            with self.leases_lock:
+                for message in response.received_messages:
+                    self.messages[message.ack_id] = (
+                        message.message,
+                        self.get_attempt(message.message,
+                                         message.delivery_attempt)
+                    )
+            for message in response.received_messages:
+                try:
+                    data = Subscriber.decode_data(
+                        message.message.data,
+                        message.message.attributes.get("encoding")
+                    )
+                    assert io.schema.is_valid_latest(data)
+                # Any decoding failure makes a message undeliverable
+                except Exception as exc:  # pylint: disable=broad-except
+                    if self.dead_letter_sink is not None:
+                        await self.fail(message.ack_id, exc)
+                        continue
+                    self._release(message.ack_id
+                                  for message in response.received_messages)
+                    raise
+                items.append((message.ack_id, data))
+        return items
+
+    # pylint: disable=invalid-overridden-method
+    async def _modify_ack_deadline(self, ack_ids, seconds):
+        """
+        Set the acknowledgement deadline of pulled messages, without
+        blocking the event loop.
+
+        Args:
+            ack_ids:    A list of the IDs received with the messages.
+            seconds:    Number of seconds from now to set the deadline to.
+        """
+        client = self.get_async_client()
+        await asyncio.gather(*(
+            client.modify_ack_deadline(request=dict(
+                subscription=self.subscription_path,
+                ack_ids=ack_ids[index:index + Subscriber._MAX_ACK_IDS],
+                ack_deadline_seconds=seconds
+            ))
+            for index in range(0, len(ack_ids), Subscriber._MAX_ACK_IDS)
+        ))
+
+    def subscribe(self, callback, concurrency=10):
+        """
+        Not supported, use pull() instead.
+        """
+        raise NotImplementedError(
+            "Asynchronous subscribers don't support streaming"
+        )
+
+    # pylint: disable=invalid-overridden-method
+    async def ack(self, *ack_ids):
+        """
+        Acknowledge reception of data, without blocking the event loop.
+
+        Args:
+            ack_ids:    The IDs received with the data to be acknowledged.
+        """
+        for message, _ in self._release(ack_ids):
+            self.attempt_counter.forget(message.message_id)
+        client = self.get_async_client()
+        await asyncio.gather(*(
+            client.acknowledge(request=dict(
+                subscription=self.subscription_path,
+                ack_ids=list(ack_ids[index:index +
+                                     Subscriber._MAX_ACK_IDS])
+            ))
+            for index in range(0, len(ack_ids), Subscriber._MAX_ACK_IDS)
+        ))
+
+    # pylint: disable=invalid-overridden-method
+    async def nack(self, *ack_ids):
+        """
+        Reject data, e.g. on failure to process it, so it's delivered
+        again right away, without blocking the event loop.
+
+        Args:
+            ack_ids:    The IDs received with the data to be rejected.
+        """
+        self._release(ack_ids)
+        await self._modify_ack_deadline(list(ack_ids), 0)
+
+    # pylint: disable=invalid-overridden-method
+    async def fail(self, ack_id, error):
+        """
+        Report a failure to process pulled data, without blocking the
+        event loop. See Subscriber.fail() for details.
+
+        Args:
+            ack_id: The ID received with the data which failed to process.
+            error:  The exception, or the string describing the failure.
+
+        Returns:
+            True if the data was moved to the dead-letter sink, False
+            otherwise.
+        """
+        assert isinstance(error, (str, Exception))
+        with self.leases_lock:
+            message, attempt = self.messages.get(ack_id, (None, 1))
+        if message is not None and self.dead_letter_sink is not None and \
+           attempt >= self.max_attempts:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.dead_letter_sink.put,
+                message.data, dict(message.attributes),
+                error if isinstance(error, str) else repr(error), attempt
+            )
+            await self.ack(ack_id)
+            return True
+        self._release([ack_id])
+        await self._modify_ack_deadline(
+            [ack_id],
+            dead_letter.get_backoff(attempt,
+                                    self.min_backoff, self.max_backoff)
+        )
+        return False
 
 
 def publisher_init_main():
@@ -205,10 +1335,16 @@ def publisher_publish_main():
         help='Name of the message queue topic to publish to',
         required=True
     )
+    parser.add_argument(
+        '-e', '--encoding',
+        help='Encoding of the published message data',
+        choices=ENCODINGS,
+        default="json"
+    )
     args = parser.parse_args()
     data = json.load(sys.stdin)
     data = io.schema.upgrade(data, copy=False)
-    publisher = Publisher(args.project, args.topic)
+    publisher = Publisher(args.project, args.topic, encoding=args.encoding)
     publisher.publish(data)
 
 
@@ -232,9 +1368,17 @@ def subscriber_init_main():
         help='Name of the subscription to create',
         required=True
     )
+    parser.add_argument(
+        '-f', '--filter',
+        metavar="EXPRESSION",
+        help='Only deliver messages with attributes matching the Pub/Sub '
+             'filter EXPRESSION, e.g. \'attributes:origin_redhat AND '
+             'attributes.tests_count != "0"\'',
+        default=None
+    )
     args = parser.parse_args()
     subscriber = Subscriber(args.project, args.topic, args.subscription)
-    subscriber.init()
+    subscriber.init(filter_expr=args.filter)
 
 
 def subscriber_cleanup_main():
@@ -282,9 +1426,252 @@ def subscriber_pull_main():
         help='Name of the subscription to pull from',
         required=True
     )
+    parser.add_argument(
+        '-m', '--max-messages',
+        metavar="NUMBER",
+        type=int,
+        default=1,
+        help='Pull at most NUMBER messages at once, outputting their data '
+             'as separate JSON documents',
+    )
     args = parser.parse_args()
+    if args.max_messages <= 0:
+        parser.error("Maximum number of messages must be positive")
     subscriber = Subscriber(args.project, args.topic, args.subscription)
-    ack_id, data = subscriber.pull()
-    json.dump(data, sys.stdout, indent=4, sort_keys=True)
+    items = subscriber.pull(max_messages=args.max_messages)
+    for _, data in items:
+        json.dump(data, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
     sys.stdout.flush()
-    subscriber.ack(ack_id)
+    subscriber.ack(*(ack_id for ack_id, _ in items))
+
+
+def encoding_bench_main():
+    """Execute the kcidb-mq-encoding-bench command-line tool"""
+    description = \
+        'kcidb-mq-encoding-bench - Benchmark message data encodings ' \
+        'on I/O data'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-e', '--encoding',
+        help='An encoding to benchmark. Repeat to benchmark several. '
+             'Default is all encodings with available dependencies.',
+        choices=ENCODINGS,
+        default=[],
+        dest="encodings",
+        action='append'
+    )
+    parser.add_argument(
+        '-n', '--repeat',
+        metavar="NUMBER",
+        type=int,
+        default=10,
+        help='Encode and decode the data NUMBER times, and report the '
+             'average time',
+    )
+    args = parser.parse_args()
+    if args.repeat <= 0:
+        parser.error("Number of repetitions must be positive")
+    encodings = args.encodings or [
+        encoding for encoding in ENCODINGS
+        if not encoding.startswith("msgpack") or
+        importlib.util.find_spec("msgpack")
+    ]
+    data = json.load(sys.stdin)
+    data = io.schema.upgrade(data, copy=False)
+    # Measure the encodings alone, without validating the data
+    json_size = len(encode(data, "json"))
+    print(f"{'ENCODING':<16}{'SIZE':>12}{'RATIO':>8}"
+          f"{'ENCODE MS':>12}{'DECODE MS':>12}")
+    for encoding in encodings:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            message_data = encode(data, encoding)
+        encode_time = (time.perf_counter() - started) / args.repeat
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            decode(message_data, encoding)
+        decode_time = (time.perf_counter() - started) / args.repeat
+        print(f"{encoding:<16}{len(message_data):>12}"
+              f"{json_size / len(message_data):>8.2f}"
+              f"{encode_time * 1000:>12.2f}{decode_time * 1000:>12.2f}")
+
+
+# pylint: disable=too-many-locals
+def bench_main():
+    """Execute the kcidb-mq-bench command-line tool"""
+    description = \
+        'kcidb-mq-bench - Benchmark message queue throughput with ' \
+        'a local backend'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-b', '--backend',
+        metavar="SPEC",
+        help='The local backend to benchmark: "memory" (default), or '
+             '"file:PATH" for files in the directory at PATH',
+        default="memory"
+    )
+    parser.add_argument(
+        '-n', '--messages',
+        metavar="NUMBER",
+        type=int,
+        default=1000,
+        help='Publish and receive NUMBER messages',
+    )
+    parser.add_argument(
+        '-s', '--size',
+        metavar="NUMBER",
+        type=int,
+        default=10,
+        help='Put NUMBER tests into each published report',
+    )
+    parser.add_argument(
+        '-m', '--max-messages',
+        metavar="NUMBER",
+        type=int,
+        default=100,
+        help='Pull at most NUMBER messages at once',
+    )
+    parser.add_argument(
+        '-e', '--encoding',
+        help='Encoding of the published message data',
+        choices=ENCODINGS,
+        default="json"
+    )
+    args = parser.parse_args()
+    if args.messages <= 0:
+        parser.error("Number of messages must be positive")
+    if args.size < 0:
+        parser.error("Number of tests must not be negative")
+    if args.max_messages <= 0:
+        parser.error("Maximum number of messages must be positive")
+    backend = local.from_spec(args.backend)
+    name = f"kcidb_mq_bench_{os.getpid()}"
+    publisher = Publisher(None, name, backend=backend)
+    subscriber = Subscriber(None, name, name, backend=backend)
+    publisher.init()
+    subscriber.init()
+    try:
+        data = dict(
+            version=dict(major=io.schema.LATEST.major,
+                         minor=io.schema.LATEST.minor),
+            builds=[dict(id="bench:b", revision_id="bench:r")],
+            tests=[
+                dict(id=f"bench:t{t}", build_id="bench:b",
+                     path=f"bench.test{t}", status="PASS")
+                for t in range(args.size)
+            ],
+        )
+        # Measure the transport alone, without validating the data
+        message_data = encode(data, args.encoding)
+        attributes = dict(encoding=args.encoding,
+                          **Publisher.get_attributes(data))
+        size = len(message_data) * args.messages
+        started = time.perf_counter()
+        futures = [
+            backend.publish(publisher.topic_path, message_data,
+                            **attributes)
+            for _ in range(args.messages)
+        ]
+        for future in futures:
+            future.result()
+        publish_time = time.perf_counter() - started
+        started = time.perf_counter()
+        received = 0
+        while received < args.messages:
+            response = backend.pull(subscriber.subscription_path,
+                                    args.max_messages)
+            for message in response.received_messages:
+                decode(message.message.data,
+                       message.message.attributes.get("encoding"))
+            backend.acknowledge(subscriber.subscription_path,
+                                [message.ack_id
+                                 for message in response.received_messages])
+            received += len(response.received_messages)
+        receive_time = time.perf_counter() - started
+    finally:
+        subscriber.cleanup()
+        publisher.cleanup()
+    print(f"{'STAGE':<12}{'MESSAGES':>12}{'SECONDS':>12}"
+          f"{'MSG/S':>12}{'MB/S':>12}")
+    for stage, stage_time in (("publish", publish_time),
+                              ("receive", receive_time)):
+        print(f"{stage:<12}{args.messages:>12}{stage_time:>12.3f}"
+              f"{args.messages / stage_time:>12.1f}"
+              f"{size / stage_time / 1024 / 1024:>12.2f}")
+
+
+def dead_letter_replay_main():
+    """Execute the kcidb-mq-dead-letter-replay command-line tool"""
+    description = \
+        'kcidb-mq-dead-letter-replay - Publish dead-lettered messages ' \
+        'again, and remove them'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '-p', '--project',
+        help='ID of the Google Cloud project with the message queue',
+        required=True
+    )
+    parser.add_argument(
+        '-t', '--topic',
+        help='Name of the message queue topic to publish the messages to',
+        required=True
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        '-d', '--dir',
+        metavar="PATH",
+        help='Replay messages from files in the dead-letter directory at '
+             'PATH'
+    )
+    source.add_argument(
+        '-s', '--subscription',
+        help='Replay messages pulled from the named subscription to '
+             'the dead-letter topic'
+    )
+    parser.add_argument(
+        '-m', '--max-messages',
+        metavar="NUMBER",
+        type=int,
+        default=100,
+        help='Replay at most NUMBER messages',
+    )
+    args = parser.parse_args()
+    if args.max_messages <= 0:
+        parser.error("Maximum number of messages must be positive")
+    publisher = Publisher(args.project, args.topic)
+
+    def replay(data, attributes):
+        """Publish message data with the original attributes"""
+        publisher.client.publish(
+            publisher.topic_path, data,
+            **{name: value for name, value in attributes.items()
+               if name not in (dead_letter.ERROR_ATTRIBUTE,
+                               dead_letter.ATTEMPTS_ATTRIBUTE)}
+        ).result()
+
+    count = 0
+    if args.dir is not None:
+        sink = dead_letter.DirSink(args.dir)
+        for path in sink.get_paths()[:args.max_messages]:
+            data, entry = dead_letter.DirSink.load(path)
+            replay(data, entry["attributes"])
+            os.remove(path)
+            count += 1
+    else:
+        # The dead-letter topic is only used by init()
+        subscriber = Subscriber(args.project, args.topic, args.subscription)
+        try:
+            # Take whatever is available, without validating the data
+            response = subscriber.client.pull(
+                request=dict(subscription=subscriber.subscription_path,
+                             max_messages=args.max_messages),
+                timeout=60
+            )
+        except DeadlineExceeded:
+            response = None
+        for message in response.received_messages if response else []:
+            replay(message.message.data, message.message.attributes)
+            subscriber.ack(message.ack_id)
+            count += 1
+    print(f"Replayed {count} message(s)", file=sys.stderr)
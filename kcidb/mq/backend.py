@@ -0,0 +1,774 @@
+"""Kernel CI report message queue - local backends"""
+
+import os
+import re
+import json
+import shutil
+import struct
+import threading
+import time
+import concurrent.futures
+from collections import namedtuple
+
+# A stored message
+Message = namedtuple("Message", "data attributes message_id")
+
+# A message received from a subscription, with the ID to acknowledge it
+# with, and the number of times it was delivered, including this time
+ReceivedMessage = namedtuple("ReceivedMessage",
+                             "ack_id message delivery_attempt")
+
+# A response to a pull request
+PullResponse = namedtuple("PullResponse", "received_messages")
+
+# A regex matching valid local topic and subscription names
+_NAME_RE = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+class Backend:
+    """
+    An abstract message queue backend, used by kcidb.mq.Publisher and
+    kcidb.mq.Subscriber instead of Google Cloud Pub/Sub. Implements the
+    subset of the Pub/Sub client interfaces they use.
+    """
+
+    def topic_path(self, project_id, topic_name):
+        """
+        Get the path of a topic.
+
+        Args:
+            project_id: ID of the project the topic belongs to.
+            topic_name: Name of the topic.
+
+        Returns:
+            The topic path.
+        """
+        raise NotImplementedError
+
+    def subscription_path(self, project_id, subscription_name):
+        """
+        Get the path of a subscription.
+
+        Args:
+            project_id:         ID of the project the subscription belongs
+                                to.
+            subscription_name:  Name of the subscription.
+
+        Returns:
+            The subscription path.
+        """
+        raise NotImplementedError
+
+    def create_topic(self, topic):
+        """
+        Create a topic.
+
+        Args:
+            topic:  The path of the topic to create.
+        """
+        raise NotImplementedError
+
+    def delete_topic(self, topic):
+        """
+        Delete a topic, along with its messages.
+
+        Args:
+            topic:  The path of the topic to delete.
+        """
+        raise NotImplementedError
+
+    def create_subscription(self, name=None, topic=None, request=None):
+        """
+        Create a subscription, receiving messages published to a topic
+        after that.
+
+        Args:
+            name:       The path of the subscription to create.
+            topic:      The path of the topic to subscribe to.
+            request:    A dictionary with the "name" and "topic" of the
+                        subscription, and optionally the message "filter",
+                        instead of the two above, or None.
+        """
+        raise NotImplementedError
+
+    def delete_subscription(self, subscription=None, request=None):
+        """
+        Delete a subscription.
+
+        Args:
+            subscription:   The path of the subscription to delete.
+            request:        A dictionary with the "subscription", instead
+                            of the above, or None.
+        """
+        raise NotImplementedError
+
+    def publish(self, topic, data, **attributes):
+        """
+        Publish a message to a topic.
+
+        Args:
+            topic:      The path of the topic to publish to.
+            data:       The message data (bytes).
+            attributes: The message attributes (strings).
+
+        Returns:
+            A concurrent.futures.Future resolving to the message ID.
+        """
+        raise NotImplementedError
+
+    def pull(self, subscription=None, max_messages=None, timeout=None,
+             request=None):
+        """
+        Pull messages from a subscription, waiting for at least one to
+        arrive, and lease them until their acknowledgement deadline.
+        Messages which are not acknowledged until then are delivered
+        again.
+
+        Args:
+            subscription:   The path of the subscription to pull from.
+            max_messages:   Maximum number of messages to pull.
+            timeout:        Maximum number of seconds to wait for messages,
+                            or None to wait indefinitely.
+            request:        A dictionary with the "subscription" and
+                            "max_messages", instead of the two first
+                            arguments, or None.
+
+        Returns:
+            A PullResponse with received messages (ReceivedMessage), none,
+            if none arrived before the timeout.
+        """
+        raise NotImplementedError
+
+    def acknowledge(self, subscription=None, ack_ids=None, request=None):
+        """
+        Acknowledge reception of messages, so they're not delivered again.
+
+        Args:
+            subscription:   The path of the subscription the messages were
+                            pulled from.
+            ack_ids:        A list of the IDs received with the messages.
+            request:        A dictionary with the "subscription" and
+                            "ack_ids", instead of the two above, or None.
+        """
+        raise NotImplementedError
+
+    def modify_ack_deadline(self, subscription=None, ack_ids=None,
+                            ack_deadline_seconds=None, request=None):
+        """
+        Change the acknowledgement deadline of leased messages.
+
+        Args:
+            subscription:           The path of the subscription the
+                                    messages were pulled from.
+            ack_ids:                A list of the IDs received with the
+                                    messages.
+            ack_deadline_seconds:   Number of seconds from now to set the
+                                    deadline to. Zero to deliver the
+                                    messages again immediately.
+            request:                A dictionary with the "subscription",
+                                    "ack_ids", and "ack_deadline_seconds",
+                                    instead of the three above, or None.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, subscription, callback, flow_control=None,
+                  scheduler=None):
+        """
+        Start receiving messages from a subscription in the background,
+        handing them to a callback.
+
+        Args:
+            subscription:   The path of the subscription to receive from.
+            callback:       The function to call with each received message
+                            (having "data", "attributes",
+                            "delivery_attempt", and ack() and nack()
+                            methods), from worker threads.
+            flow_control:   The pubsub.types.FlowControl settings, with the
+                            maximum number of messages to process at once,
+                            or None for the default of ten.
+            scheduler:      Ignored, accepted for compatibility.
+
+        Returns:
+            A concurrent.futures.Future, which can be used to wait for the
+            subscription to fail (result()), or to stop it (cancel()).
+        """
+        raise NotImplementedError
+
+
+class _Subscription:
+    """The state of a local backend subscription"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, topic, offset, acked=()):
+        """
+        Initialize the subscription state.
+
+        Args:
+            topic:  The name of the subscribed topic.
+            offset: The offset of the first unacknowledged message.
+            acked:  An iterable of offsets of acknowledged messages past
+                    the first unacknowledged one.
+        """
+        self.topic = topic
+        self.offset = offset
+        self.acked = set(acked)
+        # The offset of the next message never delivered since loading
+        self.next = offset
+        # Offsets of leased messages, and monotonic time of their deadlines
+        self.leases = {}
+        # Offsets of delivered messages, and the number of deliveries
+        self.attempts = {}
+
+    def get_state(self):
+        """
+        Get the durable part of the subscription state.
+
+        Returns:
+            A JSON-compatible dictionary with the state.
+        """
+        return dict(topic=self.topic, offset=self.offset,
+                    acked=sorted(self.acked))
+
+
+class _LocalMessage:
+    """A message received from a local backend subscription"""
+
+    def __init__(self, backend, subscription, received_message):
+        """
+        Initialize the message.
+
+        Args:
+            backend:            The backend the message was received from.
+            subscription:       The path of the subscription the message
+                                was received from.
+            received_message:   The received message (ReceivedMessage).
+        """
+        self.backend = backend
+        self.subscription = subscription
+        self.ack_id = received_message.ack_id
+        self.data = received_message.message.data
+        self.attributes = received_message.message.attributes
+        self.message_id = received_message.message.message_id
+        self.delivery_attempt = received_message.delivery_attempt
+
+    def ack(self):
+        """Acknowledge the message"""
+        self.backend.acknowledge(self.subscription, [self.ack_id])
+
+    def nack(self):
+        """Have the message delivered again"""
+        self.backend.modify_ack_deadline(self.subscription, [self.ack_id], 0)
+
+    def modify_ack_deadline(self, seconds):
+        """Set the acknowledgement deadline to seconds from now"""
+        self.backend.modify_ack_deadline(self.subscription, [self.ack_id],
+                                         seconds)
+
+
+class _StreamingPullFuture(concurrent.futures.Future):
+    """The future of a local backend streaming pull"""
+
+    def __init__(self):
+        """Initialize the future"""
+        super().__init__()
+        self.stopped = threading.Event()
+
+    def cancel(self):
+        """Stop the streaming pull"""
+        self.stopped.set()
+        return True
+
+
+class LocalBackend(Backend):
+    """
+    An abstract backend keeping messages in numbered sequences per topic,
+    and subscriptions as offsets into them, delivering each message at
+    least once. Implementations provide the storage.
+    """
+
+    def __init__(self, ack_deadline=10):
+        """
+        Initialize the local backend.
+
+        Args:
+            ack_deadline:   Number of seconds pulled messages stay leased
+                            before being delivered again, unless
+                            acknowledged.
+        """
+        assert isinstance(ack_deadline, (int, float)) and ack_deadline > 0
+        self.ack_deadline = ack_deadline
+        # A condition guarding the state, notified on state changes
+        self.cond = threading.Condition()
+        # Loaded subscription states
+        self.subscriptions = {}
+
+    def _has_topic(self, topic):
+        """Check if a topic exists"""
+        raise NotImplementedError
+
+    def _create_topic(self, topic):
+        """Create a topic storage"""
+        raise NotImplementedError
+
+    def _delete_topic(self, topic):
+        """Delete a topic storage"""
+        raise NotImplementedError
+
+    def _get_length(self, topic):
+        """Get the number of messages in a topic"""
+        raise NotImplementedError
+
+    def _append(self, topic, data, attributes):
+        """Append a message to a topic, return its offset"""
+        raise NotImplementedError
+
+    def _read(self, topic, offset):
+        """Read message data and attributes at an offset in a topic"""
+        raise NotImplementedError
+
+    def _load_subscription(self, subscription):
+        """Load a subscription state dictionary, None if not found"""
+        raise NotImplementedError
+
+    def _save_subscription(self, subscription, state):
+        """Save a subscription state dictionary"""
+        raise NotImplementedError
+
+    def _delete_subscription(self, subscription):
+        """Delete a subscription state"""
+        raise NotImplementedError
+
+    def _get_subscription(self, subscription):
+        """
+        Get a loaded subscription state.
+
+        Args:
+            subscription:   The name of the subscription.
+
+        Returns:
+            The subscription state (_Subscription).
+        """
+        if subscription not in self.subscriptions:
+            state = self._load_subscription(subscription)
+            if state is None:
+                raise Exception(f"Subscription {subscription!r} not found")
+            self.subscriptions[subscription] = _Subscription(**state)
+        return self.subscriptions[subscription]
+
+    def topic_path(self, project_id, topic_name):
+        assert _NAME_RE.fullmatch(topic_name)
+        return topic_name
+
+    def subscription_path(self, project_id, subscription_name):
+        assert _NAME_RE.fullmatch(subscription_name)
+        return subscription_name
+
+    def create_topic(self, topic):
+        with self.cond:
+            if self._has_topic(topic):
+                raise Exception(f"Topic {topic!r} already exists")
+            self._create_topic(topic)
+
+    def delete_topic(self, topic):
+        with self.cond:
+            if not self._has_topic(topic):
+                raise Exception(f"Topic {topic!r} not found")
+            self._delete_topic(topic)
+
+    def create_subscription(self, name=None, topic=None, request=None):
+        if request is not None:
+            if request.get("filter"):
+                raise NotImplementedError("Local subscriptions don't "
+                                          "support filters")
+            name = request["name"]
+            topic = request["topic"]
+        with self.cond:
+            if not self._has_topic(topic):
+                raise Exception(f"Topic {topic!r} not found")
+            if name in self.subscriptions or \
+               self._load_subscription(name) is not None:
+                raise Exception(f"Subscription {name!r} already exists")
+            self._save_subscription(
+                name, dict(topic=topic, offset=self._get_length(topic))
+            )
+
+    def delete_subscription(self, subscription=None, request=None):
+        if request is not None:
+            subscription = request["subscription"]
+        with self.cond:
+            self._get_subscription(subscription)
+            del self.subscriptions[subscription]
+            self._delete_subscription(subscription)
+            self.cond.notify_all()
+
+    def publish(self, topic, data, **attributes):
+        assert isinstance(data, bytes)
+        assert all(isinstance(v, str) for v in attributes.values())
+        with self.cond:
+            if not self._has_topic(topic):
+                raise Exception(f"Topic {topic!r} not found")
+            offset = self._append(topic, data, attributes)
+            self.cond.notify_all()
+        future = concurrent.futures.Future()
+        future.set_result(str(offset))
+        return future
+
+    def pull(self, subscription=None, max_messages=None, timeout=None,
+             request=None):
+        if request is not None:
+            subscription = request["subscription"]
+            max_messages = request["max_messages"]
+        assert isinstance(max_messages, int) and max_messages > 0
+        assert timeout is None or \
+            isinstance(timeout, (int, float)) and timeout >= 0
+        timeout_time = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                sub = self._get_subscription(subscription)
+                now = time.monotonic()
+                # Deliver messages with expired leases first, then new ones
+                offsets = sorted(
+                    offset for offset, deadline in sub.leases.items()
+                    if deadline <= now
+                )[:max_messages]
+                length = self._get_length(sub.topic)
+                while len(offsets) < max_messages and sub.next < length:
+                    if sub.next not in sub.acked:
+                        offsets.append(sub.next)
+                    sub.next += 1
+                if offsets:
+                    break
+                if timeout_time is not None and now >= timeout_time:
+                    return PullResponse([])
+                # Wait for a publication, a lease to expire, or a timeout
+                waits = [deadline - now for deadline in sub.leases.values()]
+                if timeout_time is not None:
+                    waits.append(timeout_time - now)
+                self.cond.wait(min(waits) if waits else None)
+            received_messages = []
+            for offset in offsets:
+                sub.leases[offset] = now + self.ack_deadline
+                sub.attempts[offset] = sub.attempts.get(offset, 0) + 1
+                data, attributes = self._read(sub.topic, offset)
+                received_messages.append(ReceivedMessage(
+                    str(offset), Message(data, attributes, str(offset)),
+                    sub.attempts[offset]
+                ))
+        return PullResponse(received_messages)
+
+    def acknowledge(self, subscription=None, ack_ids=None, request=None):
+        if request is not None:
+            subscription = request["subscription"]
+            ack_ids = request["ack_ids"]
+        with self.cond:
+            sub = self._get_subscription(subscription)
+            for ack_id in ack_ids:
+                offset = int(ack_id)
+                sub.leases.pop(offset, None)
+                sub.attempts.pop(offset, None)
+                if sub.offset <= offset < sub.next:
+                    sub.acked.add(offset)
+            while sub.offset in sub.acked:
+                sub.acked.remove(sub.offset)
+                sub.offset += 1
+            self._save_subscription(subscription, sub.get_state())
+
+    def modify_ack_deadline(self, subscription=None, ack_ids=None,
+                            ack_deadline_seconds=None, request=None):
+        if request is not None:
+            subscription = request["subscription"]
+            ack_ids = request["ack_ids"]
+            ack_deadline_seconds = request["ack_deadline_seconds"]
+        assert isinstance(ack_deadline_seconds, (int, float)) and \
+            ack_deadline_seconds >= 0
+        with self.cond:
+            sub = self._get_subscription(subscription)
+            deadline = time.monotonic() + ack_deadline_seconds
+            for ack_id in ack_ids:
+                if int(ack_id) in sub.leases:
+                    sub.leases[int(ack_id)] = deadline
+            self.cond.notify_all()
+
+    def subscribe(self, subscription, callback, flow_control=None,
+                  scheduler=None):
+        assert callable(callback)
+        concurrency = 10 if flow_control is None \
+            else flow_control.max_messages
+        future = _StreamingPullFuture()
+        # pylint: disable=consider-using-with
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency
+        )
+        slots = threading.BoundedSemaphore(concurrency)
+
+        def process(received_message):
+            """Hand a received message to the callback"""
+            try:
+                callback(_LocalMessage(self, subscription, received_message))
+            finally:
+                slots.release()
+
+        def stream():
+            """Pull messages and submit them for processing until stopped"""
+            try:
+                while not future.stopped.is_set():
+                    if not slots.acquire(timeout=0.1):
+                        continue
+                    response = self.pull(subscription, 1, timeout=0.1)
+                    if response.received_messages:
+                        executor.submit(process,
+                                        response.received_messages[0])
+                    else:
+                        slots.release()
+                executor.shutdown(wait=True)
+                future.set_result(None)
+            except Exception as exc:  # pylint: disable=broad-except
+                executor.shutdown(wait=False)
+                future.set_exception(exc)
+
+        threading.Thread(target=stream, daemon=True).start()
+        return future
+
+
+class MemoryBackend(LocalBackend):
+    """
+    A local backend keeping messages and subscriptions in memory, within
+    a single process.
+    """
+
+    def __init__(self, ack_deadline=10):
+        """
+        Initialize the in-memory backend.
+
+        Args:
+            ack_deadline:   Number of seconds pulled messages stay leased
+                            before being delivered again, unless
+                            acknowledged.
+        """
+        super().__init__(ack_deadline)
+        # Topic names and lists of (data, attributes) tuples
+        self.topics = {}
+        # Subscription names and their durable states
+        self.states = {}
+
+    def _has_topic(self, topic):
+        return topic in self.topics
+
+    def _create_topic(self, topic):
+        self.topics[topic] = []
+
+    def _delete_topic(self, topic):
+        del self.topics[topic]
+
+    def _get_length(self, topic):
+        return len(self.topics[topic])
+
+    def _append(self, topic, data, attributes):
+        self.topics[topic].append((data, attributes))
+        return len(self.topics[topic]) - 1
+
+    def _read(self, topic, offset):
+        return self.topics[topic][offset]
+
+    def _load_subscription(self, subscription):
+        return self.states.get(subscription)
+
+    def _save_subscription(self, subscription, state):
+        self.states[subscription] = state
+
+    def _delete_subscription(self, subscription):
+        del self.states[subscription]
+
+
+class FileBackend(LocalBackend):
+    """
+    A local backend keeping messages in append-only segment files per
+    topic, and subscriptions as files with the offsets of acknowledged
+    messages, surviving restarts. Only one backend instance per process
+    should access a directory at a time.
+    """
+
+    # The header of a message record: lengths of attributes and data
+    _HEADER = struct.Struct("<II")
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024, sync=False,
+                 ack_deadline=10):
+        """
+        Initialize the file backend.
+
+        Args:
+            path:           The path to the directory to keep the files
+                            in. Created, if it doesn't exist.
+            segment_size:   The size of a segment file (in bytes), after
+                            which messages are written to a new one.
+            sync:           True if every write should be synced to
+                            storage, False to leave that to the OS.
+            ack_deadline:   Number of seconds pulled messages stay leased
+                            before being delivered again, unless
+                            acknowledged.
+        """
+        assert isinstance(path, str)
+        assert isinstance(segment_size, int) and segment_size > 0
+        super().__init__(ack_deadline)
+        self.path = path
+        self.segment_size = segment_size
+        self.sync = sync
+        os.makedirs(os.path.join(path, "topics"), exist_ok=True)
+        os.makedirs(os.path.join(path, "subscriptions"), exist_ok=True)
+        # Loaded topic names and lists of (segment path, position) of
+        # their messages
+        self.indexes = {}
+        # Open segment files
+        self.files = {}
+
+    def _get_topic_path(self, topic):
+        """Get the path to a topic directory"""
+        return os.path.join(self.path, "topics", topic)
+
+    def _get_subscription_path(self, subscription):
+        """Get the path to a subscription file"""
+        return os.path.join(self.path, "subscriptions",
+                            subscription + ".json")
+
+    def _get_file(self, segment_path):
+        """Get an open segment file"""
+        if segment_path not in self.files:
+            # pylint: disable=consider-using-with
+            self.files[segment_path] = open(segment_path, "a+b")
+        return self.files[segment_path]
+
+    def _close_files(self, topic):
+        """Close open segment files of a topic"""
+        prefix = self._get_topic_path(topic) + os.sep
+        for segment_path in list(self.files):
+            if segment_path.startswith(prefix):
+                self.files.pop(segment_path).close()
+
+    def _get_index(self, topic):
+        """
+        Get the index of a topic's messages, scanning its segments, and
+        truncating an incomplete record at the end, if not loaded yet.
+        """
+        if topic in self.indexes:
+            return self.indexes[topic]
+        index = []
+        topic_path = self._get_topic_path(topic)
+        for segment_name in sorted(os.listdir(topic_path)):
+            segment_path = os.path.join(topic_path, segment_name)
+            file = self._get_file(segment_path)
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            position = 0
+            while position + self._HEADER.size <= size:
+                file.seek(position)
+                attributes_size, data_size = \
+                    self._HEADER.unpack(file.read(self._HEADER.size))
+                end = position + self._HEADER.size + \
+                    attributes_size + data_size
+                if end > size:
+                    break
+                index.append((segment_path, position))
+                position = end
+            if position < size:
+                file.truncate(position)
+        self.indexes[topic] = index
+        return index
+
+    def _has_topic(self, topic):
+        return topic in self.indexes or \
+            os.path.isdir(self._get_topic_path(topic))
+
+    def _create_topic(self, topic):
+        os.mkdir(self._get_topic_path(topic))
+        self.indexes[topic] = []
+
+    def _delete_topic(self, topic):
+        self._close_files(topic)
+        self.indexes.pop(topic, None)
+        shutil.rmtree(self._get_topic_path(topic))
+
+    def _get_length(self, topic):
+        return len(self._get_index(topic))
+
+    def _append(self, topic, data, attributes):
+        index = self._get_index(topic)
+        if index:
+            file = self._get_file(index[-1][0])
+            file.seek(0, os.SEEK_END)
+        if not index or file.tell() >= self.segment_size:
+            # Name segments after their first offsets, sorting in order
+            file = self._get_file(os.path.join(self._get_topic_path(topic),
+                                               f"{len(index):020}.log"))
+            file.seek(0, os.SEEK_END)
+        segment_path = file.name
+        position = file.tell()
+        attributes_data = json.dumps(attributes).encode()
+        file.write(self._HEADER.pack(len(attributes_data), len(data)) +
+                   attributes_data + data)
+        file.flush()
+        if self.sync:
+            os.fsync(file.fileno())
+        index.append((segment_path, position))
+        return len(index) - 1
+
+    def _read(self, topic, offset):
+        segment_path, position = self._get_index(topic)[offset]
+        file = self._get_file(segment_path)
+        file.seek(position)
+        attributes_size, data_size = \
+            self._HEADER.unpack(file.read(self._HEADER.size))
+        attributes = json.loads(file.read(attributes_size))
+        return file.read(data_size), attributes
+
+    def _load_subscription(self, subscription):
+        try:
+            with open(self._get_subscription_path(subscription), "r",
+                      encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _save_subscription(self, subscription, state):
+        # Replace the file atomically, so a crash leaves either state
+        path = self._get_subscription_path(subscription)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(state, file)
+            if self.sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _delete_subscription(self, subscription):
+        os.remove(self._get_subscription_path(subscription))
+
+
+# Backends created by from_spec(), shared within the process
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def from_spec(spec):
+    """
+    Get a local backend from its specification, the same one for the
+    same specification within the process.
+
+    Args:
+        spec:   The backend specification, one of:
+                * "memory" - the in-memory backend,
+                * "file:PATH" - the file backend keeping its files in
+                  the directory at PATH.
+
+    Returns:
+        The backend.
+    """
+    assert isinstance(spec, str)
+    with _BACKENDS_LOCK:
+        if spec not in _BACKENDS:
+            if spec == "memory":
+                _BACKENDS[spec] = MemoryBackend()
+            elif spec.startswith("file:"):
+                _BACKENDS[spec] = FileBackend(spec[len("file:"):])
+            else:
+                raise Exception(f"Unknown backend specification {spec!r}")
+        return _BACKENDS[spec]
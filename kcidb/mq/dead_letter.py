@@ -0,0 +1,220 @@
+"""Kernel CI report message queue - dead letters"""
+
+import os
+import json
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Names of attributes added to dead-lettered messages
+ERROR_ATTRIBUTE = "dead_letter_error"
+ATTEMPTS_ATTRIBUTE = "dead_letter_attempts"
+# Maximum size of the error attribute value, in bytes
+_MAX_ERROR_SIZE = 1024
+
+
+def get_backoff(attempt, min_backoff, max_backoff):
+    """
+    Get the delay before retrying a message which failed to process,
+    growing exponentially with the number of attempts.
+
+    Args:
+        attempt:        The number of the failed attempt, starting from one.
+        min_backoff:    The delay after the first attempt, in seconds.
+        max_backoff:    The maximum delay, in seconds.
+
+    Returns:
+        The delay, in seconds.
+    """
+    assert isinstance(attempt, int) and attempt > 0
+    assert 0 <= min_backoff <= max_backoff
+    return min(max_backoff, min_backoff * 2 ** min(attempt - 1, 32))
+
+
+class AttemptCounter:
+    """
+    A counter of attempts to process messages, for messages which don't
+    come with one, remembering a limited number of the most recent ones.
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        Initialize an attempt counter.
+
+        Args:
+            max_size:   The maximum number of messages to remember.
+        """
+        assert isinstance(max_size, int) and max_size > 0
+        self.max_size = max_size
+        self.attempts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def increment(self, message_id):
+        """
+        Count an attempt to process a message.
+
+        Args:
+            message_id: The ID of the message.
+
+        Returns:
+            The number of attempts so far, including this one.
+        """
+        assert isinstance(message_id, str)
+        with self.lock:
+            attempts = self.attempts.pop(message_id, 0) + 1
+            self.attempts[message_id] = attempts
+            while len(self.attempts) > self.max_size:
+                self.attempts.popitem(last=False)
+            return attempts
+
+    def forget(self, message_id):
+        """
+        Stop counting attempts to process a message.
+
+        Args:
+            message_id: The ID of the message.
+        """
+        with self.lock:
+            self.attempts.pop(message_id, None)
+
+
+class Sink:
+    """An abstract destination for messages failing to process"""
+
+    # pylint: disable=too-few-public-methods
+
+    def put(self, data, attributes, error, attempts):
+        """
+        Store a message which failed to process.
+
+        Args:
+            data:       The message data (bytes).
+            attributes: A dictionary of the message attributes.
+            error:      A description of the last failure (a string).
+            attempts:   The number of attempts made to process the message.
+        """
+        raise NotImplementedError
+
+
+class TopicSink(Sink):
+    """
+    A dead-letter sink publishing messages to a message queue topic,
+    unchanged, with the error and the number of attempts added as
+    attributes.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, publisher):
+        """
+        Initialize a topic dead-letter sink.
+
+        Args:
+            publisher:  The kcidb.mq.Publisher for the dead-letter topic.
+        """
+        self.publisher = publisher
+
+    def put(self, data, attributes, error, attempts):
+        assert isinstance(data, bytes)
+        assert isinstance(error, str)
+        assert isinstance(attempts, int)
+        error = error.encode()[:_MAX_ERROR_SIZE].decode(errors="ignore")
+        self.publisher.client.publish(
+            self.publisher.topic_path, data,
+            **{**attributes,
+               ERROR_ATTRIBUTE: error,
+               ATTEMPTS_ATTRIBUTE: str(attempts)}
+        ).result()
+
+
+class DirSink(Sink):
+    """
+    A dead-letter sink writing messages to JSON files in a local
+    directory, one per message, with the data encoded in base64.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize a directory dead-letter sink.
+
+        Args:
+            path:   The path to the directory to write the files to.
+                    Created, if it doesn't exist.
+        """
+        assert isinstance(path, str)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def put(self, data, attributes, error, attempts):
+        assert isinstance(data, bytes)
+        assert isinstance(error, str)
+        assert isinstance(attempts, int)
+        # Name files so they sort in the order of arrival
+        path = os.path.join(
+            self.path,
+            f"{int(time.time() * 1e9):020}-"
+            f"{hashlib.sha1(data).hexdigest()[:12]}.json"
+        )
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(dict(
+                data=base64.b64encode(data).decode(),
+                attributes=dict(attributes),
+                error=error,
+                attempts=attempts,
+                time=datetime.now(timezone.utc).isoformat(),
+            ), file, indent=4, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def get_paths(self):
+        """
+        Get the paths to stored message files, in the order of arrival.
+
+        Returns:
+            A list of file paths.
+        """
+        return [os.path.join(self.path, name)
+                for name in sorted(os.listdir(self.path))
+                if name.endswith(".json")]
+
+    @staticmethod
+    def load(path):
+        """
+        Load a stored message from a file.
+
+        Args:
+            path:   The path to the file.
+
+        Returns:
+            The message data (bytes), and a dictionary of the original
+            message attributes, the "error", the number of "attempts", and
+            the "time" the message was stored.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+        return base64.b64decode(entry.pop("data")), entry
+
+
+def from_env(publisher_factory):
+    """
+    Create a dead-letter sink configured with environment variables:
+    KCIDB_DEAD_LETTER_DIR - the path to the directory to write the dead
+    letters to, or KCIDB_DEAD_LETTER_TOPIC - the name of the topic to
+    publish them to.
+
+    Args:
+        publisher_factory:  A function creating a kcidb.mq.Publisher,
+                            given a topic name.
+
+    Returns:
+        The created sink, or None, if neither variable is set.
+    """
+    path = os.environ.get("KCIDB_DEAD_LETTER_DIR")
+    if path:
+        return DirSink(path)
+    topic_name = os.environ.get("KCIDB_DEAD_LETTER_TOPIC")
+    if topic_name:
+        return TopicSink(publisher_factory(topic_name))
+    return None
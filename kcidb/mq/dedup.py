@@ -0,0 +1,174 @@
+"""Kernel CI report message queue - message deduplication stores"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class Store:
+    """
+    An abstract store of fingerprints of processed messages (see
+    kcidb.mq.Publisher.get_fingerprint()), letting consumers skip
+    redelivered and resubmitted messages.
+    """
+
+    def is_processed(self, fingerprint):
+        """
+        Check if a message was processed already.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+
+        Returns:
+            True if the message was processed, False otherwise.
+        """
+        raise NotImplementedError
+
+    def mark_processed(self, fingerprint):
+        """
+        Record a message as processed.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+        """
+        raise NotImplementedError
+
+
+class MemoryStore(Store):
+    """
+    An in-memory fingerprint store, remembering a limited number of the
+    most recently processed messages.
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        Initialize an in-memory fingerprint store.
+
+        Args:
+            max_size:   The maximum number of fingerprints to remember.
+        """
+        assert isinstance(max_size, int) and max_size > 0
+        self.max_size = max_size
+        self.fingerprints = OrderedDict()
+        self.lock = threading.Lock()
+
+    def is_processed(self, fingerprint):
+        """
+        Check if a message was processed already.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+
+        Returns:
+            True if the message was processed, False otherwise.
+        """
+        assert isinstance(fingerprint, str)
+        with self.lock:
+            if fingerprint not in self.fingerprints:
+                return False
+            self.fingerprints.move_to_end(fingerprint)
+            return True
+
+    def mark_processed(self, fingerprint):
+        """
+        Record a message as processed.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+        """
+        assert isinstance(fingerprint, str)
+        with self.lock:
+            self.fingerprints[fingerprint] = None
+            self.fingerprints.move_to_end(fingerprint)
+            while len(self.fingerprints) > self.max_size:
+                self.fingerprints.popitem(last=False)
+
+
+class SQLiteStore(Store):
+    """
+    A fingerprint store kept in an SQLite database, shared between
+    processes, remembering messages for a limited time.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 60 * 60):
+        """
+        Initialize an SQLite fingerprint store.
+
+        Args:
+            path:   The path to the SQLite database file to keep the
+                    fingerprints in, or ":memory:" to keep them in memory.
+            ttl:    The number of seconds to remember processed messages
+                    for.
+        """
+        assert isinstance(path, str)
+        assert isinstance(ttl, (int, float)) and ttl > 0
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, isolation_level=None,
+                                    check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (\n"
+            "    fingerprint TEXT PRIMARY KEY,\n"
+            "    expires REAL NOT NULL\n"
+            ")"
+        )
+
+    def is_processed(self, fingerprint):
+        """
+        Check if a message was processed already.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+
+        Returns:
+            True if the message was processed, False otherwise.
+        """
+        assert isinstance(fingerprint, str)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM fingerprints "
+                "WHERE fingerprint = ? AND expires > ?",
+                (fingerprint, time.time())
+            ).fetchone() is not None
+
+    def mark_processed(self, fingerprint):
+        """
+        Record a message as processed, forgetting expired messages.
+
+        Args:
+            fingerprint:    The fingerprint of the message.
+        """
+        assert isinstance(fingerprint, str)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM fingerprints WHERE expires <= ?",
+                              (now,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?)",
+                (fingerprint, now + self.ttl)
+            )
+
+
+def from_env():
+    """
+    Create a fingerprint store configured with environment variables:
+    KCIDB_DEDUP_STORE - the path to the SQLite database file to keep the
+    fingerprints in, or empty for an in-memory store, KCIDB_DEDUP_TTL - the
+    number of seconds the SQLite store remembers messages for, and
+    KCIDB_DEDUP_SIZE - the number of messages the in-memory store
+    remembers.
+
+    Returns:
+        The created store.
+    """
+    path = os.environ.get("KCIDB_DEDUP_STORE")
+    if path:
+        return SQLiteStore(
+            path, ttl=float(os.environ.get("KCIDB_DEDUP_TTL",
+                                           str(7 * 24 * 60 * 60)))
+        )
+    return MemoryStore(
+        max_size=int(os.environ.get("KCIDB_DEDUP_SIZE", "100000"))
+    )
@@ -0,0 +1,1239 @@
+"""kcdib.db module tests"""
+# pylint: disable=too-many-lines
+
+import base64
+import decimal
+import json
+import os
+import tempfile
+import time
+import unittest
+import importlib.util
+import io
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from kcidb.io import schema as io_schema
+from kcidb.db import schema, misc, arrow, bigquery, cache, \
+    Client, FederatedClient, load_main, dump_main, query_main
+from kcidb.oo.misc import Status
+
+
+class SchemaTestCase(unittest.TestCase):
+    """kcidb.db.schema test case"""
+
+    @staticmethod
+    def get_field(table_name, field_name):
+        """Get a top-level field of a table schema, or None if not found"""
+        for field in schema.TABLE_MAP[table_name]:
+            if field.name == field_name:
+                return field
+        return None
+
+    def test_partitioning(self):
+        """Check table partitioning settings are valid"""
+        self.assertEqual(set(schema.TABLE_PARTITIONING_MAP),
+                         set(schema.TABLE_MAP))
+        for table_name, field_name in schema.TABLE_PARTITIONING_MAP.items():
+            field = self.get_field(table_name, field_name)
+            self.assertIsNotNone(field)
+            self.assertEqual(field.field_type, "TIMESTAMP")
+            self.assertEqual(field.mode, "NULLABLE")
+
+    def test_clustering(self):
+        """Check table clustering settings are valid"""
+        self.assertEqual(set(schema.TABLE_CLUSTERING_MAP),
+                         set(schema.TABLE_MAP))
+        for table_name, field_names in schema.TABLE_CLUSTERING_MAP.items():
+            # BigQuery supports up to four clustering fields
+            self.assertTrue(1 <= len(field_names) <= 4)
+            self.assertEqual(len(set(field_names)), len(field_names))
+            for field_name in field_names:
+                field = self.get_field(table_name, field_name)
+                self.assertIsNotNone(field)
+                self.assertEqual(field.field_type, "STRING")
+                self.assertEqual(field.mode, "NULLABLE")
+            # Every parent ID field should be used for clustering
+            for parent_name, child_names in io_schema.LATEST.tree.items():
+                if parent_name and table_name in child_names:
+                    self.assertIn(parent_name[:-1] + "_id", field_names)
+
+    def test_storage(self):
+        """Check storage schemas only add service fields"""
+        self.assertEqual(set(schema.STORAGE_TABLE_MAP), set(schema.TABLE_MAP))
+        for table_name, fields in schema.STORAGE_TABLE_MAP.items():
+            io_fields = schema.TABLE_MAP[table_name]
+            self.assertEqual(fields[:len(io_fields)], io_fields)
+            self.assertEqual(fields[len(io_fields):],
+                             [schema.INGESTION_TIME_FIELD])
+            self.assertIsNone(
+                self.get_field(table_name, schema.INGESTION_TIME_FIELD.name)
+            )
+
+    def test_rollups(self):
+        """Check rollup table settings are valid"""
+        self.assertEqual(set(schema.ROLLUP_TABLE_CLUSTERING_MAP),
+                         set(schema.ROLLUP_TABLE_MAP))
+        for table_name, fields in schema.ROLLUP_TABLE_MAP.items():
+            # Rollup tables are named after the object lists
+            obj_name = table_name[:-len("_rollups")]
+            self.assertIn(obj_name + "s", schema.TABLE_MAP)
+            # The first field is the object ID, used for clustering
+            self.assertEqual(fields[0].name, obj_name + "_id")
+            self.assertEqual(
+                schema.ROLLUP_TABLE_CLUSTERING_MAP[table_name][0],
+                fields[0].name
+            )
+        # Status counts correspond to known statuses
+        for field in schema.TEST_STATUS_FIELDS:
+            if field.name.endswith("_count") and \
+               field.name not in ("test_count", "none_count"):
+                self.assertIn(field.name[:-len("_count")].upper(),
+                              Status.__members__)
+
+
+class MiscTestCase(unittest.TestCase):
+    """kcidb.db.misc test case"""
+
+    def test_parse_timestamp(self):
+        """Check ISO-8601 timestamps are parsed the same on all Pythons"""
+        plus_one = timezone(timedelta(hours=1))
+        for string, timestamp in (
+            ("2020-03-02", datetime(2020, 3, 2)),
+            ("2020-03-02 10:00", datetime(2020, 3, 2, 10)),
+            ("2020-03-02T10:00:00Z",
+             datetime(2020, 3, 2, 10, tzinfo=timezone.utc)),
+            ("2020-03-02T10:00:00.5+01:00",
+             datetime(2020, 3, 2, 10, 0, 0, 500000, tzinfo=plus_one)),
+            ("2020-03-02T10:00:00.1234567+0100",
+             datetime(2020, 3, 2, 10, 0, 0, 123456, tzinfo=plus_one)),
+        ):
+            self.assertEqual(misc.parse_timestamp(string), timestamp)
+            self.assertEqual(misc.parse_timestamp(string).tzinfo,
+                             timestamp.tzinfo)
+        for string in ("", "2020-03-02T10", "2020-13-02", "2020-03-02X"):
+            with self.assertRaises(ValueError):
+                misc.parse_timestamp(string)
+
+
+class QuerySQLTestCase(unittest.TestCase):
+    """kcidb.db.bigquery.Driver query SQL generation test case"""
+    # pylint: disable=protected-access
+
+    def setUp(self):
+        """Setup tests"""
+        self.since = datetime(2020, 3, 2, tzinfo=timezone.utc)
+        self.until = datetime(2020, 3, 3, tzinfo=timezone.utc)
+        self.filters = dict(
+            revisions=dict(
+                git_repository_commit_hash=(
+                    "=", "5e29d1443c46b6ca70a4c940a67e8c09f05dcb7e"
+                ),
+            ),
+            builds=dict(
+                architecture=("in", ["x86_64", "aarch64"]),
+            ),
+            tests=dict(
+                path=("prefix", "ltp."),
+                status=("=", "FAIL"),
+                duration=("range", (10, None)),
+            ),
+        )
+
+    def test_params_match(self):
+        """Check the number of parameters matches the placeholders"""
+        for children in (False, True):
+            for parents in (False, True):
+                for since, until in ((None, None),
+                                     (self.since, None),
+                                     (self.since, self.until)):
+                    obj_list_sql = bigquery.Driver._get_query_sql(
+                        dict(builds=["origin:%"]), children, parents,
+                        since, until, self.filters
+                    )
+                    for sql, params in obj_list_sql.values():
+                        self.assertEqual(sql.count("?"), len(params))
+
+    def test_time_pruning(self):
+        """Check time bounds are applied to fetching, where possible"""
+        obj_list_sql = bigquery.Driver._get_query_sql(
+            dict(builds=["origin:%"]), False, True, self.since, self.until,
+            {}
+        )
+        # Tests and their parent builds are matched by time
+        self.assertTrue(
+            obj_list_sql["tests"][0].endswith(
+                ") AND tests.start_time >= ? AND tests.start_time < ?\n"
+            )
+        )
+        # Builds include parents of tests, outside the time bounds
+        self.assertTrue(obj_list_sql["builds"][0].endswith(")\n"))
+        # Bounds without time are not applied
+        for sql, params in bigquery.Driver._get_query_sql(
+            dict(builds=["origin:%"]), True, True, None, None, {}
+        ).values():
+            self.assertNotIn("_time", sql)
+            self.assertEqual(len(params), sql.count("UNNEST(?)"))
+
+    def test_filters(self):
+        """Check filters are validated and applied"""
+        self.assertTrue(Client.is_valid_filters(self.filters))
+        self.assertTrue(Client.is_valid_filters({}))
+        for invalid_filters in (
+            dict(tests=dict(unknown=("=", "x"))),
+            dict(tests=dict(output_files=("=", "x"))),
+            dict(tests=dict(status=("~", "FAIL"))),
+            dict(tests=dict(status=("=", 1))),
+            dict(tests=dict(waived=("prefix", "x"))),
+            dict(tests=dict(duration=("range", (1,)))),
+            dict(tests=dict(path=("range", ("a", "b")))),
+            dict(builds=dict(start_time=("=", datetime(2020, 3, 2)))),
+        ):
+            self.assertFalse(Client.is_valid_filters(invalid_filters))
+
+        obj_list_sql = bigquery.Driver._get_query_sql(
+            dict(tests=["origin:%"]), False, False, None, None, self.filters
+        )
+        sql, params = obj_list_sql["tests"]
+        self.assertTrue(sql.endswith(
+            ") AND STARTS_WITH(tests.path, ?) "
+            "AND tests.status = ? AND tests.duration >= ?\n"
+        ))
+        self.assertEqual([p.value for p in params[-3:]],
+                         ["ltp.", "FAIL", decimal.Decimal(10)])
+
+    def test_template(self):
+        """Check statement templates are generated once per query shape"""
+        # Pylint doesn't see through lru_cache on static methods
+        # pylint: disable=no-value-for-parameter
+        filters = dict(tests=dict(status=("=", "FAIL")))
+        sql, slots = bigquery.Driver._get_query_template(
+            False, False, (True, False), misc.get_filters_shape(filters), "*"
+        )["tests"]
+        self.assertEqual(
+            sql,
+            "SELECT * FROM tests WHERE id IN (\n"
+            "SELECT tests.id AS id FROM tests "
+            "INNER JOIN UNNEST(?) AS id_pattern "
+            "ON tests.id LIKE id_pattern "
+            "WHERE tests.start_time >= ? AND tests.status = ?\n"
+            ") AND tests.start_time >= ? AND tests.status = ?\n"
+        )
+        self.assertEqual(slots, (
+            ("patterns", "tests"),
+            ("since",), ("filter", "tests", "status", "=", None),
+            ("since",), ("filter", "tests", "status", "=", None),
+        ))
+
+        # Queries differing only in values reuse the template
+        hits = bigquery.Driver._get_query_template.cache_info().hits
+        for status in ("FAIL", "PASS"):
+            params = bigquery.Driver._get_query_sql(
+                dict(tests=["origin:%"]), False, False, self.since, None,
+                dict(tests=dict(status=("=", status)))
+            )["tests"][1]
+            self.assertEqual(params[-1].value, status)
+        self.assertEqual(
+            bigquery.Driver._get_query_template.cache_info().hits, hits + 2
+        )
+
+
+class RollupSQLTestCase(unittest.TestCase):
+    """kcidb.db.bigquery.Driver rollup update SQL generation test case"""
+    # pylint: disable=protected-access
+
+    class Job:
+        """A stub BigQuery query job"""
+        # pylint: disable=too-few-public-methods
+        num_dml_affected_rows = 0
+
+        def __init__(self, rows):
+            self.rows = rows
+
+        def __iter__(self):
+            return iter(self.rows)
+
+        def result(self):
+            """Wait for the job to finish"""
+            return self
+
+    def test_sql(self):
+        """Check rollups are updated with deltas from loaded objects only"""
+        build_sql = bigquery.Driver._get_build_rollups_sql()
+        revision_sql = bigquery.Driver._get_revision_rollups_sql()
+        for sql in (build_sql, revision_sql):
+            # Counts are added to, not recomputed
+            self.assertIn("test_count = target.test_count + "
+                          "source.test_count,\n", sql)
+            self.assertIn("FROM UNNEST(@tests) AS tests\n", sql)
+            # Neither the object tables, nor the whole rollups are read
+            self.assertNotIn("`tests`", sql)
+            self.assertNotIn("`builds`", sql)
+        self.assertIn("revision_id = IFNULL(source.revision_id, "
+                      "target.revision_id),\n", build_sql)
+        self.assertIn("SELECT * FROM `build_rollups`\n"
+                      "        WHERE build_id IN UNNEST(@build_ids)\n",
+                      revision_sql)
+        self.assertIn("build_count = target.build_count + "
+                      "source.build_count,\n", revision_sql)
+        # Previous versions are looked up by ID and start time
+        self.assertTrue(bigquery.Driver._get_previous_sql("tests").endswith(
+            "FROM `tests` AS t\n"
+            "WHERE t.id IN UNNEST(@ids) AND\n"
+            "      (t.start_time IS NULL OR\n"
+            "       t.start_time IN UNNEST(@start_times))\n"
+            "GROUP BY t.id\n"
+        ))
+
+    def test_update(self):
+        """Check replaced objects are subtracted from rollups"""
+        previous_test = dict(id="origin:t", build_id="origin:b1",
+                             status="FAIL", waived=False,
+                             duration=decimal.Decimal(1))
+        queries = []
+
+        def query(sql, job_config):
+            # Keep the parameter values in their API representation
+            queries.append((sql, {
+                param["name"]: param["parameterValue"]
+                for param in job_config.to_api_repr()["query"][
+                    "queryParameters"
+                ]
+            }))
+            return RollupSQLTestCase.Job(
+                [previous_test] if "`tests`" in sql else []
+            )
+
+        def get_values(param_value, *names):
+            return [
+                tuple(value["structValues"][name]["value"] for name in names)
+                if names else value["value"]
+                for value in param_value["arrayValues"]
+            ]
+
+        driver = bigquery.Driver.__new__(bigquery.Driver)
+        misc.Driver.__init__(driver)
+        driver.client = SimpleNamespace(query=query)
+        driver.dataset_ref = None
+        data = dict(
+            version=dict(major=io_schema.LATEST.major,
+                         minor=io_schema.LATEST.minor),
+            tests=[dict(id="origin:t", build_id="origin:b2", status="PASS",
+                        start_time="2020-03-02T00:00:00+00:00")],
+        )
+        previous = driver._get_previous(data)
+        self.assertEqual(previous, dict(tests=[previous_test]))
+        params = queries[0][1]
+        self.assertEqual(get_values(params["ids"]), ["origin:t"])
+        self.assertEqual(get_values(params["start_times"]),
+                         ["2020-03-02T00:00:00+00:00"])
+
+        driver._update_rollups(data, previous)
+        sql, params = queries[1]
+        self.assertTrue(sql.startswith("BEGIN TRANSACTION;\n"))
+        self.assertTrue(sql.endswith("COMMIT TRANSACTION;\n"))
+        self.assertEqual(get_values(params["builds"], "id"), [])
+        self.assertEqual(
+            get_values(params["tests"], "build_id", "status", "sign"),
+            [("origin:b2", "PASS", "1"), ("origin:b1", "FAIL", "-1")]
+        )
+        self.assertEqual(get_values(params["build_ids"]),
+                         ["origin:b1", "origin:b2"])
+        self.assertEqual(get_values(params["revision_ids"]), [])
+
+
+def get_bigquery_client(**methods):
+    """
+    Create a kcidb.db.Client for a BigQuery dataset of the latest schema
+    version, with a stub BigQuery client.
+
+    Args:
+        methods:    Functions implementing the BigQuery client methods
+                    used by the test, besides get_dataset().
+
+    Returns:
+        The created kcidb.db.Client.
+    """
+    client = Client.__new__(Client)
+    client.obj_cache = None
+    client.result_cache = None
+    client.driver = bigquery.Driver.__new__(bigquery.Driver)
+    misc.Driver.__init__(client.driver)
+    client.driver.dataset_ref = None
+    client.driver.client = SimpleNamespace(
+        get_dataset=lambda dataset_ref: SimpleNamespace(labels=dict(
+            version_major=str(io_schema.LATEST.major),
+            version_minor=str(io_schema.LATEST.minor),
+        )),
+        **methods
+    )
+    return client
+
+
+class UpsertSQLTestCase(unittest.TestCase):
+    """kcidb.db.bigquery.Driver upsert and compaction test case"""
+    # pylint: disable=protected-access
+
+    def test_merge_sql(self):
+        """Check upserts match rows by ID and replace all other columns"""
+        sql = bigquery.Driver._get_merge_sql("builds", "_staging_builds_x")
+        self.assertTrue(sql.startswith(
+            "MERGE `builds` AS target\n"
+            "USING `_staging_builds_x` AS source\n"
+            "ON target.id = source.id\n"
+            "WHEN MATCHED THEN\n"
+            "    UPDATE SET\n"
+        ))
+        self.assertTrue(sql.endswith(
+            "WHEN NOT MATCHED THEN\n"
+            "    INSERT ROW\n"
+        ))
+        assignments = sql.split("    UPDATE SET\n")[1].split(
+            "\nWHEN NOT MATCHED")[0].split(",\n")
+        self.assertEqual(
+            assignments,
+            [f"        {field.name} = source.{field.name}"
+             for field in schema.STORAGE_TABLE_MAP["builds"]
+             if field.name != "id"]
+        )
+        self.assertIn(f"        {schema.INGESTION_TIME_FIELD.name} = "
+                      f"source.{schema.INGESTION_TIME_FIELD.name}",
+                      assignments)
+
+    def test_compact_sql(self):
+        """Check compaction keeps the last loaded row for each ID"""
+        sql = bigquery.Driver._get_compact_sql("tests")
+        self.assertTrue(sql.startswith("MERGE `tests` AS target\n"))
+        self.assertIn(
+            f"        original ORDER BY "
+            f"original.{schema.INGESTION_TIME_FIELD.name} DESC\n"
+            f"        LIMIT 1\n", sql
+        )
+        self.assertIn("    FROM `tests` AS original\n"
+                      "    GROUP BY original.id\n", sql)
+        self.assertTrue(sql.endswith(
+            "ON FALSE\n"
+            "WHEN NOT MATCHED BY SOURCE THEN\n"
+            "    DELETE\n"
+            "WHEN NOT MATCHED BY TARGET THEN\n"
+            "    INSERT ROW\n"
+        ))
+
+    def test_staging_cleanup(self):
+        """Check staging tables are removed when upserts fail"""
+        created = []
+        deleted = []
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("Failed")
+
+        driver = bigquery.Driver.__new__(bigquery.Driver)
+        misc.Driver.__init__(driver)
+        driver.dataset_ref = \
+            bigquery.bigquery.DatasetReference("project", "dataset")
+        driver.client = SimpleNamespace(
+            create_table=lambda table: created.append(table.reference),
+            delete_table=deleted.append,
+            load_table_from_json=fail,
+        )
+        # Failing to load the staging table
+        with self.assertRaisesRegex(RuntimeError, "Failed"):
+            driver._upsert_table("builds", [dict(id="origin:1")])
+        self.assertEqual(len(created), 1)
+        self.assertTrue(
+            created[0].table_id.startswith("_staging_builds_")
+        )
+        self.assertEqual(deleted, created)
+        # Failing to merge the staging table
+        driver.client.load_table_from_json = \
+            lambda *args, **kwargs: SimpleNamespace(
+                result=lambda: None, output_rows=1,
+                total_bytes_processed=None, total_bytes_billed=None,
+                slot_millis=None
+            )
+        driver.client.query = fail
+        with self.assertRaisesRegex(RuntimeError, "Failed"):
+            driver._upsert_table("builds", [dict(id="origin:1")])
+        self.assertEqual(len(created), 2)
+        self.assertEqual(deleted, created)
+
+    def test_service_fields(self):
+        """Check service fields are added to tables missing them"""
+        tables = {
+            table_name: SimpleNamespace(
+                name=table_name,
+                schema=list(schema.STORAGE_TABLE_MAP[table_name])
+            )
+            for table_name in schema.STORAGE_TABLE_MAP
+        }
+        # Tests were created before ingestion times were recorded
+        tables["tests"].schema = list(schema.TABLE_MAP["tests"])
+        updated = []
+
+        def query(sql, job_config):
+            # pylint: disable=unused-argument
+            return RollupSQLTestCase.Job([SimpleNamespace(total=1, ids=1)])
+
+        driver = bigquery.Driver.__new__(bigquery.Driver)
+        misc.Driver.__init__(driver)
+        driver.service_fields_added = False
+        driver.dataset_ref = \
+            bigquery.bigquery.DatasetReference("project", "dataset")
+        driver.client = SimpleNamespace(
+            get_table=lambda table_ref: tables[table_ref.table_id],
+            update_table=lambda table, fields:
+            updated.append((table.name, fields)),
+            query=query,
+        )
+        self.assertEqual(driver.compact(),
+                         {name: (1, 0) for name in schema.TABLE_MAP})
+        self.assertEqual(updated, [("tests", ["schema"])])
+        self.assertEqual(tables["tests"].schema,
+                         schema.STORAGE_TABLE_MAP["tests"])
+        # Tables are only checked once
+        tables["tests"].schema = list(schema.TABLE_MAP["tests"])
+        driver.compact()
+        self.assertEqual(len(updated), 1)
+
+
+class DumpTestCase(unittest.TestCase):
+    """kcidb.db.Client incremental dump test case, with a stub client"""
+
+    def test_watermark(self):
+        """Check watermarks don't move backwards, or past running loads"""
+        now = datetime.now(timezone.utc)
+        row_times = [now - timedelta(hours=1), now]
+
+        def query(sql, job_config):
+            # pylint: disable=unused-argument
+            return RollupSQLTestCase.Job([
+                {"id": f"origin:{i}",
+                 schema.INGESTION_TIME_FIELD.name: row_time}
+                for i, row_time in enumerate(row_times)
+            ] if sql.startswith("SELECT * FROM `revisions`") else [])
+
+        client = get_bigquery_client(query=query)
+        client.driver.service_fields_added = True
+        # Loads could still be running at the latest ingestion time
+        data, watermark = client.dump_incremental()
+        self.assertEqual(len(data["revisions"]), 2)
+        self.assertLess(watermark, now)
+        self.assertGreater(watermark, row_times[0])
+        # The watermark never precedes the one dumped since
+        since = now - timedelta(seconds=1)
+        _, watermark = client.dump_incremental(since)
+        self.assertEqual(watermark, since)
+
+
+class PagingTestCase(unittest.TestCase):
+    """kcidb.db.Client paging test case with a stub BigQuery client"""
+
+    def setUp(self):
+        """Setup tests"""
+        # Object rows returned by the queries, per object list name
+        self.rows = dict(
+            revisions=[dict(id=f"origin:r{i}") for i in range(3)],
+            builds=[dict(id="origin:b", revision_id="origin:r0")],
+            tests=[],
+        )
+        self.queries = []
+
+        def query(sql, job_config):
+            # pylint: disable=unused-argument
+            # Object lists are queried in order, once each
+            obj_list_name = list(self.rows)[len(self.queries)]
+            self.queries.append(obj_list_name)
+            return get_job(obj_list_name)
+
+        def get_job(job_id, location=None):
+            # pylint: disable=unused-argument
+            return SimpleNamespace(
+                job_id=job_id, location="EU", destination=job_id,
+                total_bytes_processed=None, total_bytes_billed=None,
+                slot_millis=None,
+                result=lambda: SimpleNamespace(
+                    total_rows=len(self.rows[job_id])
+                )
+            )
+
+        def list_rows(destination, selected_fields, page_size, page_token):
+            # pylint: disable=unused-argument
+            start = int(page_token or 0)
+            end = start + page_size
+            rows = self.rows[destination]
+            return SimpleNamespace(
+                pages=iter([rows[start:end]]),
+                next_page_token=str(end) if end < len(rows) else None
+            )
+
+        self.client = get_bigquery_client(query=query, get_job=get_job,
+                                          list_rows=list_rows)
+
+    @staticmethod
+    def get_ids(data):
+        """Get a dictionary of object list names and object IDs"""
+        return {
+            obj_list_name: [obj["id"] for obj in data[obj_list_name]]
+            for obj_list_name in schema.TABLE_MAP
+            if obj_list_name in data
+        }
+
+    def test_token(self):
+        """Check continuation tokens resume queries where they stopped"""
+        data, token = self.client.query_page(dict(revisions=["%"]),
+                                             page_size=2)
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:r0", "origin:r1"]))
+        self.assertIsInstance(token, str)
+        # The page spans the end of one list and the start of another
+        data, token = self.client.query_page(dict(revisions=["%"]),
+                                             page_size=2, token=token)
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:r2"],
+                              builds=["origin:b"]))
+        self.assertIsInstance(token, str)
+        # The last page has no continuation token, even if empty
+        data, token = self.client.query_page(dict(revisions=["%"]),
+                                             page_size=2, token=token)
+        self.assertEqual(self.get_ids(data), {})
+        self.assertIsNone(token)
+        # Query results are reused, each list is queried once
+        self.assertEqual(self.queries, ["revisions", "builds", "tests"])
+
+    def test_iter(self):
+        """Check iterating over pages returns every object once"""
+        pages = list(self.client.query_iter(dict(revisions=["%"]),
+                                            page_size=3))
+        self.assertEqual([self.get_ids(data) for data in pages], [
+            dict(revisions=["origin:r0", "origin:r1", "origin:r2"]),
+            dict(builds=["origin:b"]),
+        ])
+
+    def test_invalid_token(self):
+        """Check invalid continuation tokens are rejected"""
+        for token in ("", "!!!", "bm90IGpzb24=",
+                      base64.urlsafe_b64encode(b"[]").decode(),
+                      base64.urlsafe_b64encode(json.dumps(dict(
+                          index=3, job_id=None, location=None, page=None
+                      )).encode()).decode()):
+            with self.assertRaisesRegex(ValueError, "Invalid page token"):
+                self.client.query_page(dict(revisions=["%"]), token=token)
+
+
+class AggregateTestCase(unittest.TestCase):
+    """kcidb.db.Client.aggregate() test case with a stub BigQuery client"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.queries = []
+
+        def query(sql, job_config):
+            self.queries.append((sql, job_config.query_parameters))
+            return RollupSQLTestCase.Job([
+                dict(origin="origin", path="ltp.fs", count=2),
+            ])
+
+        self.client = get_bigquery_client(query=query)
+
+    def test_sql(self):
+        """Check objects are counted and grouped by key positions"""
+        groups = self.client.aggregate("tests", ["origin", "status"],
+                                       dict(builds=["origin:%"]),
+                                       children=True)
+        self.assertEqual(groups,
+                         [dict(origin="origin", path="ltp.fs", count=2)])
+        sql, params = self.queries.pop()
+        self.assertTrue(sql.startswith(
+            "SELECT SPLIT(tests.id, ':')[OFFSET(0)] AS origin, "
+            "tests.status AS status, COUNT(*) AS count FROM tests "
+            "WHERE id IN (\n"
+        ))
+        self.assertTrue(sql.endswith("GROUP BY 1, 2\nORDER BY 1, 2\n"))
+        self.assertEqual([param.values for param in params],
+                         [[], ["origin:%"], []])
+        # Test paths are truncated to the requested depth
+        self.client.aggregate("tests", ["path"], dict(tests=["%"]),
+                              path_depth=2)
+        sql, _ = self.queries.pop()
+        self.assertIn(
+            "ARRAY_TO_STRING(ARRAY(SELECT part FROM "
+            "UNNEST(SPLIT(tests.path, '.')) AS part "
+            "WITH OFFSET AS part_index WHERE part_index < 2 "
+            "ORDER BY part_index), '.') AS path, COUNT(*) AS count ",
+            sql
+        )
+        self.assertTrue(sql.endswith("GROUP BY 1\nORDER BY 1\n"))
+        # Without keys, a single total is returned
+        self.client.aggregate("builds", [], dict(builds=["%"]))
+        sql, _ = self.queries.pop()
+        self.assertTrue(sql.startswith(
+            "SELECT COUNT(*) AS count FROM builds WHERE id IN (\n"
+        ))
+        self.assertNotIn("GROUP BY", sql)
+
+    def test_validation(self):
+        """Check invalid aggregation arguments are rejected"""
+        patterns = dict(tests=["%"])
+        for args, kwargs in (
+            (("checkouts", [], patterns), {}),
+            (("tests", ["unknown"], patterns), {}),
+            (("tests", ["status", "status"], patterns), {}),
+            (("tests", "status", patterns), {}),
+            (("tests", ["path"], patterns), dict(path_depth=0)),
+            (("tests", ["path"], patterns), dict(path_depth="1")),
+            (("tests", ["status"], dict(tests="%")), {}),
+            (("tests", ["status"], patterns),
+             dict(since=datetime(2020, 3, 2))),
+        ):
+            with self.assertRaises(AssertionError):
+                self.client.aggregate(*args, **kwargs)
+        self.assertEqual(self.queries, [])
+
+
+class SQLiteTestCase(unittest.TestCase):
+    """kcidb.db.Client test case with an SQLite database"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.client = Client("sqlite::memory:")
+        self.client.init()
+        self.version = dict(major=io_schema.LATEST.major,
+                            minor=io_schema.LATEST.minor)
+        self.data = dict(
+            version=self.version,
+            revisions=[
+                dict(id="origin:R1",
+                     discovery_time="2020-03-02T10:00:00.5+01:00",
+                     patch_mboxes=[dict(name="0001.patch",
+                                        url="https://example.com/0001")],
+                     misc=dict(foo="bar")),
+                dict(id="origin:r_2"),
+            ],
+            builds=[
+                dict(id="origin:1", revision_id="origin:R1",
+                     valid=True, duration=10.5),
+                dict(id="origin:2", revision_id="origin:r_2",
+                     valid=False),
+            ],
+            tests=[
+                dict(id="origin:1", build_id="origin:1",
+                     path="ltp.fs", status="FAIL", waived=False,
+                     start_time="2020-03-02T12:00:00Z"),
+                dict(id="origin:2", build_id="origin:1",
+                     path="ltp.mm", status="PASS", waived=False),
+                dict(id="other:1", build_id="origin:2",
+                     path="kselftest", status="PASS", waived=True),
+            ],
+        )
+        self.client.load(self.data)
+
+    def get_ids(self, data):
+        """Get a dictionary of object list names and sorted object IDs"""
+        return {
+            obj_list_name: sorted(obj["id"] for obj in data[obj_list_name])
+            for obj_list_name in schema.TABLE_MAP
+            if data.get(obj_list_name)
+        }
+
+    def test_dump(self):
+        """Check dumped data matches loaded data"""
+        self.assertEqual(self.client.get_schema_version(),
+                         (io_schema.LATEST.major, io_schema.LATEST.minor))
+        data = self.client.dump()
+        self.assertEqual(self.get_ids(data), self.get_ids(self.data))
+        revision = data["revisions"][0]
+        self.assertEqual(revision["discovery_time"],
+                         "2020-03-02T09:00:00.500000+00:00")
+        self.assertEqual(revision["patch_mboxes"],
+                         self.data["revisions"][0]["patch_mboxes"])
+        self.assertEqual(revision["misc"], dict(foo="bar"))
+        self.assertEqual(data["builds"][0]["valid"], True)
+        self.assertEqual(data["builds"][0]["duration"], 10.5)
+        self.assertNotIn("duration", data["builds"][1])
+
+    def test_dump_incremental(self):
+        """Check incremental dumps only return newly loaded data"""
+        data, watermark = self.client.dump_incremental()
+        self.assertEqual(len(data["tests"]), 3)
+        data, watermark = self.client.dump_incremental(watermark)
+        self.assertEqual(self.get_ids(data), {})
+        self.client.load(dict(version=self.version,
+                              tests=[dict(id="origin:3",
+                                          build_id="origin:2")]))
+        data, _ = self.client.dump_incremental(watermark)
+        self.assertEqual(self.get_ids(data), dict(tests=["origin:3"]))
+
+    def test_dump_main(self):
+        """Check the dump tool outputs and stores watermarks"""
+        def dump(*args):
+            """Run the dump tool, returning its output data and watermark"""
+            with mock.patch("sys.argv",
+                            ["kcidb-db-dump", "-d", database, *args]), \
+                    mock.patch("sys.stdout", io.StringIO()) as stdout, \
+                    mock.patch("sys.stderr", io.StringIO()) as stderr:
+                dump_main()
+            return json.loads(stdout.getvalue()), \
+                json.loads(stderr.getvalue().splitlines()[-1])["watermark"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = f"sqlite:{tmpdir}/db.sqlite3"
+            watermark_path = os.path.join(tmpdir, "watermark")
+            client = Client(database)
+            client.init()
+            data, watermark = dump()
+            self.assertEqual(self.get_ids(data), {})
+            self.assertIsNone(watermark)
+            client.load(self.data)
+            # Plain dumps output the watermark too
+            data, watermark = dump()
+            self.assertEqual(self.get_ids(data), self.get_ids(self.data))
+            self.assertIsNotNone(watermark)
+            data, since_watermark = dump("--since", watermark)
+            self.assertEqual(self.get_ids(data), {})
+            self.assertEqual(since_watermark, watermark)
+            # Watermark files are created and updated
+            data, file_watermark = dump("-w", watermark_path)
+            self.assertEqual(self.get_ids(data), self.get_ids(self.data))
+            self.assertEqual(file_watermark, watermark)
+            with open(watermark_path, "r", encoding="utf-8") as file:
+                self.assertEqual(file.read(), watermark + "\n")
+            client.load(dict(version=self.version,
+                             tests=[dict(id="origin:3",
+                                         build_id="origin:2")]))
+            data, file_watermark = dump("-w", watermark_path)
+            self.assertEqual(self.get_ids(data), dict(tests=["origin:3"]))
+            self.assertGreater(misc.parse_timestamp(file_watermark),
+                               misc.parse_timestamp(watermark))
+
+    def test_query_main(self):
+        """Check the query tool requires patterns for time bounds"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = f"sqlite:{tmpdir}/db.sqlite3"
+            client = Client(database)
+            client.init()
+            client.load(self.data)
+            argv = ["kcidb-db-query", "-d", database, "--no-cache",
+                    "--since", "2020-03-02T11:00:00Z"]
+            with mock.patch("sys.argv", argv), \
+                    mock.patch("sys.stderr", io.StringIO()) as stderr, \
+                    self.assertRaises(SystemExit) as context:
+                query_main()
+            self.assertEqual(context.exception.code, 2)
+            self.assertIn("require ID patterns", stderr.getvalue())
+            with mock.patch("sys.argv", argv + ["-t", "%"]), \
+                    mock.patch("sys.stdout", io.StringIO()) as stdout:
+                query_main()
+        self.assertEqual(self.get_ids(json.loads(stdout.getvalue())),
+                         dict(tests=["origin:1"]))
+
+    def test_query(self):
+        """Check querying with patterns, parents and children works"""
+        # LIKE patterns are case-sensitive, and can be escaped
+        data = self.client.query(dict(revisions=["origin:r%"]))
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:r_2"]))
+        data = self.client.query(dict(
+            revisions=[Client.escape_like_pattern("origin:r_") + "%"]
+        ))
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:r_2"]))
+        # Children
+        data = self.client.query(dict(revisions=["origin:R1"]),
+                                 children=True)
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:R1"],
+                              builds=["origin:1"],
+                              tests=["origin:1", "origin:2"]))
+        # Parents
+        data = self.client.query(dict(tests=["other:%"]), parents=True)
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:r_2"],
+                              builds=["origin:2"],
+                              tests=["other:1"]))
+        # Complement
+        data = self.client.complement(dict(
+            version=self.version,
+            tests=[dict(id="origin:2", build_id="origin:1")]
+        ))
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:R1"],
+                              builds=["origin:1"],
+                              tests=["origin:1", "origin:2"]))
+
+    def test_query_filters(self):
+        """Check querying with time bounds and filters works"""
+        data = self.client.query(
+            dict(tests=["%"]),
+            since=datetime(2020, 3, 2, 11, 59, tzinfo=timezone.utc)
+        )
+        self.assertEqual(self.get_ids(data), dict(tests=["origin:1"]))
+        data = self.client.query(
+            dict(tests=["%"]),
+            filters=dict(tests=dict(path=("prefix", "ltp."),
+                                    status=("in", ["PASS", "ERROR"]),
+                                    waived=("=", False)))
+        )
+        self.assertEqual(self.get_ids(data), dict(tests=["origin:2"]))
+        data = self.client.query(
+            dict(builds=["%"]),
+            filters=dict(builds=dict(duration=("range", (10, 11))))
+        )
+        self.assertEqual(self.get_ids(data), dict(builds=["origin:1"]))
+
+    def test_upsert_compact(self):
+        """Check upserting and compacting works"""
+        tests = [dict(id="origin:1", build_id="origin:1", status="PASS"),
+                 dict(id="origin:4", build_id="origin:1")]
+        self.assertEqual(
+            self.client.load(dict(version=self.version, tests=tests),
+                             upsert=True),
+            dict(tests=(1, 1))
+        )
+        self.client.load(dict(version=self.version, tests=tests))
+        self.assertEqual(len(self.client.dump()["tests"]), 6)
+        # Objects with duplicate rows are counted as merged once
+        self.assertEqual(
+            self.client.load(dict(version=self.version, tests=tests),
+                             upsert=True),
+            dict(tests=(0, 2))
+        )
+        self.assertEqual(len(self.client.dump()["tests"]), 4)
+        self.client.load(dict(version=self.version, tests=tests))
+        self.assertEqual(self.client.compact()["tests"], (4, 2))
+        data = self.client.query(dict(tests=["origin:1"]))
+        self.assertEqual(data["tests"], [tests[0]])
+
+    def test_unsupported(self):
+        """Check unsupported operations are rejected cleanly"""
+        data = dict(version=self.version,
+                    tests=[dict(id="origin:5", build_id="origin:1")])
+        with self.assertRaises(NotImplementedError):
+            self.client.load(data, rollup=True)
+        self.assertEqual(
+            self.client.query(dict(tests=["origin:5"]))["tests"], []
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = f"sqlite:{tmpdir}/db.sqlite3"
+            Client(database).init()
+            with mock.patch("sys.argv", ["kcidb-db-load", "--rollup",
+                                         "-d", database]), \
+                    mock.patch("sys.stdin", io.StringIO(json.dumps(data))), \
+                    self.assertRaises(SystemExit) as context:
+                load_main()
+        self.assertEqual(str(context.exception),
+                         "The database doesn't support rollups")
+
+    def test_cleanup(self):
+        """Check cleanup removes the data and schema version"""
+        self.client.cleanup()
+        self.assertEqual(self.client.get_schema_version(),
+                         (io_schema.V1.major, io_schema.V1.minor))
+
+    def test_stats_hook(self):
+        """Check job statistics are reported to the hook"""
+        records = []
+        client = Client("sqlite::memory:", stats_hook=records.append)
+        client.init()
+        client.load(self.data)
+        self.assertEqual([(r["operation"], r["table"], r["rows"])
+                          for r in records],
+                         [("load", "revisions", 2),
+                          ("load", "builds", 2),
+                          ("load", "tests", 3)])
+        del records[:]
+        client.query(dict(tests=["origin:1"]))
+        client.query(dict(tests=["origin:2"]))
+        client.complement(dict(version=self.version,
+                               revisions=[dict(id="origin:r_2")]))
+        self.assertEqual(
+            [(r["operation"], r["table"], r["rows"]) for r in records],
+            [("query", "revisions", 0), ("query", "builds", 0),
+             ("query", "tests", 1)] * 2 +
+            [("complement", "revisions", 1), ("complement", "builds", 1),
+             ("complement", "tests", 1)]
+        )
+        # Queries differing only in parameters have the same shape
+        self.assertEqual(records[0]["shape"], records[3]["shape"])
+        self.assertNotEqual(records[0]["shape"], records[6]["shape"])
+        self.assertTrue(all(r["latency"] >= 0 and
+                            r["bytes_processed"] is None
+                            for r in records))
+
+    def test_federated(self):
+        """Check federated queries merge results by precedence"""
+        staging = Client("sqlite::memory:")
+        staging.init()
+        staging.load(dict(
+            version=self.version,
+            tests=[dict(id="origin:1", build_id="origin:1", status="ERROR"),
+                   dict(id="staging:1", build_id="origin:2")],
+        ))
+        federated = FederatedClient([self.client, staging])
+        data = federated.query(dict(tests=["%:1"]), parents=True)
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:R1", "origin:r_2"],
+                              builds=["origin:1", "origin:2"],
+                              tests=["origin:1", "other:1", "staging:1"]))
+        # Objects are taken from the first client having them
+        test = [t for t in data["tests"] if t["id"] == "origin:1"][0]
+        self.assertEqual(test["status"], "FAIL")
+        data = FederatedClient([staging, self.client]).complement(
+            dict(version=self.version,
+                 tests=[dict(id="origin:1", build_id="origin:1")])
+        )
+        self.assertEqual(self.get_ids(data),
+                         dict(revisions=["origin:R1"],
+                              builds=["origin:1"],
+                              tests=["origin:1", "origin:2"]))
+        test = [t for t in data["tests"] if t["id"] == "origin:1"][0]
+        self.assertEqual(test["status"], "ERROR")
+
+
+class ObjectCacheTestCase(unittest.TestCase):
+    """kcidb.db.cache.ObjectCache test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.version = dict(major=io_schema.LATEST.major,
+                            minor=io_schema.LATEST.minor)
+        self.data = dict(
+            version=self.version,
+            revisions=[dict(id="origin:r1"), dict(id="origin:r2")],
+            builds=[dict(id="origin:b1", revision_id="origin:r1"),
+                    dict(id="origin:b2", revision_id="origin:r2")],
+            tests=[dict(id="origin:t1", build_id="origin:b1"),
+                   dict(id="origin:t2", build_id="origin:b2")],
+        )
+
+    def get_client(self, obj_cache):
+        """Create an SQLite database client with the data and a cache"""
+        client = Client("sqlite::memory:", obj_cache=obj_cache)
+        client.init()
+        client.load(self.data)
+        return client
+
+    def test_complement(self):
+        """Check complements are served from the cache, coherently"""
+        obj_cache = cache.ObjectCache()
+        client = self.get_client(obj_cache)
+        tests = dict(version=self.version,
+                     tests=[dict(id="origin:t1", build_id="origin:b1")])
+        # Loaded objects' children are unknown
+        complement = client.complement(tests)
+        self.assertEqual(obj_cache.get_stats()["misses"], 1)
+        self.assertEqual(client.complement(tests), complement)
+        self.assertEqual(obj_cache.get_stats()["hits"], 1)
+        self.assertEqual(obj_cache.hit_ratio, 0.5)
+        # Loaded children are added to the cached complement
+        client.load(dict(version=self.version,
+                         tests=[dict(id="origin:t3", build_id="origin:b1",
+                                     status="PASS")]))
+        complement = client.complement(tests)
+        self.assertEqual(obj_cache.get_stats()["hits"], 2)
+        expected = client.driver.query(dict(tests=["origin:t1"]),
+                                       True, True, None, None, {})
+        for obj_list_name in schema.TABLE_MAP:
+            self.assertEqual(
+                sorted(complement[obj_list_name], key=lambda o: o["id"]),
+                sorted(expected[obj_list_name], key=lambda o: o["id"])
+            )
+        # Objects not cached completely are fetched
+        complement = client.complement(dict(
+            version=self.version,
+            builds=[dict(id="origin:b2", revision_id="origin:r2")]
+        ))
+        self.assertEqual(obj_cache.get_stats()["misses"], 2)
+        self.assertEqual([t["id"] for t in complement["tests"]],
+                         ["origin:t2"])
+
+    def test_eviction(self):
+        """Check evicted objects are fetched again, or read from disk"""
+        tests = dict(version=self.version,
+                     tests=[dict(id="origin:t1", build_id="origin:b1")])
+        obj_cache = cache.ObjectCache(max_size=2)
+        client = self.get_client(obj_cache)
+        client.complement(tests)
+        client.complement(tests)
+        self.assertEqual(obj_cache.get_stats(),
+                         dict(hits=0, misses=2, hit_ratio=0, size=2))
+        with tempfile.TemporaryDirectory() as directory:
+            obj_cache = cache.ObjectCache(
+                max_size=2, path=os.path.join(directory, "cache.sqlite3")
+            )
+            client = self.get_client(obj_cache)
+            complement = client.complement(tests)
+            self.assertEqual(client.complement(tests), complement)
+            self.assertEqual(obj_cache.get_stats()["hits"], 1)
+
+    def test_other_writer(self):
+        """Check children loaded behind the cache's back are fetched"""
+        builds = dict(version=self.version,
+                      builds=[dict(id="origin:b1", revision_id="origin:r1")])
+        with tempfile.TemporaryDirectory() as directory:
+            database = "sqlite:" + os.path.join(directory, "db.sqlite3")
+            obj_cache = cache.ObjectCache(ttl=0.5)
+            client = Client(database, obj_cache=obj_cache)
+            client.init()
+            client.load(self.data)
+            client.complement(builds)
+            # Another writer loads a child, not seen by the cache
+            Client(database).load(dict(
+                version=self.version,
+                tests=[dict(id="origin:t3", build_id="origin:b1")]
+            ))
+            time.sleep(0.6)
+            complement = client.complement(builds)
+            self.assertEqual(obj_cache.get_stats()["hits"], 0)
+            self.assertEqual(sorted(t["id"] for t in complement["tests"]),
+                             ["origin:t1", "origin:t3"])
+            # The refreshed children are trusted until they expire
+            self.assertEqual(client.complement(builds), complement)
+            self.assertEqual(obj_cache.get_stats()["hits"], 1)
+
+    def test_from_env(self):
+        """Check the cache is only enabled when configured"""
+        names = ("KCIDB_DB_CACHE_SIZE", "KCIDB_DB_CACHE_PATH",
+                 "KCIDB_DB_CACHE_TTL")
+        saved = {name: os.environ.pop(name, None) for name in names}
+        try:
+            self.assertIsNone(cache.ObjectCache.from_env())
+            os.environ["KCIDB_DB_CACHE_SIZE"] = "5"
+            os.environ["KCIDB_DB_CACHE_TTL"] = "7"
+            obj_cache = cache.ObjectCache.from_env()
+            self.assertEqual((obj_cache.max_size, obj_cache.ttl), (5, 7))
+        finally:
+            for name, value in saved.items():
+                os.environ.pop(name, None)
+                if value is not None:
+                    os.environ[name] = value
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """kcidb.db.cache.ResultCache test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.version = dict(major=io_schema.LATEST.major,
+                            minor=io_schema.LATEST.minor)
+        self.data = dict(version=self.version,
+                         revisions=[dict(id="origin:r1")])
+
+    def test_key(self):
+        """Check equivalent queries have the same key"""
+        get_key = cache.ResultCache.get_key
+        since = datetime(2020, 3, 2, tzinfo=timezone.utc)
+        self.assertEqual(
+            get_key("db", dict(revisions=["b", "a", "b"], builds=[]),
+                    True, False, since, None, None),
+            get_key("db", dict(revisions=["a", "b"]),
+                    True, False, since, None, {})
+        )
+        self.assertNotEqual(
+            get_key("db", dict(revisions=["a"]),
+                    True, False, None, None, None),
+            get_key("db", dict(revisions=["a"]),
+                    False, True, None, None, None)
+        )
+        self.assertNotEqual(
+            get_key("db", dict(revisions=["a"]),
+                    True, False, since, None, None),
+            get_key("db", dict(revisions=["a"]),
+                    True, False, None, since, None)
+        )
+        self.assertNotEqual(
+            get_key("db", dict(revisions=["a"]),
+                    True, False, None, None, None),
+            get_key("other", dict(revisions=["a"]),
+                    True, False, None, None, None)
+        )
+
+    def test_bounds(self):
+        """Check results expire, and their size is bounded"""
+        result_cache = cache.ResultCache(ttl=0.1, max_bytes=100)
+        result_cache.put("a", self.data)
+        self.assertEqual(result_cache.get("a"), self.data)
+        time.sleep(0.2)
+        self.assertIsNone(result_cache.get("a"))
+        result_cache = cache.ResultCache(max_bytes=len(json.dumps(self.data)))
+        result_cache.put("a", self.data)
+        result_cache.put("b", self.data)
+        self.assertIsNone(result_cache.get("a"))
+        self.assertEqual(result_cache.get("b"), self.data)
+        result_cache.invalidate("b")
+        self.assertIsNone(result_cache.get("b"))
+
+    def test_client(self):
+        """Check query results are cached, and invalidated by loading"""
+        client = Client("sqlite::memory:",
+                        result_cache=cache.ResultCache())
+        client.init()
+        client.load(self.data)
+        patterns = dict(revisions=["origin:%"])
+        self.assertEqual(len(client.query(patterns)["revisions"]), 1)
+        self.assertEqual(len(client.query(patterns)["revisions"]), 1)
+        self.assertEqual((client.result_cache.hits,
+                          client.result_cache.misses), (1, 1))
+        client.load(dict(version=self.version,
+                         revisions=[dict(id="origin:r2")]))
+        self.assertEqual(len(client.query(patterns)["revisions"]), 2)
+        # Clients of other databases sharing the cache don't get the results
+        other_client = Client("sqlite::memory:",
+                              result_cache=client.result_cache)
+        other_client.init()
+        self.assertEqual(other_client.query(patterns)["revisions"], [])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "kcidb.sqlite3")
+            self.assertEqual(Client("sqlite:" + path).database_id,
+                             Client(f"sqlite:{tmpdir}/./kcidb.sqlite3").
+                             database_id)
+
+
+@unittest.skipIf(importlib.util.find_spec("pyarrow") is None,
+                 "pyarrow is not installed")
+class ArrowTestCase(unittest.TestCase):
+    """kcidb.db.arrow test case"""
+
+    def test_schema(self):
+        """Check Arrow schemas follow table schemas"""
+        for table_name, table_schema in schema.TABLE_MAP.items():
+            arrow_schema = arrow.get_schema(table_name)
+            self.assertEqual(arrow_schema.names,
+                             [field.name for field in table_schema])
+        arrow_schema = arrow.get_schema("revisions")
+        self.assertEqual(str(arrow_schema.field("discovery_time").type),
+                         "timestamp[us, tz=UTC]")
+        self.assertEqual(str(arrow_schema.field("patch_mboxes").type),
+                         "list<item: struct<name: string, url: string>>")
+
+    def test_parquet(self):
+        """Check conformed batches are written to Parquet files"""
+        # pylint: disable=import-outside-toplevel
+        import pyarrow
+        import pyarrow.parquet
+        batch = pyarrow.RecordBatch.from_pydict({
+            "_ingestion_time": [datetime(2020, 1, 1, tzinfo=timezone.utc)],
+            "id": ["origin:1"],
+            "build_id": ["origin:1"],
+            "duration": [1.5],
+        })
+        batch = arrow.conform_batch("tests", batch)
+        self.assertEqual(batch.schema, arrow.get_schema("tests"))
+        with tempfile.TemporaryDirectory() as directory:
+            arrow.write_parquet(directory, [("tests", batch)])
+            self.assertEqual(sorted(os.listdir(directory)),
+                             sorted(name + ".parquet"
+                                    for name in schema.TABLE_MAP))
+            table = pyarrow.parquet.read_table(
+                os.path.join(directory, "tests.parquet")
+            )
+            self.assertEqual(table.num_rows, 1)
+            row = table.to_pylist()[0]
+            self.assertEqual(row["id"], "origin:1")
+            self.assertEqual(row["duration"], decimal.Decimal("1.5"))
+            self.assertIsNone(row["status"])
+            self.assertEqual(
+                pyarrow.parquet.read_table(
+                    os.path.join(directory, "builds.parquet")
+                ).num_rows,
+                0
+            )
@@ -0,0 +1,788 @@
+"""kcdib.mq module tests"""
+
+import io
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+import importlib.util
+import concurrent.futures
+from unittest import mock
+import jsonschema
+from google.cloud import pubsub
+from kcidb.io import schema
+from kcidb.mq import ENCODINGS, Publisher, Subscriber, AsyncPublisher, \
+    AsyncSubscriber, dedup, backend, dead_letter, dead_letter_replay_main
+
+
+def run_async(coroutine):
+    """
+    Run a coroutine to completion in a new event loop.
+
+    Args:
+        coroutine:  The coroutine to run.
+
+    Returns:
+        The coroutine's result.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class SplitDataTestCase(unittest.TestCase):
+    """kcidb.mq.Publisher.split_data() test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.version = dict(major=schema.LATEST.major,
+                            minor=schema.LATEST.minor)
+        # A huge synthetic report: revisions with builds with tests,
+        # plus orphan builds and tests
+        self.data = dict(
+            version=self.version,
+            revisions=[
+                dict(id=f"origin:r{r}", discovery_time="2020-03-02T10:00:00Z")
+                for r in range(5)
+            ],
+            builds=[
+                dict(id=f"origin:r{r}b{b}", revision_id=f"origin:r{r}",
+                     architecture="x86_64", log_url="https://x.org/" * 10)
+                for r in range(6) for b in range(20)
+            ],
+            tests=[
+                dict(id=f"origin:r{r}b{b}t{t}",
+                     build_id=f"origin:r{r}b{b}",
+                     path=f"ltp.test{t}", status="PASS",
+                     misc=dict(output="x" * (t % 7 * 100)))
+                for r in range(6) for b in range(21) for t in range(20)
+            ],
+        )
+
+    @staticmethod
+    def get_ids(data):
+        """Get a dictionary of object list names and sorted object IDs"""
+        return {
+            obj_list_name: sorted(obj["id"] for obj in data[obj_list_name])
+            for obj_list_name in schema.LATEST.tree
+            if data.get(obj_list_name)
+        }
+
+    def test_fits(self):
+        """Check data fitting into the limit is not split"""
+        size = len(Publisher.encode_data(self.data))
+        self.assertEqual(Publisher.split_data(self.data, size), [self.data])
+
+    def test_split(self):
+        """Check huge data is split into valid pieces within the limit"""
+        max_size = 64 * 1024
+        pieces = Publisher.split_data(self.data, max_size)
+        self.assertGreater(len(pieces), 10)
+        merged = dict(version=self.version)
+        piece_map = {}
+        for index, piece in enumerate(pieces):
+            self.assertTrue(schema.is_valid_latest(piece))
+            self.assertEqual(piece["version"], self.version)
+            self.assertLessEqual(len(Publisher.encode_data(piece)), max_size)
+            for obj_list_name, obj_list in piece.items():
+                if obj_list_name != "version":
+                    merged.setdefault(obj_list_name, []).extend(obj_list)
+                    for obj in obj_list:
+                        piece_map[obj["id"]] = index
+        # Nothing is lost or duplicated
+        for obj_list_name in ("revisions", "builds", "tests"):
+            self.assertEqual(len(merged[obj_list_name]),
+                             len(self.data[obj_list_name]))
+        self.assertEqual(self.get_ids(merged), self.get_ids(self.data))
+        # Builds travel with (at least some of) their tests
+        for build in self.data["builds"]:
+            self.assertEqual(piece_map[build["id"]],
+                             piece_map[build["id"] + "t0"])
+        # Splitting is deterministic
+        self.assertEqual(Publisher.split_data(self.data, max_size), pieces)
+
+    def test_oversized_object(self):
+        """Check objects larger than the limit are rejected"""
+        data = dict(version=self.version,
+                    revisions=[dict(id="origin:r", misc=dict(x="x" * 1000))])
+        with self.assertRaises(Exception):
+            Publisher.split_data(data, 500)
+
+
+class EncodingTestCase(unittest.TestCase):
+    """kcidb.mq message data encoding test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.data = dict(
+            version=dict(major=schema.LATEST.major,
+                         minor=schema.LATEST.minor),
+            builds=[
+                dict(id=f"origin:{b}", revision_id="origin:r",
+                     valid=True, duration=b / 2, misc=dict(n=None))
+                for b in range(100)
+            ],
+        )
+
+    def test_round_trip(self):
+        """Check data survives encoding and decoding"""
+        for encoding in ENCODINGS:
+            if encoding.startswith("msgpack") and \
+               not importlib.util.find_spec("msgpack"):
+                continue
+            message_data = Publisher.encode_data(self.data, encoding)
+            self.assertEqual(Subscriber.decode_data(message_data, encoding),
+                             self.data)
+
+    def test_compat(self):
+        """Check plain JSON is the default, and compression helps"""
+        message_data = Publisher.encode_data(self.data)
+        self.assertEqual(Subscriber.decode_data(message_data), self.data)
+        self.assertEqual(Subscriber.decode_data(message_data, "json"),
+                         self.data)
+        self.assertLess(
+            len(Publisher.encode_data(self.data, "json+zlib")) * 5,
+            len(message_data)
+        )
+
+
+class AttributesTestCase(unittest.TestCase):
+    """kcidb.mq.Publisher.get_attributes() test case"""
+
+    def test_summary(self):
+        """Check data is summarized in attributes"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        attributes = Publisher.get_attributes(dict(
+            version=version,
+            builds=[dict(id="redhat:1", revision_id="google:r1"),
+                    dict(id="redhat:2", revision_id="google:r2")],
+            tests=[dict(id="some_origin:1", build_id="redhat:1")],
+        ))
+        self.assertEqual(
+            {k: v for k, v in attributes.items() if k != "revisions_digest"},
+            dict(schema_version=f"{version['major']}.{version['minor']}",
+                 revisions_count="0", builds_count="2", tests_count="1",
+                 origins="google,redhat,some_origin",
+                 origin_google="", origin_redhat="", origin_some_origin="")
+        )
+        self.assertEqual(
+            attributes["revisions_digest"],
+            Publisher.get_attributes(dict(
+                version=version,
+                revisions=[dict(id="google:r2"), dict(id="google:r1")],
+            ))["revisions_digest"]
+        )
+        # Too many origins don't get separate attributes
+        attributes = Publisher.get_attributes(dict(
+            version=version,
+            revisions=[dict(id=f"o{i}:r") for i in range(100)]
+        ))
+        self.assertEqual(len(attributes["origins"].split(",")), 100)
+        self.assertNotIn("origin_o1", attributes)
+
+
+class DedupTestCase(unittest.TestCase):
+    """kcidb.mq fingerprinting and deduplication test case"""
+
+    def test_fingerprint(self):
+        """Check fingerprints only depend on the content"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        fingerprint = Publisher.get_fingerprint(dict(
+            version=version,
+            builds=[dict(id="origin:1", revision_id="origin:r", valid=True)]
+        ))
+        self.assertEqual(fingerprint, Publisher.get_fingerprint(dict(
+            builds=[dict(valid=True, revision_id="origin:r", id="origin:1")],
+            version=version
+        )))
+        self.assertNotEqual(fingerprint, Publisher.get_fingerprint(dict(
+            version=version,
+            builds=[dict(id="origin:1", revision_id="origin:r", valid=False)]
+        )))
+
+    def test_stores(self):
+        """Check fingerprint stores remember processed messages"""
+        for store in (dedup.MemoryStore(max_size=2),
+                      dedup.SQLiteStore(":memory:")):
+            self.assertFalse(store.is_processed("a"))
+            store.mark_processed("a")
+            store.mark_processed("b")
+            self.assertTrue(store.is_processed("b"))
+            self.assertTrue(store.is_processed("a"))
+        # The in-memory store forgets the least recently used
+        store = dedup.MemoryStore(max_size=2)
+        store.mark_processed("a")
+        store.mark_processed("b")
+        store.is_processed("a")
+        store.mark_processed("c")
+        self.assertTrue(store.is_processed("a"))
+        self.assertFalse(store.is_processed("b"))
+        # The SQLite store forgets expired messages
+        store = dedup.SQLiteStore(":memory:", ttl=0.01)
+        store.mark_processed("a")
+        time.sleep(0.02)
+        self.assertFalse(store.is_processed("a"))
+
+
+class PublisherTestCase(unittest.TestCase):
+    """kcidb.mq.Publisher publishing test case"""
+
+    # pylint: disable=too-few-public-methods
+    class Client:
+        """A publisher client completing publishing immediately"""
+
+        def __init__(self):
+            """Initialize the client"""
+            self.messages = []
+
+        def publish(self, topic_path, message_data, **attributes):
+            """Publish a message, failing if it's marked so"""
+            future = concurrent.futures.Future()
+            if attributes["builds_count"] == "0":
+                future.set_exception(Exception("No builds"))
+            else:
+                self.messages.append((topic_path, message_data, attributes))
+                future.set_result(str(len(self.messages)))
+            return future
+
+    @staticmethod
+    def get_publisher(publisher_class):
+        """Create a publisher of the class, with a stub client"""
+        publisher = publisher_class.__new__(publisher_class)
+        publisher.client = PublisherTestCase.Client()
+        publisher.topic_path = "topic"
+        publisher.encoding = "json"
+        publisher.futures = []
+        publisher.futures_lock = threading.Lock()
+        return publisher
+
+    def test_publish(self):
+        """Check publish() only reports its own data"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        publisher = PublisherTestCase.get_publisher(Publisher)
+        data = dict(version=version,
+                    builds=[dict(id="origin:1", revision_id="origin:r")])
+        # Another caller's pending failure doesn't fail publish()
+        futures = publisher.publish_many([dict(version=version)])
+        self.assertEqual(len(futures), 1)
+        self.assertEqual(publisher.publish(data), ["1"])
+        # And publish() doesn't take another caller's results
+        results = publisher.flush()
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], Exception)
+        publisher.publish_many([data])
+        with self.assertRaises(Exception):
+            publisher.publish(dict(version=version))
+        self.assertEqual(publisher.flush(), ["2"])
+
+    def test_validate_once(self):
+        """Check published data is only validated once"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        publisher = PublisherTestCase.get_publisher(Publisher)
+        data = dict(version=version,
+                    builds=[dict(id="origin:1", revision_id="origin:r")])
+        with mock.patch("jsonschema.validate",
+                        wraps=jsonschema.validate) as validate:
+            self.assertEqual(publisher.publish(data), ["1"])
+        self.assertEqual(validate.call_count, 1)
+        topic_path, message_data, attributes = publisher.client.messages[0]
+        self.assertEqual(topic_path, "topic")
+        self.assertEqual(message_data, Publisher.encode_data(data))
+        self.assertEqual(attributes["fingerprint"],
+                         Publisher.get_fingerprint(data))
+        self.assertEqual(attributes["builds_count"], "1")
+
+
+class SubscriberClientTestCase(unittest.TestCase):
+    """kcidb.mq.Subscriber test case with a Pub/Sub client"""
+
+    def setUp(self):
+        """Setup tests"""
+        self.subscriber = Subscriber("project", "topic", "sub",
+                                     lease_extension=None)
+        # Check calls against the signatures of the installed client
+        # pylint: disable=protected-access
+        self.subscriber._client = \
+            mock.create_autospec(pubsub.SubscriberClient, instance=True)
+
+    def test_requests(self):
+        """Check subscriptions are set up, pulled and acked with requests"""
+        client = self.subscriber.client
+        subscription_path = "projects/project/subscriptions/sub"
+        self.subscriber.init()
+        self.subscriber.init(filter_expr="attributes:builds_count")
+        self.assertEqual(client.create_subscription.call_args_list, [
+            mock.call(request=dict(name=subscription_path,
+                                   topic="projects/project/topics/topic")),
+            mock.call(request=dict(name=subscription_path,
+                                   topic="projects/project/topics/topic",
+                                   filter="attributes:builds_count")),
+        ])
+        data = dict(version=dict(major=schema.LATEST.major,
+                                 minor=schema.LATEST.minor))
+        message_data = Publisher.encode_data(data)
+        client.pull.return_value = backend.PullResponse([
+            backend.ReceivedMessage(
+                str(i), backend.Message(message_data, {}, str(i)), 1
+            )
+            for i in range(3)
+        ])
+        items = self.subscriber.pull(max_messages=3)
+        self.assertEqual(items, [(str(i), data) for i in range(3)])
+        client.pull.assert_called_once_with(
+            request=dict(subscription=subscription_path, max_messages=3),
+            timeout=300
+        )
+        with mock.patch.object(Subscriber, "_MAX_ACK_IDS", 2):
+            self.subscriber.ack(*(ack_id for ack_id, _ in items))
+        self.assertEqual(client.acknowledge.call_args_list, [
+            mock.call(request=dict(subscription=subscription_path,
+                                   ack_ids=ack_ids))
+            for ack_ids in (["0", "1"], ["2"])
+        ])
+        self.subscriber.cleanup()
+        client.delete_subscription.assert_called_once_with(
+            request=dict(subscription=subscription_path)
+        )
+
+    def test_modify_ack_deadline(self):
+        """Check message deadlines are modified with requests"""
+        client = self.subscriber.client
+        with mock.patch.object(Subscriber, "_MAX_ACK_IDS", 2):
+            self.subscriber.nack("a", "b", "c")
+        self.assertEqual(client.modify_ack_deadline.call_args_list, [
+            mock.call(request=dict(
+                subscription="projects/project/subscriptions/sub",
+                ack_ids=ack_ids, ack_deadline_seconds=0
+            ))
+            for ack_ids in (["a", "b"], ["c"])
+        ])
+
+
+class AsyncPublisherTestCase(unittest.TestCase):
+    """kcidb.mq.AsyncPublisher test case"""
+
+    def test_publish(self):
+        """Check data is published and flushed asynchronously"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        publisher = PublisherTestCase.get_publisher(AsyncPublisher)
+        data = dict(version=version,
+                    builds=[dict(id="origin:1", revision_id="origin:r")])
+
+        async def run():
+            self.assertEqual(await publisher.publish(data), ["1"])
+            self.assertEqual(
+                len(await publisher.publish_many([data,
+                                                  dict(version=version)])),
+                2
+            )
+            results = await publisher.flush()
+            self.assertEqual(results[0], "2")
+            self.assertIsInstance(results[1], Exception)
+            with self.assertRaises(Exception):
+                await publisher.publish(dict(version=version))
+
+        run_async(run())
+        self.assertEqual(
+            Subscriber.decode_data(publisher.client.messages[0][1]), data
+        )
+
+
+class BackendTestCase(unittest.TestCase):
+    """kcidb.mq.backend test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        self.data_list = [
+            dict(version=version,
+                 builds=[dict(id=f"origin:{b}", revision_id="origin:r")])
+            for b in range(5)
+        ]
+        # pylint: disable=consider-using-with
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """Cleanup tests"""
+        self.tmpdir.cleanup()
+
+    def get_backends(self, **kwargs):
+        """Get a list of fresh backends of each type"""
+        return [backend.MemoryBackend(**kwargs),
+                backend.FileBackend(self.tmpdir.name, segment_size=200,
+                                    **kwargs)]
+
+    def test_at_least_once(self):
+        """Check messages are delivered until acknowledged"""
+        for local in self.get_backends():
+            publisher = Publisher(None, "topic", backend=local)
+            publisher.init()
+            subscriber = Subscriber(None, "topic", "sub", backend=local)
+            subscriber.init()
+            publisher.publish_many(self.data_list)
+            self.assertEqual(len(publisher.flush()), 5)
+            items = subscriber.pull(max_messages=3)
+            self.assertEqual([data for _, data in items],
+                             self.data_list[:3])
+            subscriber.ack(items[1][0])
+            # Negatively acknowledged messages are delivered first
+            local.modify_ack_deadline("sub", [items[2][0]], 0)
+            items = subscriber.pull(max_messages=10)
+            self.assertEqual([data for _, data in items],
+                             self.data_list[2:])
+            subscriber.ack(*(ack_id for ack_id, _ in items))
+            # Messages with expired leases are delivered again
+            local.ack_deadline = 0.1
+            local.modify_ack_deadline("sub", ["0"], 0.1)
+            self.assertEqual(local.pull("sub", 10, timeout=0).
+                             received_messages, [])
+            time.sleep(0.2)
+            received_messages = local.pull("sub", 10).received_messages
+            self.assertEqual(len(received_messages), 1)
+            self.assertEqual(received_messages[0].ack_id, "0")
+            self.assertEqual(received_messages[0].delivery_attempt, 2)
+            subscriber.cleanup()
+            publisher.cleanup()
+
+    def test_durability(self):
+        """Check file backend messages and offsets survive reopening"""
+        local = backend.FileBackend(self.tmpdir.name, segment_size=200)
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        subscriber = Subscriber(None, "topic", "sub", backend=local)
+        subscriber.init()
+        publisher.publish_many(self.data_list)
+        publisher.flush()
+        self.assertGreater(
+            len(os.listdir(os.path.join(self.tmpdir.name, "topics", "topic"))),
+            1
+        )
+        items = subscriber.pull(max_messages=3)
+        subscriber.ack(items[0][0], items[2][0])
+        # Reopen, leaving an incomplete record at the end
+        local = backend.FileBackend(self.tmpdir.name, segment_size=200)
+        segment_path = os.path.join(
+            self.tmpdir.name, "topics", "topic",
+            sorted(os.listdir(os.path.join(self.tmpdir.name,
+                                           "topics", "topic")))[-1]
+        )
+        with open(segment_path, "ab") as file:
+            file.write(b"\1\0")
+        subscriber = Subscriber(None, "topic", "sub", backend=local)
+        items = subscriber.pull(max_messages=10)
+        self.assertEqual([data for _, data in items],
+                         [self.data_list[1]] + self.data_list[3:])
+        subscriber.ack(*(ack_id for ack_id, _ in items))
+        Publisher(None, "topic", backend=local).publish(self.data_list[0])
+        self.assertEqual([data for _, data in subscriber.pull()],
+                         self.data_list[:1])
+
+    def test_subscribe(self):
+        """Check messages are received by streaming pull"""
+        for local in self.get_backends():
+            publisher = Publisher(None, "topic", backend=local)
+            publisher.init()
+            subscriber = Subscriber(None, "topic", "sub", backend=local)
+            subscriber.init()
+            received = []
+            failed = []
+
+            def callback(data):
+                """Receive the data, failing the first time"""
+                # pylint: disable=cell-var-from-loop
+                if not failed:
+                    failed.append(data)
+                    raise Exception("Failed")
+                received.append(data)
+
+            future = subscriber.subscribe(callback, concurrency=1)
+            publisher.publish_many(self.data_list)
+            publisher.flush()
+            deadline = time.monotonic() + 10
+            while len(received) < len(self.data_list) and \
+                    time.monotonic() < deadline:
+                time.sleep(0.01)
+            future.cancel()
+            future.result()
+            self.assertEqual(received, self.data_list)
+
+    def test_lease(self):
+        """Check pulled messages are leased until (n)acked or expired"""
+        local = backend.MemoryBackend(ack_deadline=0.3)
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        subscriber = Subscriber(None, "topic", "sub", backend=local,
+                                lease_extension=0.4, max_lease=2)
+        subscriber.init()
+        publisher.publish_many(self.data_list[:3])
+        publisher.flush()
+        items = subscriber.pull(max_messages=3)
+        time.sleep(1)
+        self.assertEqual(local.pull("sub", 10, timeout=0).received_messages,
+                         [])
+        # Rejected messages are released right away
+        subscriber.nack(items[0][0])
+        self.assertEqual(
+            [m.ack_id for m in local.pull("sub", 10).received_messages],
+            [items[0][0]]
+        )
+        local.acknowledge("sub", [items[0][0]])
+        subscriber.ack(items[1][0])
+        # Messages leased for too long are released
+        time.sleep(2)
+        self.assertEqual(
+            [m.ack_id for m in local.pull("sub", 10).received_messages],
+            [items[2][0]]
+        )
+        self.assertIsNone(subscriber.lease_thread)
+
+    def test_batches(self):
+        """Check messages are pulled and (n)acked in limited batches"""
+        local = backend.MemoryBackend()
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        subscriber = Subscriber(None, "topic", "sub", backend=local)
+        subscriber.init()
+        publisher.publish_many(self.data_list)
+        publisher.flush()
+        with mock.patch.object(Subscriber, "_MAX_ACK_IDS", 2), \
+                mock.patch.object(local, "acknowledge",
+                                  wraps=local.acknowledge) as acknowledge, \
+                mock.patch.object(local, "modify_ack_deadline",
+                                  wraps=local.modify_ack_deadline) \
+                as modify_ack_deadline:
+            # Pulls return at most the requested number of messages
+            items = subscriber.pull(max_messages=3)
+            self.assertEqual([ack_id for ack_id, _ in items],
+                             ["0", "1", "2"])
+            self.assertEqual(set(subscriber.messages), {"0", "1", "2"})
+            subscriber.nack(*(ack_id for ack_id, _ in items))
+            self.assertEqual(subscriber.messages, {})
+            items = subscriber.pull(max_messages=10)
+            self.assertEqual([data for _, data in items], self.data_list)
+            # Requests are split into chunks of limited size
+            self.assertEqual(
+                [(len(call[1]["request"]["ack_ids"]),
+                  call[1]["request"]["ack_deadline_seconds"])
+                 for call in modify_ack_deadline.call_args_list],
+                [(2, 60), (1, 60), (2, 0), (1, 0),
+                 (2, 60), (2, 60), (1, 60)]
+            )
+            subscriber.ack(*(ack_id for ack_id, _ in items))
+            self.assertEqual([call[1]["request"]["ack_ids"]
+                              for call in acknowledge.call_args_list],
+                             [["0", "1"], ["2", "3"], ["4"]])
+        self.assertEqual(subscriber.leases, {})
+        self.assertEqual(subscriber.messages, {})
+        self.assertEqual(local.pull("sub", 10, timeout=0).received_messages,
+                         [])
+
+    def test_subscribe_dead_letter(self):
+        """Check streamed messages failing too many times are dead-lettered"""
+        local = backend.MemoryBackend()
+        sink = dead_letter.DirSink(self.tmpdir.name)
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        subscriber = Subscriber(None, "topic", "sub", backend=local,
+                                dead_letter_sink=sink, max_attempts=2)
+        subscriber.init()
+        received = []
+
+        def callback(data):
+            """Receive the data, failing for the first build"""
+            if data == self.data_list[0]:
+                raise Exception("Failed")
+            received.append(data)
+
+        future = subscriber.subscribe(callback, concurrency=2)
+        local.publish("topic", b"{", encoding="json")
+        publisher.publish_many(self.data_list)
+        publisher.flush()
+        deadline = time.monotonic() + 10
+        while (len(received) < len(self.data_list) - 1 or
+               len(sink.get_paths()) < 2) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        future.cancel()
+        future.result()
+        self.assertEqual(sorted(data["builds"][0]["id"] for data in received),
+                         [data["builds"][0]["id"]
+                          for data in self.data_list[1:]])
+        entries = [dead_letter.DirSink.load(path)
+                   for path in sink.get_paths()]
+        self.assertEqual(sorted(entry["error"].split("(")[0]
+                                for _, entry in entries),
+                         ["Exception", "JSONDecodeError"])
+        self.assertEqual([entry["attempts"] for _, entry in entries],
+                         [2, 2])
+        # Everything was acknowledged
+        self.assertEqual(local.pull("sub", 10, timeout=0).received_messages,
+                         [])
+
+
+class DeadLetterTestCase(unittest.TestCase):
+    """kcidb.mq dead-letter routing test case"""
+
+    def setUp(self):
+        """Setup tests"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        self.data = dict(version=version,
+                         builds=[dict(id="origin:1", revision_id="origin:r")])
+        # pylint: disable=consider-using-with
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """Cleanup tests"""
+        self.tmpdir.cleanup()
+
+    def test_backoff(self):
+        """Check retries are backed off exponentially"""
+        self.assertEqual([dead_letter.get_backoff(attempt, 10, 600)
+                          for attempt in range(1, 9)],
+                         [10, 20, 40, 80, 160, 320, 600, 600])
+
+    def test_dead_letter(self):
+        """Check messages failing too many times are dead-lettered"""
+        local = backend.MemoryBackend()
+        sink = dead_letter.DirSink(self.tmpdir.name)
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        subscriber = Subscriber(None, "topic", "sub", backend=local,
+                                dead_letter_sink=sink, max_attempts=2,
+                                min_backoff=0, max_backoff=0)
+        subscriber.init()
+        local.publish("topic", b"{", encoding="json")
+        publisher.publish(self.data)
+        # Malformed messages are skipped and retried
+        items = subscriber.pull(max_messages=10)
+        self.assertEqual([data for _, data in items], [self.data])
+        self.assertEqual(sink.get_paths(), [])
+        # Failing messages are retried, until attempts run out
+        self.assertFalse(subscriber.fail(items[0][0], "Failed"))
+        items = subscriber.pull(max_messages=10)
+        self.assertEqual([data for _, data in items], [self.data])
+        self.assertTrue(subscriber.fail(items[0][0], Exception("Failed")))
+        paths = sink.get_paths()
+        self.assertEqual(len(paths), 2)
+        data, entry = dead_letter.DirSink.load(paths[0])
+        self.assertEqual(data, b"{")
+        self.assertEqual(entry["attributes"], dict(encoding="json"))
+        self.assertEqual(entry["attempts"], 2)
+        self.assertIn("JSONDecodeError", entry["error"])
+        data, entry = dead_letter.DirSink.load(paths[1])
+        self.assertEqual(Subscriber.decode_data(data), self.data)
+        self.assertEqual(entry["error"], "Exception('Failed')")
+        # Nothing is left to deliver
+        self.assertEqual(
+            local.pull("sub", 10, timeout=0).received_messages, []
+        )
+
+    def test_replay(self):
+        """Check dead letters are replayed from a Pub/Sub subscription"""
+        client = mock.create_autospec(pubsub.SubscriberClient, instance=True)
+        client.pull.return_value = backend.PullResponse([
+            backend.ReceivedMessage(
+                "0", backend.Message(b"{}", {
+                    "encoding": "json",
+                    dead_letter.ERROR_ATTRIBUTE: "Failed",
+                    dead_letter.ATTEMPTS_ATTRIBUTE: "5",
+                }, "0"), 1
+            )
+        ])
+        argv = ["kcidb-mq-dead-letter-replay", "-p", "project",
+                "-t", "topic", "-s", "dead", "-m", "10"]
+        with mock.patch("sys.argv", argv), \
+                mock.patch("kcidb.mq.pubsub.PublisherClient",
+                           autospec=True) as publisher_client_class, \
+                mock.patch.object(Subscriber, "client", client), \
+                mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            publisher_client = publisher_client_class.return_value
+            publisher_client.topic_path.return_value = "topic_path"
+            dead_letter_replay_main()
+        client.pull.assert_called_once_with(
+            request=dict(subscription="projects/project/subscriptions/dead",
+                         max_messages=10),
+            timeout=60
+        )
+        publisher_client.publish.assert_called_once_with(
+            "topic_path", b"{}", encoding="json"
+        )
+        client.acknowledge.assert_called_once_with(request=dict(
+            subscription="projects/project/subscriptions/dead",
+            ack_ids=["0"]
+        ))
+        self.assertEqual(stderr.getvalue(), "Replayed 1 message(s)\n")
+
+
+class AsyncSubscriberTestCase(unittest.TestCase):
+    """kcidb.mq.AsyncSubscriber test case"""
+
+    class Client:
+        """An asynchronous subscriber client stub over a local backend"""
+
+        def __init__(self, local):
+            """Initialize the client"""
+            self.local = local
+
+        def get_path(self, request):
+            """Get the local path of the subscription in a request"""
+            return self.local.subscription_path(
+                None, request["subscription"].rsplit("/", 1)[-1]
+            )
+
+        async def pull(self, request, timeout):
+            """Pull messages"""
+            return self.local.pull(self.get_path(request),
+                                   request["max_messages"], timeout=timeout)
+
+        async def acknowledge(self, request):
+            """Acknowledge messages"""
+            self.local.acknowledge(self.get_path(request), request["ack_ids"])
+
+        async def modify_ack_deadline(self, request):
+            """Modify the acknowledgement deadline of messages"""
+            self.local.modify_ack_deadline(self.get_path(request),
+                                           request["ack_ids"],
+                                           request["ack_deadline_seconds"])
+
+    def test_pull(self):
+        """Check data is pulled, rejected and dead-lettered asynchronously"""
+        version = dict(major=schema.LATEST.major, minor=schema.LATEST.minor)
+        data = dict(version=version,
+                    builds=[dict(id="origin:1", revision_id="origin:r")])
+        local = backend.MemoryBackend()
+        publisher = Publisher(None, "topic", backend=local)
+        publisher.init()
+        Subscriber(None, "topic", "sub", backend=local).init()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sink = dead_letter.DirSink(tmpdir)
+            subscriber = AsyncSubscriber(None, "topic", "sub",
+                                         dead_letter_sink=sink,
+                                         max_attempts=2,
+                                         min_backoff=0, max_backoff=0)
+            subscriber.async_client = AsyncSubscriberTestCase.Client(local)
+            local.publish("topic", b"{", encoding="json")
+            publisher.publish(data)
+
+            async def run():
+                # Malformed messages are skipped and retried
+                items = await subscriber.pull(max_messages=10)
+                self.assertEqual([item[1] for item in items], [data])
+                await subscriber.nack(items[0][0])
+                items = await subscriber.pull(max_messages=10)
+                self.assertEqual([item[1] for item in items], [data])
+                self.assertTrue(await subscriber.fail(items[0][0], "Failed"))
+
+            run_async(run())
+            self.assertEqual(len(sink.get_paths()), 2)
+        self.assertEqual(
+            local.pull("sub", 10, timeout=0).received_messages, []
+        )
+        with self.assertRaises(NotImplementedError):
+            subscriber.subscribe(print)
+        # No synchronous client was needed
+        # pylint: disable=protected-access
+        self.assertIsNone(subscriber._client)
@@ -4,6 +4,8 @@ import os
 import base64
 # import smtplib
 import kcidb
+import kcidb.mq.dedup
+import kcidb.mq.dead_letter
 
 PROJECT_ID = os.environ["GCP_PROJECT"]
 DATASET = os.environ["KCIDB_DATASET"]
@@ -11,35 +13,102 @@ SMTP_HOST = os.environ.get("KCIDB_SMTP_HOST", "")
 SMTP_TO_ADDRS = os.environ.get("KCIDB_SMTP_TO_ADDRS", None)
 MQ_LOADED_TOPIC = os.environ["KCIDB_MQ_LOADED_TOPIC"]
 
-DB_CLIENT = kcidb.db.Client(DATASET)
+# Off unless configured, as the cache doesn't see loads by other instances
+DB_CACHE = kcidb.db.cache.ObjectCache.from_env()
+DB_CLIENT = kcidb.db.Client(DATASET, obj_cache=DB_CACHE)
 SPOOL_CLIENT = kcidb.spool.Client()
 MQ_LOADED_PUBLISHER = kcidb.mq.Publisher(PROJECT_ID, MQ_LOADED_TOPIC)
+MQ_DEDUP_STORE = kcidb.mq.dedup.from_env()
+# The sink for messages failing to process too many times, or None to leave
+# them to the subscriptions. Failed messages are redelivered with the
+# backoff of the subscriptions' retry policies, and are moved to their
+# dead-letter topics after their maximum delivery attempts, if the
+# subscriptions have dead-letter policies. Only the subscriptions count
+# the attempts, as each delivery can reach a different instance.
+MQ_DEAD_LETTER_SINK = kcidb.mq.dead_letter.from_env(
+    lambda topic_name: kcidb.mq.Publisher(PROJECT_ID, topic_name)
+)
+MQ_MAX_ATTEMPTS = int(os.environ.get("KCIDB_MQ_MAX_ATTEMPTS", "5"))
+
+
+def process_event(function, event, context):
+    """
+    Process a Pub Sub event with a function, moving its message to the
+    dead-letter sink (if configured) instead of failing, after too many
+    failed delivery attempts, as counted by the subscription's dead-letter
+    policy. Failures of messages arriving without the delivery attempt
+    number are left to the subscription.
+    """
+    try:
+        function(event)
+    except Exception as exc:  # pylint: disable=broad-except
+        attempts = event.get("deliveryAttempt")
+        if MQ_DEAD_LETTER_SINK is None or attempts is None or \
+           int(attempts) < MQ_MAX_ATTEMPTS:
+            raise
+        print("DEAD LETTER:", context.event_id, repr(exc))
+        MQ_DEAD_LETTER_SINK.put(base64.b64decode(event["data"]),
+                                event.get("attributes") or {},
+                                repr(exc), int(attempts))
 
 
-# pylint: disable=unused-argument
 def kcidb_load(event, context):
     """
     Load KCIDB data from a Pub Sub subscription into the dataset
     """
+    process_event(load, event, context)
+
+
+def load(event):
+    """
+    Load KCIDB data from a Pub Sub event into the dataset
+    """
+    attributes = event.get("attributes") or {}
     # Get new data
-    io_new = kcidb.mq.Subscriber.decode_data(base64.b64decode(event["data"]))
+    io_new = kcidb.mq.Subscriber.decode_data(
+        base64.b64decode(event["data"]),
+        attributes.get("encoding")
+    )
+    # Skip data we already loaded (redelivered, or resubmitted), going by
+    # the fingerprint of the data itself, as the submitted one could be
+    # reused for different data, and suppress loading it
+    fingerprint = kcidb.mq.Publisher.get_fingerprint(io_new)
+    if attributes.get("fingerprint", fingerprint) != fingerprint:
+        print("FINGERPRINT MISMATCH:", attributes["fingerprint"], fingerprint)
+    if MQ_DEDUP_STORE.is_processed(fingerprint):
+        print("SKIPPING DUPLICATE:", fingerprint)
+        return
     # Store it in the database
     DB_CLIENT.load(io_new)
     # Forward the data to the "loaded" MQ topic
     MQ_LOADED_PUBLISHER.publish(io_new)
+    MQ_DEDUP_STORE.mark_processed(fingerprint)
 
 
 def kcidb_spool_notifications(event, context):
     """
     Spool notifications about KCIDB data arriving from a Pub Sub subscription
     """
+    process_event(spool_notifications, event, context)
+
+
+def spool_notifications(event):
+    """
+    Spool notifications about KCIDB data arriving in a Pub Sub event
+    """
     # Get loaded data
     io_loaded = kcidb.mq.Subscriber.decode_data(
-        base64.b64decode(event["data"])
+        base64.b64decode(event["data"]),
+        (event.get("attributes") or {}).get("encoding")
     )
+    # Update the cache with the data loaded by another instance
+    if DB_CACHE is not None:
+        DB_CACHE.update(io_loaded)
     # Load the complement: the loaded data along with all the linked
     # parents and children
     io_complement = DB_CLIENT.complement(io_loaded)
+    if DB_CACHE is not None:
+        print("DB CACHE STATS:", DB_CACHE.get_stats())
     # Convert loaded and complemented data to object-oriented representation
     oo_loaded = kcidb.oo.from_io(io_loaded)
     oo_complement = kcidb.oo.from_io(io_complement)
@@ -54,6 +123,7 @@ def kcidb_spool_notifications(event, context):
         SPOOL_CLIENT.put(notification)
 
 
+# pylint: disable=unused-argument
 def kcidb_send_notification(data, context):
     """
     Send notifications from the spool
@@ -47,6 +47,12 @@ setuptools.setup(
         "jinja2",
     ],
     extras_require=dict(
+        arrow=[
+            "pyarrow",
+        ],
+        msgpack=[
+            "msgpack",
+        ],
         dev=[
             "flake8",
             "pylint",
@@ -65,13 +71,18 @@ setuptools.setup(
             "kcidb-describe = kcidb:describe_main",
             "kcidb-db-init = kcidb.db:init_main",
             "kcidb-db-cleanup = kcidb.db:cleanup_main",
+            "kcidb-db-compact = kcidb.db:compact_main",
             "kcidb-db-load = kcidb.db:load_main",
             "kcidb-db-dump = kcidb.db:dump_main",
             "kcidb-db-query = kcidb.db:query_main",
             "kcidb-db-complement = kcidb.db:complement_main",
+            "kcidb-db-stats = kcidb.db:stats_main",
             "kcidb-mq-publisher-init = kcidb.mq:publisher_init_main",
             "kcidb-mq-publisher-cleanup = kcidb.mq:publisher_cleanup_main",
             "kcidb-mq-publisher-publish = kcidb.mq:publisher_publish_main",
+            "kcidb-mq-encoding-bench = kcidb.mq:encoding_bench_main",
+            "kcidb-mq-bench = kcidb.mq:bench_main",
+            "kcidb-mq-dead-letter-replay = kcidb.mq:dead_letter_replay_main",
             "kcidb-mq-subscriber-init = kcidb.mq:subscriber_init_main",
             "kcidb-mq-subscriber-cleanup = kcidb.mq:subscriber_cleanup_main",
             "kcidb-mq-subscriber-pull = kcidb.mq:subscriber_pull_main",